@@ -0,0 +1,143 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from .models import Cuisine, Rating, Recipe
+
+
+def apply_rating_delta(recipe_id, cuisine_id, count_delta, sum_delta):
+    """
+    Shift the denormalized rating totals of a recipe and its cuisine by the
+    given deltas. Uses F() expressions so concurrent writers never lose an
+    update.
+    """
+    if not count_delta and not sum_delta:
+        return
+    Recipe.objects.filter(pk=recipe_id).update(
+        rating_count=F('rating_count') + count_delta,
+        rating_sum=F('rating_sum') + sum_delta,
+    )
+    if cuisine_id:
+        Cuisine.objects.filter(pk=cuisine_id).update(
+            rating_count=F('rating_count') + count_delta,
+            rating_sum=F('rating_sum') + sum_delta,
+        )
+
+
+def apply_rating_deltas(deltas):
+    """
+    Batch form of ``apply_rating_delta``: ``deltas`` maps recipe id to
+    ``(cuisine_id, count_delta, sum_delta)``. Recipes and cuisines are each
+    updated with a single UPDATE, whatever the number of entries.
+    """
+    deltas = {recipe_id: delta for recipe_id, delta in deltas.items() if delta[1] or delta[2]}
+    if not deltas:
+        return
+
+    cuisine_deltas = {}
+    for cuisine_id, count_delta, sum_delta in deltas.values():
+        if cuisine_id:
+            count, total = cuisine_deltas.get(cuisine_id, (0, 0))
+            cuisine_deltas[cuisine_id] = (count + count_delta, total + sum_delta)
+
+    def shift(rows, index):
+        return Case(
+            *[When(pk=pk, then=Value(delta[index])) for pk, delta in rows.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    recipe_rows = {recipe_id: (count, total) for recipe_id, (_, count, total) in deltas.items()}
+    Recipe.objects.filter(pk__in=recipe_rows).update(
+        rating_count=F('rating_count') + shift(recipe_rows, 0),
+        rating_sum=F('rating_sum') + shift(recipe_rows, 1),
+    )
+    if cuisine_deltas:
+        Cuisine.objects.filter(pk__in=cuisine_deltas).update(
+            rating_count=F('rating_count') + shift(cuisine_deltas, 0),
+            rating_sum=F('rating_sum') + shift(cuisine_deltas, 1),
+        )
+
+
+def apply_recipe_delta(cuisine_id, recipe_delta, rating_count=0, rating_sum=0):
+    """
+    Add (``recipe_delta=1``) or remove (``recipe_delta=-1``) a recipe and its
+    rating totals from a cuisine's aggregates.
+    """
+    if not cuisine_id:
+        return
+    Cuisine.objects.filter(pk=cuisine_id).update(
+        recipe_count=F('recipe_count') + recipe_delta,
+        rating_count=F('rating_count') + recipe_delta * rating_count,
+        rating_sum=F('rating_sum') + recipe_delta * rating_sum,
+    )
+
+
+def move_recipe_cuisine(recipe, old_cuisine_id):
+    if old_cuisine_id == recipe.cuisine_id:
+        return
+    # Lock the row so a concurrent rating cannot land between reading the
+    # totals and moving them.
+    rating_count, rating_sum = locked_rating_totals(recipe.pk)
+    apply_recipe_delta(old_cuisine_id, -1, rating_count, rating_sum)
+    apply_recipe_delta(recipe.cuisine_id, 1, rating_count, rating_sum)
+
+
+def locked_rating_totals(recipe_id):
+    """
+    Read a recipe's ``(rating_count, rating_sum)`` under ``SELECT ... FOR
+    UPDATE``. Must be called inside the transaction that applies them.
+    """
+    return Recipe.objects.select_for_update().filter(pk=recipe_id).values_list('rating_count', 'rating_sum').get()
+
+
+def remove_user_contributions(user_id):
+    """
+    Take a user's recipes and ratings off the aggregates before deleting the
+    user cascades to them. Ratings on the user's own recipes leave with the
+    recipes' totals, so only ratings on other recipes are applied per recipe.
+    """
+    recipes = Recipe.objects.filter(creator_id=user_id)
+    list(recipes.select_for_update().values_list('pk', flat=True))
+
+    for row in recipes.exclude(cuisine=None).order_by().values('cuisine_id').annotate(
+        recipes=Count('id'), ratings=Sum('rating_count'), total=Sum('rating_sum'),
+    ):
+        Cuisine.objects.filter(pk=row['cuisine_id']).update(
+            recipe_count=F('recipe_count') - row['recipes'],
+            rating_count=F('rating_count') - row['ratings'],
+            rating_sum=F('rating_sum') - row['total'],
+        )
+
+    ratings = Rating.objects.filter(user_id=user_id).exclude(recipe__creator_id=user_id)
+    apply_rating_deltas({
+        row['recipe_id']: (row['recipe__cuisine_id'], -row['ratings'], -row['total'])
+        for row in ratings.order_by().values('recipe_id', 'recipe__cuisine_id').annotate(
+            ratings=Count('id'), total=Sum('score'),
+        )
+    })
+
+
+def rebuild_rating_aggregates():
+    """
+    Recompute every denormalized aggregate from the source tables. Used by
+    the ``rebuild_rating_aggregates`` management command to repair drift.
+    """
+    def total(queryset, group_by, aggregate):
+        return Coalesce(
+            Subquery(queryset.values(group_by).annotate(total=aggregate).values('total')[:1]),
+            Value(0),
+        )
+
+    ratings = Rating.objects.filter(recipe=OuterRef('pk')).order_by()
+    recipes = Recipe.objects.filter(cuisine=OuterRef('pk')).order_by()
+
+    with transaction.atomic():
+        Recipe.objects.update(
+            rating_count=total(ratings, 'recipe', Count('id')),
+            rating_sum=total(ratings, 'recipe', Sum('score')),
+        )
+        Cuisine.objects.update(
+            recipe_count=total(recipes, 'cuisine', Count('id')),
+            rating_count=total(recipes, 'cuisine', Sum('rating_count')),
+            rating_sum=total(recipes, 'cuisine', Sum('rating_sum')),
+        )
@@ -0,0 +1,61 @@
+"""
+Async support for DRF views. Under an ASGI server a request to an
+``AsyncAPIView`` only holds a worker thread while it runs blocking code
+(authentication, ORM calls); the rest, including sending the response to a
+slow client, happens on the event loop.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines. Authentication, permission and
+    throttle checks may hit the database, so they run in the request's
+    worker thread; handlers must use the async ORM or ``sync_to_async``.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+async def _iterate_in_thread(iterator):
+    done = object()
+    advance = sync_to_async(next)
+    while (chunk := await advance(iterator, done)) is not done:
+        yield chunk
+
+
+def stream_in_thread(request, response):
+    """
+    Under ASGI, let a streaming response built on a blocking iterator be
+    read one chunk at a time in a worker thread. Django would otherwise
+    consume the whole iterator into memory before sending anything. Under
+    WSGI the response is returned unchanged.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest) and not response.is_async:
+        response.streaming_content = _iterate_in_thread(iter(response.streaming_content))
+    return response
@@ -0,0 +1,132 @@
+"""
+Batch rating and favourite writes for clients replaying offline actions.
+Each batch is validated up front and applied in one transaction, with a
+fixed number of queries however many items it holds.
+"""
+from django.db import transaction
+from .aggregates import apply_rating_deltas
+from .cache import CUISINE_STATS, RECIPE_LIST, bump, recipe_namespace
+from .models import Favourite, Rating, Recipe
+from .recommendations import schedule_similarity_refresh
+from .serializers import FavouriteBatchItemSerializer, RatingBatchItemSerializer
+
+MAX_BATCH_SIZE = 100
+
+
+def _result(index, recipe_id, status, **extra):
+    return {'index': index, 'recipe': str(recipe_id), 'status': status, **extra}
+
+
+def _validate(items, serializer_class):
+    """
+    Validate every item. Returns ``(results, latest)``: ``results`` already
+    holds the outcome of invalid and superseded items, ``latest`` maps each
+    recipe id to the ``(index, data)`` of its last valid item, since a later
+    action on the same recipe replaces an earlier one.
+    """
+    results = [None] * len(items)
+    latest = {}
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if not serializer.is_valid():
+            results[index] = {'index': index, 'status': 'invalid', 'errors': serializer.errors}
+            continue
+        recipe_id = serializer.validated_data['recipe']
+        if recipe_id in latest:
+            results[latest[recipe_id][0]] = _result(latest[recipe_id][0], recipe_id, 'superseded')
+        latest[recipe_id] = (index, serializer.validated_data)
+    return results, latest
+
+
+def apply_rating_batch(user, items):
+    """
+    Upsert ``[{"recipe": <uuid>, "score": <int>}, ...]`` for ``user`` and
+    return one result per item, in order.
+    """
+    results, latest = _validate(items, RatingBatchItemSerializer)
+    deltas = {}
+
+    with transaction.atomic():
+        # Same locking as RatingSerializer.create, taken in primary key order
+        # so two overlapping batches cannot deadlock.
+        cuisines = dict(
+            Recipe.objects.select_for_update().filter(pk__in=latest).order_by('pk').values_list('pk', 'cuisine_id')
+        )
+        previous = {
+            recipe_id: (rating_id, score)
+            for recipe_id, rating_id, score in Rating.objects.filter(user=user, recipe_id__in=cuisines).values_list('recipe_id', 'id', 'score')
+        }
+
+        ratings = []
+        for recipe_id, (index, data) in latest.items():
+            score = data['score']
+            if recipe_id not in cuisines:
+                results[index] = _result(index, recipe_id, 'not_found')
+            elif recipe_id not in previous:
+                rating = Rating(user=user, recipe_id=recipe_id, score=score)
+                ratings.append(rating)
+                deltas[recipe_id] = (cuisines[recipe_id], 1, score)
+                results[index] = _result(index, recipe_id, 'created', id=str(rating.pk), score=score)
+            else:
+                rating_id, previous_score = previous[recipe_id]
+                status = 'unchanged'
+                if score != previous_score:
+                    ratings.append(Rating(user=user, recipe_id=recipe_id, score=score))
+                    deltas[recipe_id] = (cuisines[recipe_id], 0, score - previous_score)
+                    status = 'updated'
+                results[index] = _result(index, recipe_id, status, id=str(rating_id), score=score)
+
+        if ratings:
+            Rating.objects.bulk_create(
+                ratings,
+                update_conflicts=True,
+                unique_fields=['user', 'recipe'],
+                update_fields=['score'],
+            )
+            apply_rating_deltas(deltas)
+            bump(*[recipe_namespace(recipe_id) for recipe_id in deltas], RECIPE_LIST, CUISINE_STATS)
+
+    schedule_similarity_refresh(*deltas)
+    return results
+
+
+def apply_favourite_batch(user, items):
+    """
+    Apply ``[{"recipe": <uuid>, "action": "add" | "remove"}, ...]`` to the
+    favourites of ``user`` and return one result per item, in order.
+    """
+    results, latest = _validate(items, FavouriteBatchItemSerializer)
+    added, removed = [], []
+
+    with transaction.atomic():
+        existing = set(Favourite.objects.filter(user=user, recipe_id__in=latest).values_list('recipe_id', flat=True))
+        wanted = [recipe_id for recipe_id, (_, data) in latest.items() if data['action'] == 'add' and recipe_id not in existing]
+        found = set(Recipe.objects.filter(pk__in=wanted).values_list('pk', flat=True)) if wanted else set()
+
+        for recipe_id, (index, data) in latest.items():
+            if data['action'] == 'add':
+                if recipe_id in existing:
+                    status = 'unchanged'
+                elif recipe_id in found:
+                    added.append(recipe_id)
+                    status = 'added'
+                else:
+                    status = 'not_found'
+            elif recipe_id in existing:
+                removed.append(recipe_id)
+                status = 'removed'
+            else:
+                status = 'unchanged'
+            results[index] = _result(index, recipe_id, status)
+
+        if added:
+            # INSERT ... ON CONFLICT DO NOTHING, as in FavouriteView.post.
+            Favourite.objects.bulk_create(
+                [Favourite(user=user, recipe_id=recipe_id) for recipe_id in added],
+                ignore_conflicts=True,
+            )
+        if removed:
+            Favourite.objects.filter(user=user, recipe_id__in=removed).delete()
+
+    schedule_similarity_refresh(*added, *removed)
+    return results
@@ -0,0 +1,662 @@
+"""
+Synthetic data and a load generator for comparing performance work.
+``seed()`` fills the database with benchmark-only rows; ``run()`` replays a
+weighted mix of the real endpoints from concurrent threads, either in
+process through the full middleware/view stack or over HTTP against a
+running server, and returns a JSON-able report.
+"""
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.db.models import Count, F, Q
+from django.test import Client
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from users.models import CustomUser
+from users.tokens import UserRefreshToken
+from .aggregates import rebuild_rating_aggregates
+from .matching import IngredientIndex
+from .models import Cuisine, Favourite, Ingredient, Rating, Recipe, RecipeIngredient, RecipeNeighbours
+from .search import refresh_search_vectors
+from .uploads import BULK_UPLOAD_COLUMNS
+
+EMAIL_DOMAIN = 'bench.local'
+CUISINE_PREFIX = 'Bench '
+INGREDIENT_PREFIX = 'bench '
+BATCH_SIZE = 2000
+
+WORDS = (
+    'tomato', 'basil', 'garlic', 'onion', 'chicken', 'rice', 'lentil', 'paneer', 'noodle', 'lemon',
+    'ginger', 'chilli', 'mushroom', 'spinach', 'potato', 'coconut', 'cumin', 'yogurt', 'pepper', 'butter',
+)
+CUISINES = (
+    'Italian', 'Indian', 'Mexican', 'Thai', 'Japanese', 'French', 'Greek', 'Chinese', 'Spanish', 'Turkish',
+    'Korean', 'Lebanese', 'Ethiopian', 'Peruvian', 'Vietnamese', 'Moroccan',
+)
+
+DEFAULT_MIX = {
+    'list-recipes': 35,
+    'detail-recipe': 30,
+    'cuisine-stats': 15,
+    'create-ratings': 12,
+    'recipe-pdf': 6,
+    'upload-excel': 2,
+}
+
+_queries = re.compile(r'desc="(\d+) queries"')
+
+
+def _batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def reset():
+    """Delete every row created by ``seed()``."""
+    with transaction.atomic():
+        CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+        Cuisine.objects.filter(name__startswith=CUISINE_PREFIX).delete()
+        Ingredient.objects.filter(name__startswith=INGREDIENT_PREFIX).delete()
+
+
+def seed(users, cuisines, ingredients, recipes, ratings, favourites, seed=0):
+    """
+    Create benchmark data with bulk inserts, then rebuild the denormalized
+    aggregates and search vectors. The same arguments always produce the
+    same data. Returns the number of rows created per model.
+    """
+    rng = random.Random(seed)
+    password = make_password(None)
+
+    creators = max(1, users // 10)
+    CustomUser.objects.bulk_create(
+        [
+            CustomUser(email=f'bench{i}@{EMAIL_DOMAIN}', user_type='creator' if i < creators else 'viewer', password=password)
+            for i in range(users)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').order_by('pk').values_list('pk', flat=True))
+    creator_ids = user_ids[:creators]
+
+    cuisine_rows = Cuisine.objects.bulk_create(
+        [Cuisine(name=f'{CUISINE_PREFIX}{CUISINES[i % len(CUISINES)]} {i}') for i in range(cuisines)]
+    )
+    ingredient_rows = Ingredient.objects.bulk_create(
+        [Ingredient(name=f'{INGREDIENT_PREFIX}{WORDS[i % len(WORDS)]} {i}', image='') for i in range(ingredients)],
+        batch_size=BATCH_SIZE,
+    )
+
+    now = timezone.now()
+    recipe_rows = []
+    for i in range(recipes):
+        title = ' '.join(rng.sample(WORDS, 3))
+        recipe_rows.append(Recipe(
+            creator_id=rng.choice(creator_ids),
+            cuisine=rng.choice(cuisine_rows),
+            title=title.title(),
+            description=f'A {title} dish.',
+            instructions=' '.join(rng.choices(WORDS, k=40)),
+            prep_duration=rng.randint(5, 60),
+            cook_duration=rng.randint(0, 120),
+            thumbnail='',
+            created_at=now - timezone.timedelta(minutes=i),
+        ))
+    for batch in _batches(recipe_rows):
+        Recipe.objects.bulk_create(batch)
+
+    recipe_ingredients = [
+        RecipeIngredient(recipe=recipe, ingredient=ingredient)
+        for recipe in recipe_rows
+        for ingredient in rng.sample(ingredient_rows, min(len(ingredient_rows), rng.randint(3, 10)))
+    ]
+    for batch in _batches(recipe_ingredients):
+        RecipeIngredient.objects.bulk_create(batch)
+
+    def pairs(count):
+        chosen = set()
+        limit = min(count, len(user_ids) * len(recipe_rows))
+        while len(chosen) < limit:
+            chosen.add((rng.choice(user_ids), rng.randrange(len(recipe_rows))))
+        return sorted(chosen)
+
+    rating_rows = [Rating(user_id=user_id, recipe=recipe_rows[index], score=rng.randint(1, 5)) for user_id, index in pairs(ratings)]
+    for batch in _batches(rating_rows):
+        Rating.objects.bulk_create(batch)
+    favourite_rows = [Favourite(user_id=user_id, recipe=recipe_rows[index]) for user_id, index in pairs(favourites)]
+    for batch in _batches(favourite_rows):
+        Favourite.objects.bulk_create(batch)
+
+    rebuild_rating_aggregates()
+    for batch in _batches([recipe.pk for recipe in recipe_rows]):
+        refresh_search_vectors(batch)
+
+    return {
+        'users': len(user_ids),
+        'cuisines': len(cuisine_rows),
+        'ingredients': len(ingredient_rows),
+        'recipes': len(recipe_rows),
+        'recipe_ingredients': len(recipe_ingredients),
+        'ratings': len(rating_rows),
+        'favourites': len(favourite_rows),
+    }
+
+
+class Workload:
+    """Ids, tokens and payloads the request generators draw from."""
+
+    def __init__(self, upload_rows=20):
+        users = CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}')
+        creators = list(users.filter(user_type='creator')[:20])
+        viewers = list(users.filter(user_type='viewer')[:200])
+        if not creators or not viewers:
+            raise ValueError("No benchmark data found; run seed_benchmark_data first.")
+
+        self.creator_tokens = [str(UserRefreshToken.for_user(user).access_token) for user in creators]
+        self.viewer_tokens = [str(UserRefreshToken.for_user(user).access_token) for user in viewers]
+        self.recipe_ids = [str(pk) for pk in Recipe.objects.filter(creator__in=users).values_list('pk', flat=True)[:5000]]
+        self.cuisine_ids = [str(pk) for pk in Cuisine.objects.filter(name__startswith=CUISINE_PREFIX).values_list('pk', flat=True)]
+        ingredient_ids = [str(pk) for pk in Ingredient.objects.filter(name__startswith=INGREDIENT_PREFIX).values_list('pk', flat=True)[:50]]
+
+        wb = Workbook()
+        ws = wb.active
+        ws.append(list(BULK_UPLOAD_COLUMNS))
+        for i in range(upload_rows):
+            ws.append([f'Bench upload {i}', 'Uploaded', 'Mix well.', 10, 20, self.cuisine_ids[i % len(self.cuisine_ids)], ','.join(ingredient_ids[:3])])
+        buffer = BytesIO()
+        wb.save(buffer)
+        self.upload = buffer.getvalue()
+
+    def request(self, endpoint, client, rng):
+        viewer = {'HTTP_AUTHORIZATION': f'Bearer {rng.choice(self.viewer_tokens)}'}
+        creator = {'HTTP_AUTHORIZATION': f'Bearer {rng.choice(self.creator_tokens)}'}
+
+        if endpoint == 'list-recipes':
+            params = {'limit': 10, 'offset': rng.randrange(0, 100, 10)}
+            if rng.random() < 0.3:
+                params['cuisine'] = rng.choice(self.cuisine_ids)
+            return client.get('/api/v1/app/list-recipes/', params, **viewer)
+        if endpoint == 'detail-recipe':
+            return client.get(f'/api/v1/app/detail-recipe/{rng.choice(self.recipe_ids)}/', **viewer)
+        if endpoint == 'cuisine-stats':
+            return client.get('/api/v1/app/cuisine-stats/', {'limit': 10}, **viewer)
+        if endpoint == 'create-ratings':
+            return client.post(
+                '/api/v1/app/create-ratings/',
+                {'recipe': rng.choice(self.recipe_ids), 'score': rng.randint(1, 5)},
+                content_type='application/json',
+                **viewer,
+            )
+        if endpoint == 'recipe-pdf':
+            return client.get('/api/v1/app/recipe-pdf/', {'recipe_id': rng.choice(self.recipe_ids)}, **viewer)
+        if endpoint == 'upload-excel':
+            upload = BytesIO(self.upload)
+            upload.name = 'benchmark.xlsx'
+            return client.post('/api/v1/app/upload-excel/', {'file': upload}, **creator)
+        raise ValueError(f"Unknown endpoint {endpoint!r}")
+
+
+class HttpResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+    def get(self, header, default=None):
+        return self.headers.get(header, default)
+
+
+class HttpClient:
+    """
+    The subset of the test client's interface ``Workload`` uses, sending
+    real HTTP requests over one keep-alive connection.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.connection = HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+        self.prefix = parts.path.rstrip('/')
+
+    def get(self, path, data=None, **extra):
+        if data:
+            path = f'{path}?{urlencode(data)}'
+        return self.request('GET', path, None, extra)
+
+    def post(self, path, data, content_type=None, **extra):
+        if content_type is not None:
+            body = json.dumps(data).encode()
+        else:
+            boundary = uuid.uuid4().hex
+            body = b''
+            for name, value in data.items():
+                body += (
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{value.name}"\r\n'
+                    f'Content-Type: application/octet-stream\r\n\r\n'
+                ).encode() + value.read() + b'\r\n'
+            body += f'--{boundary}--\r\n'.encode()
+            content_type = f'multipart/form-data; boundary={boundary}'
+        return self.request('POST', path, body, {'CONTENT_TYPE': content_type, **extra})
+
+    def request(self, method, path, body, extra):
+        # Test-client style META keys (HTTP_AUTHORIZATION) to header names.
+        headers = {key.removeprefix('HTTP_').replace('_', '-').title(): value for key, value in extra.items()}
+        for attempt in range(2):
+            try:
+                self.connection.request(method, self.prefix + path, body, headers)
+                response = self.connection.getresponse()
+                response.read()
+                return HttpResponse(response.status, response.headers)
+            except (ConnectionError, HTTPException):
+                # The server closed the keep-alive connection; retry once.
+                self.connection.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        self.connection.close()
+
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+
+def _summary(samples, duration):
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [count for _, count, _ in samples if count is not None]
+    statuses = Counter(status for _, _, status in samples)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / duration, 2) if duration else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': _percentile(latencies, 0.50),
+        'p95_ms': _percentile(latencies, 0.95),
+        'p99_ms': _percentile(latencies, 0.99),
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def run(requests, concurrency, mix=None, warmup=0, seed=0, url=None):
+    """
+    Send ``requests`` requests drawn from the weighted ``mix`` of endpoints
+    from ``concurrency`` threads, each with its own client: the test client,
+    or an HTTP connection to the server at ``url``, which must use the same
+    database and SECRET_KEY. Latency is measured around the whole request;
+    queries per request come from the ``Server-Timing`` header of
+    RequestMetricsMiddleware.
+    """
+    mix = mix or DEFAULT_MIX
+    workload = Workload()
+    endpoints, weights = zip(*mix.items())
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def worker(index, count, record):
+        rng = random.Random(seed * 1000 + index)
+        client = HttpClient(url) if url else Client(raise_request_exception=False)
+        try:
+            for endpoint in rng.choices(endpoints, weights, k=count):
+                start = time.perf_counter()
+                response = workload.request(endpoint, client, rng)
+                latency = (time.perf_counter() - start) * 1000
+                if record:
+                    found = _queries.search(response.get('Server-Timing', ''))
+                    with lock:
+                        samples[endpoint].append((latency, int(found.group(1)) if found else None, response.status_code))
+        finally:
+            if url:
+                client.close()
+            connections.close_all()
+
+    def replay(total, record):
+        per_worker = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker, i, count, record) for i, count in enumerate(per_worker)]:
+                future.result()
+
+    if warmup:
+        replay(warmup, record=False)
+    started_at = timezone.now()
+    start = time.perf_counter()
+    replay(requests, record=True)
+    duration = time.perf_counter() - start
+
+    return {
+        'config': {
+            'target': url or 'in-process',
+            'database': connection.vendor,
+            'requests': requests,
+            'concurrency': concurrency,
+            'warmup': warmup,
+            'seed': seed,
+            'mix': dict(mix),
+            'started_at': started_at.isoformat(),
+            'duration_s': round(duration, 3),
+        },
+        'overall': _summary([sample for endpoint_samples in samples.values() for sample in endpoint_samples], duration),
+        'endpoints': {endpoint: _summary(samples[endpoint], duration) for endpoint in endpoints if samples[endpoint]},
+    }
+
+
+def _latencies(samples):
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 3) if ordered else None,
+        'p50_ms': _percentile(ordered, 0.50),
+        'p95_ms': _percentile(ordered, 0.95),
+        'max_ms': round(ordered[-1], 3) if ordered else None,
+    }
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def _match_with_orm(ingredient_ids, max_missing, limit):
+    return list(
+        Recipe.objects.order_by()
+        .annotate(
+            total=Count('recipeingredient'),
+            matched=Count('recipeingredient', filter=Q(recipeingredient__ingredient_id__in=ingredient_ids)),
+        )
+        .filter(matched__gt=0, total__lte=F('matched') + max_missing)
+        .order_by(F('total') - F('matched'), '-matched')
+        .values_list('pk', 'matched', 'total')[:limit]
+    )
+
+
+def benchmark_matching(queries=200, ingredients_per_query=8, max_missing=1, limit=20, replays=50, seed=0):
+    """
+    Time ``IngredientIndex.match()`` against the equivalent aggregate query
+    over RecipeIngredient for the same random ingredient sets, and catching
+    up with another process's change by replay against a full rebuild.
+    """
+    rng = random.Random(seed)
+    ingredient_ids = list(Ingredient.objects.filter(name__startswith=INGREDIENT_PREFIX).values_list('pk', flat=True))
+    recipe_ids = list(Recipe.objects.filter(creator__email__endswith=f'@{EMAIL_DOMAIN}').values_list('pk', flat=True))
+    if not ingredient_ids or not recipe_ids:
+        raise ValueError("No benchmark data found; run seed_benchmark_data first.")
+
+    index = IngredientIndex()
+    _, rebuild_ms = _timed(index.rebuild)
+    index_ms, orm_ms, mismatches = [], [], 0
+    for _ in range(queries):
+        have = rng.sample(ingredient_ids, min(ingredients_per_query, len(ingredient_ids)))
+        found, elapsed = _timed(index.match, have, max_missing=max_missing, limit=limit)
+        index_ms.append(elapsed)
+        expected, elapsed = _timed(_match_with_orm, have, max_missing, limit)
+        orm_ms.append(elapsed)
+        # Ties may be broken differently, so compare the ranking keys.
+        if [(t - m, m) for _, m, t in found] != [(t - m, m) for _, m, t in expected]:
+            mismatches += 1
+
+    other = IngredientIndex()
+    other.rebuild()
+    replay_ms = []
+    for _ in range(replays):
+        index.refresh_recipes([rng.choice(recipe_ids)])
+        other._checked_at = 0
+        _, elapsed = _timed(other.ensure_fresh)
+        replay_ms.append(elapsed)
+
+    index_summary, orm_summary = _latencies(index_ms), _latencies(orm_ms)
+    return {
+        'config': {
+            'database': connection.vendor,
+            'recipes': len(index.positions),
+            'ingredients': len(ingredient_ids),
+            'queries': queries,
+            'ingredients_per_query': ingredients_per_query,
+            'max_missing': max_missing,
+            'limit': limit,
+            'seed': seed,
+        },
+        'index': index_summary,
+        'orm': orm_summary,
+        'p50_speedup': round(orm_summary['p50_ms'] / index_summary['p50_ms'], 1) if index_summary['p50_ms'] else None,
+        'mismatches': mismatches,
+        'rebuild_ms': round(rebuild_ms, 2),
+        'replay': _latencies(replay_ms),
+    }
+
+
+def benchmark_similarity(refreshes=20, recipes_per_refresh=1, changes=5, seed=0):
+    """
+    Time a full rebuild of the recommendation model against incremental
+    refreshes after re-scoring ``changes`` ratings of random benchmark
+    recipes, then compare every stored neighbour list with a fresh full
+    rebuild. Modifies the benchmark ratings.
+    """
+    from .similarity import rebuild_neighbours
+
+    rng = random.Random(seed)
+    recipe_ids = list(
+        Rating.objects.filter(user__email__endswith=f'@{EMAIL_DOMAIN}').order_by()
+        .values_list('recipe_id', flat=True).distinct()
+    )
+    if not recipe_ids:
+        raise ValueError("No benchmark data found; run seed_benchmark_data first.")
+
+    written, rebuild_ms = _timed(rebuild_neighbours)
+    refresh_ms = []
+    for _ in range(refreshes):
+        touched = rng.sample(recipe_ids, recipes_per_refresh)
+        for recipe_id in touched:
+            for rating_id in Rating.objects.filter(recipe_id=recipe_id).values_list('pk', flat=True)[:changes]:
+                Rating.objects.filter(pk=rating_id).update(score=rng.randint(1, 5))
+        _, elapsed = _timed(rebuild_neighbours, touched)
+        refresh_ms.append(elapsed)
+
+    def stored():
+        return {
+            recipe_id: [round(score, 3) for score in scores]
+            for recipe_id, scores in RecipeNeighbours.objects.values_list('recipe_id', 'scores').iterator(chunk_size=5000)
+        }
+
+    refreshed = stored()
+    rebuild_neighbours()
+    rebuilt = stored()
+    return {
+        'config': {
+            'database': connection.vendor,
+            'ratings': Rating.objects.count(),
+            'favourites': Favourite.objects.count(),
+            'recipes': len(recipe_ids),
+            'refreshes': refreshes,
+            'recipes_per_refresh': recipes_per_refresh,
+            'changes': changes,
+            'seed': seed,
+        },
+        'rebuild_ms': round(rebuild_ms, 1),
+        'rows': written,
+        'refresh': _latencies(refresh_ms),
+        'rows_differing_from_rebuild': sum(
+            1 for recipe_id in refreshed.keys() | rebuilt.keys() if refreshed.get(recipe_id) != rebuilt.get(recipe_id)
+        ),
+    }
+
+
+def _import_row_by_row(chunk, user):
+    # The per-row ORM import process_chunk replaced: one lookup and insert
+    # per recipe, then one insert per ingredient.
+    created = 0
+    for _, row in chunk:
+        try:
+            with transaction.atomic():
+                title, description, instructions, prep_duration, cook_duration, cuisine_id, ingredient_ids_str = row
+                recipe = Recipe.objects.create(
+                    creator=user,
+                    title=title.strip(),
+                    description=description.strip(),
+                    instructions=instructions.strip(),
+                    prep_duration=int(prep_duration),
+                    cook_duration=int(cook_duration),
+                    cuisine=Cuisine.objects.get(pk=cuisine_id),
+                )
+                for ingredient_id in ingredient_ids_str.split(','):
+                    if ingredient_id.strip():
+                        RecipeIngredient.objects.create(recipe=recipe, ingredient_id=ingredient_id.strip())
+            created += 1
+        except Exception:
+            continue
+    return created
+
+
+def benchmark_bulk_import(rows=1000, ingredients_per_row=3, invalid_every=50, seed=0):
+    """
+    Import the same generated sheet rows with ``process_chunk()`` and with
+    the row-by-row ORM import it replaced, chunk by chunk as the Celery
+    tasks do, counting queries and wall time. Each run is rolled back.
+    """
+    from .tasks import CHUNK_SIZE, iter_chunks, process_chunk
+
+    rng = random.Random(seed)
+    user = CustomUser.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}', user_type='creator').first()
+    cuisine_ids = [str(pk) for pk in Cuisine.objects.filter(name__startswith=CUISINE_PREFIX).values_list('pk', flat=True)]
+    ingredient_ids = [str(pk) for pk in Ingredient.objects.filter(name__startswith=INGREDIENT_PREFIX).values_list('pk', flat=True)]
+    if user is None or not cuisine_ids or not ingredient_ids:
+        raise ValueError("No benchmark data found; run seed_benchmark_data first.")
+
+    sheet = []
+    for row_number in range(2, rows + 2):
+        # Every invalid_every-th row names an unknown cuisine, so both
+        # importers also exercise their error path.
+        invalid = invalid_every and row_number % invalid_every == 0
+        sheet.append((row_number, [
+            f'Bench import {row_number}', 'Imported', 'Mix well.', rng.randint(5, 30), rng.randint(5, 90),
+            str(uuid.uuid4()) if invalid else rng.choice(cuisine_ids),
+            ','.join(rng.sample(ingredient_ids, min(ingredients_per_row, len(ingredient_ids)))),
+        ]))
+
+    def measure(import_chunk):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with transaction.atomic(), connection.execute_wrapper(count):
+            start = time.perf_counter()
+            created = sum(import_chunk(chunk) for chunk in iter_chunks(sheet, CHUNK_SIZE))
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return {
+            'created': created,
+            'queries': queries,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed) if elapsed else None,
+        }
+
+    set_based = measure(lambda chunk: process_chunk(chunk, user)[0])
+    row_by_row = measure(lambda chunk: _import_row_by_row(chunk, user))
+    return {
+        'config': {
+            'database': connection.vendor,
+            'rows': rows,
+            'chunk_size': CHUNK_SIZE,
+            'ingredients_per_row': ingredients_per_row,
+            'invalid_every': invalid_every,
+            'seed': seed,
+        },
+        'set_based': set_based,
+        'row_by_row': row_by_row,
+        'speedup': round(row_by_row['seconds'] / set_based['seconds'], 1) if set_based['seconds'] else None,
+    }
+
+
+def write_upload_sheet(path, rows, seed=0):
+    """Write a bulk-upload sheet of ``rows`` recipe rows with random ids."""
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(BULK_UPLOAD_COLUMNS))
+    ingredient_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(200)]
+    for i in range(rows):
+        ws.append([
+            f'Bench upload {i}', 'Uploaded', 'Mix well.', rng.randint(5, 30), rng.randint(5, 90),
+            str(uuid.UUID(int=rng.getrandbits(128))), ','.join(rng.sample(ingredient_ids, 3)),
+        ])
+    wb.save(path)
+
+
+def sheet_peak_rss(path, full_load=False):
+    """
+    Read the sheet at ``path`` the way the bulk upload does, validating the
+    header and then streaming it in chunks, or with ``full_load`` the way it
+    was read before: the whole workbook and every row in memory. Meant to
+    run in a fresh process; returns its RSS before and at peak, in MB.
+    """
+    from .tasks import CHUNK_SIZE, iter_sheet_chunks
+    from .uploads import validate_bulk_upload_header
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if full_load:
+        rows = list(load_workbook(path).active.iter_rows(min_row=2, values_only=True))
+        count = len(rows)
+    else:
+        validate_bulk_upload_header(path)
+        count = sum(len(chunk) for chunk in iter_sheet_chunks(path, CHUNK_SIZE))
+    return {
+        'rows': count,
+        'seconds': round(time.perf_counter() - start, 1),
+        # ru_maxrss is in kilobytes on Linux.
+        'baseline_rss_mb': round(before / 1024, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def benchmark_sheet_memory(rows=(1000, 100000), full_load_max_rows=100000, seed=0):
+    """
+    Measure the peak RSS of reading bulk-upload sheets of each size in
+    ``rows``, each in a fresh Python process so earlier runs do not inflate
+    the peak. Sheets up to ``full_load_max_rows`` are also read the old way.
+    """
+    from .tasks import CHUNK_SIZE
+
+    script = (
+        'import django, json, sys; django.setup(); '
+        'from app.benchmark import sheet_peak_rss; '
+        'print(json.dumps(sheet_peak_rss(sys.argv[1], sys.argv[2] == "full")))'
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in rows:
+            path = os.path.join(directory, f'{count}.xlsx')
+            write_upload_sheet(path, count, seed=seed)
+            result = {'rows': count, 'file_mb': round(os.path.getsize(path) / 2**20, 1)}
+            for mode in ('streamed', 'full') if count <= full_load_max_rows else ('streamed',):
+                output = subprocess.run(
+                    [sys.executable, '-c', script, path, mode],
+                    cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+                ).stdout
+                result[mode] = json.loads(output)
+            results.append(result)
+    return {
+        'config': {'python': sys.version.split()[0], 'chunk_size': CHUNK_SIZE, 'seed': seed},
+        'upload_size_limit_mb': round(settings.BULK_UPLOAD_MAX_SIZE / 2**20, 1),
+        'sheets': results,
+    }
@@ -0,0 +1,122 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'recipes'
+
+# Namespaces whose version is part of a cached payload's key. Bumping a
+# version makes every payload built under the old one unreachable, so a write
+# never has to find and delete the affected keys.
+RECIPE_LIST = 'recipe-list'
+CUISINE_STATS = 'cuisine-stats'
+CATALOG = 'catalog'
+
+
+def recipe_namespace(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def _version_key(namespace):
+    return f'{KEY_PREFIX}:version:{namespace}'
+
+
+def get_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seed with a timestamp rather than 1 so a version key that was
+            # evicted can never come back to a number used before.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def _bump_now(namespaces):
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump(*namespaces):
+    # Deferred to commit so a concurrent reader cannot re-cache the old rows
+    # under the new version while the write is still uncommitted.
+    transaction.on_commit(lambda: _bump_now(namespaces))
+
+
+def _record(view_name, outcome):
+    key = f'{KEY_PREFIX}:stats:{view_name}:{outcome}'
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+
+
+async def _arecord(view_name, outcome):
+    key = f'{KEY_PREFIX}:stats:{view_name}:{outcome}'
+    if not await cache.aadd(key, 1, timeout=None):
+        await cache.aincr(key)
+
+
+def _payload_key(view_name, versions, request):
+    fingerprint = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f"{KEY_PREFIX}:payload:{view_name}:{':'.join(map(str, versions))}:{fingerprint}"
+
+
+def cached_payload(view_name, namespaces, request, build):
+    """
+    Return the payload produced by ``build()`` for this request, serving it
+    from the cache when an entry for the current namespace versions exists.
+    """
+    key = _payload_key(view_name, get_versions(namespaces), request)
+
+    payload = cache.get(key)
+    if payload is not None:
+        _record(view_name, 'hits')
+        return payload
+
+    _record(view_name, 'misses')
+    payload = build()
+    cache.set(key, payload, timeout=settings.RECIPE_CACHE_TIMEOUT)
+    return payload
+
+
+async def acached_payload(view_name, namespaces, request, build):
+    """Async ``cached_payload()``; ``build`` is a coroutine function."""
+    key = _payload_key(view_name, await aget_versions(namespaces), request)
+
+    payload = await cache.aget(key)
+    if payload is not None:
+        await _arecord(view_name, 'hits')
+        return payload
+
+    await _arecord(view_name, 'misses')
+    payload = await build()
+    await cache.aset(key, payload, timeout=settings.RECIPE_CACHE_TIMEOUT)
+    return payload
+
+
+def cache_stats(view_names):
+    keys = {
+        (view_name, outcome): f'{KEY_PREFIX}:stats:{view_name}:{outcome}'
+        for view_name in view_names
+        for outcome in ('hits', 'misses')
+    }
+    values = cache.get_many(keys.values())
+    return {
+        view_name: {outcome: values.get(keys[(view_name, outcome)], 0) for outcome in ('hits', 'misses')}
+        for view_name in view_names
+    }
@@ -1,9 +1,35 @@
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_shutdown
 from django.conf import settings
+from django.db import connections
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'receipe_management_system.settings')
 app = Celery('receipe_management_system')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks() 
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+def close_database_pools():
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+    for connection in connections.all():
+        # Reading connection.pool would create the pool it is about to close,
+        # and pools are shared by every thread, so look them up directly.
+        if connection.alias in getattr(connection, '_connection_pools', ()):
+            connection.close_pool()
+
+
+# Celery's Django fixup already releases connections around every task; the
+# pools need handling at process boundaries. Prefork children must not
+# inherit a pool the parent opened, since they would share its sockets, and
+# each child returns its connections to the server when it exits.
+@worker_init.connect
+def close_parent_database_pools(**kwargs):
+    close_database_pools()
+
+
+@worker_process_shutdown.connect
+def close_child_database_pools(**kwargs):
+    close_database_pools()
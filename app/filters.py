@@ -0,0 +1,112 @@
+import uuid
+from django.db import connection
+from django.db.models import Case, CharField, Count, Exists, F, OuterRef, Q, Value, When
+from django.db.models.functions import Cast
+from .models import Recipe, RecipeIngredient
+
+FACETS = ('cuisine', 'creator', 'ingredient', 'total_time', 'rating')
+
+# Upper bounds (minutes) of the total-time facet buckets; anything longer
+# falls into the last, open-ended bucket.
+TOTAL_TIME_BUCKETS = (15, 30, 60)
+TOTAL_TIME_LABELS = {
+    str(bound): f'{lower + 1 if lower else 0}-{bound}'
+    for lower, bound in zip((0,) + TOTAL_TIME_BUCKETS, TOTAL_TIME_BUCKETS)
+}
+TOTAL_TIME_LABELS['-1'] = f'{TOTAL_TIME_BUCKETS[-1] + 1}+'
+
+# Buckets returned per facet, largest first; creators and ingredients can
+# otherwise run into the thousands.
+FACET_BUCKETS = 20
+
+
+def _csv(value, parse):
+    return [parse(part.strip()) for part in value.split(',') if part.strip()]
+
+
+class RecipeFilters:
+    """
+    Combinable list-recipes filters parsed from query params. Each dimension
+    is kept as a separate Q so facet counts can apply every filter except
+    their own one.
+    """
+
+    def __init__(self, params):
+        self.conditions = {}
+
+        if params.get('cuisine'):
+            self.conditions['cuisine'] = Q(cuisine_id__in=_csv(params['cuisine'], uuid.UUID))
+        if params.get('creator'):
+            self.conditions['creator'] = Q(creator_id__in=_csv(params['creator'], int))
+        if params.get('ingredient'):
+            condition = Q()
+            for ingredient_id in _csv(params['ingredient'], uuid.UUID):
+                condition &= Q(Exists(RecipeIngredient.objects.filter(recipe=OuterRef('pk'), ingredient_id=ingredient_id)))
+            self.conditions['ingredient'] = condition
+        if params.get('max_total_time'):
+            self.conditions['total_time'] = Q(total_duration__lte=int(params['max_total_time']))
+        if params.get('min_rating'):
+            min_rating = float(params['min_rating'])
+            self.conditions['rating'] = Q(rating_count__gt=0, rating_sum__gte=F('rating_count') * min_rating)
+
+    def q(self, exclude=None):
+        combined = Q()
+        for name, condition in self.conditions.items():
+            if name != exclude:
+                combined &= condition
+        return combined
+
+    def apply(self, queryset):
+        return queryset.filter(self.q())
+
+    def facet_counts(self, buckets=FACET_BUCKETS):
+        """
+        Recipe counts for the ``buckets`` most common values of every facet,
+        each under all the other active filters, fetched in a single UNION
+        ALL query.
+        """
+        total_time_bucket = Case(
+            *[When(total_duration__lte=bound, then=Value(bound)) for bound in TOTAL_TIME_BUCKETS],
+            default=Value(-1),
+        )
+        rating_bucket = Case(
+            *[When(rating_sum__gte=F('rating_count') * score, then=Value(score)) for score in (5, 4, 3, 2)],
+            default=Value(1),
+        )
+        keys = {
+            'cuisine': F('cuisine_id'),
+            'creator': F('creator_id'),
+            'ingredient': F('recipeingredient__ingredient_id'),
+            'total_time': total_time_bucket,
+            'rating': rating_bucket,
+        }
+
+        queries = []
+        for name in FACETS:
+            queryset = Recipe.objects.order_by().filter(self.q(exclude=name))
+            if name == 'rating':
+                queryset = queryset.filter(rating_count__gt=0)
+            queryset = (
+                queryset.annotate(facet=Value(name, output_field=CharField()), key=Cast(keys[name], CharField()))
+                .filter(key__isnull=False)
+                .values('facet', 'key')
+                .annotate(count=Count('pk'))
+                .values_list('facet', 'key', 'count')
+            )
+            if connection.features.supports_slicing_ordering_in_compound:
+                queryset = queryset.order_by('-count', 'key')[:buckets]
+            queries.append(queryset)
+
+        rows = sorted(queries[0].union(*queries[1:], all=True), key=lambda row: (-row[2], row[1]))
+        facets = {name: {} for name in FACETS}
+        for name, key, count in rows:
+            # Backends without LIMIT inside UNION (SQLite) are trimmed here.
+            if len(facets[name]) >= buckets:
+                continue
+            if name == 'total_time':
+                key = TOTAL_TIME_LABELS[key]
+            elif name in ('cuisine', 'ingredient'):
+                # Text casts of UUIDs differ between backends (SQLite drops the dashes).
+                key = str(uuid.UUID(key))
+            facets[name][key] = count
+        return facets
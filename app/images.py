@@ -0,0 +1,170 @@
+"""
+Resized WebP/JPEG derivatives and blur placeholders for uploaded images.
+Generated off the request path by the ``generate_image_variants`` task and
+recorded, with their dimensions, in a ``<field>_variants`` JSON column next
+to the original image field.
+"""
+import base64
+import logging
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+from .cache import CATALOG, RECIPE_LIST, bump, recipe_namespace
+from .models import Ingredient, Recipe, StepPicture
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'image_variants'
+
+# Maximum width (pixels) of each derivative; smaller originals are not upscaled.
+VARIANT_WIDTHS = {'small': 320, 'large': 960}
+PLACEHOLDER_SIZE = 16
+
+IMAGE_FIELDS = {
+    Recipe: 'thumbnail',
+    Ingredient: 'image',
+    StepPicture: 'image',
+}
+
+
+def variants_field(field_name):
+    return f'{field_name}_variants'
+
+
+def variant_path(name, label, extension):
+    stem, _ = os.path.splitext(name)
+    return f'{VARIANT_DIR}/{stem}/{label}.{extension}'
+
+
+def _encode(image, format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def _flatten(image):
+    """RGB copy of ``image`` with any transparency composited onto white."""
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def _store(path, data):
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(data))
+
+
+def build_image_variants(name):
+    """
+    Write the derivatives of the stored image ``name`` and return its
+    variants record, or ``None`` if the file is missing or not an image.
+    Module-level and free of model instances so it can run in a process
+    pool.
+    """
+    try:
+        with default_storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        logger.exception("Could not read image %s", name)
+        return None
+
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'PA', 'P') else 'RGB')
+    variants = {'source': name, 'width': image.width, 'height': image.height, 'sizes': {}}
+
+    for label, width in VARIANT_WIDTHS.items():
+        resized = image
+        if image.width > width:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        webp, jpeg = variant_path(name, label, 'webp'), variant_path(name, label, 'jpg')
+        _store(webp, _encode(resized, 'WEBP', quality=80, method=4))
+        _store(jpeg, _encode(_flatten(resized), 'JPEG', quality=82, optimize=True, progressive=True))
+        variants['sizes'][label] = {'width': resized.width, 'height': resized.height, 'webp': webp, 'jpeg': jpeg}
+
+    placeholder = _flatten(image).copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    placeholder = placeholder.filter(ImageFilter.GaussianBlur(1))
+    variants['placeholder'] = 'data:image/jpeg;base64,' + base64.b64encode(_encode(placeholder, 'JPEG', quality=50)).decode()
+    return variants
+
+
+def _paths(variants):
+    return {path for size in (variants or {}).get('sizes', {}).values() for path in (size['webp'], size['jpeg'])}
+
+
+def delete_image_variants(variants, keep=()):
+    for path in _paths(variants) - set(keep):
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def save_image_variants(model, pk, name, variants, previous):
+    """
+    Record ``variants`` for ``name`` unless the image was replaced while they
+    were being generated, and drop the files of ``previous``. Returns whether
+    the row was updated.
+    """
+    field = IMAGE_FIELDS[model]
+    updated = model.objects.filter(pk=pk, **{field: name}).update(**{variants_field(field): variants})
+    if not updated:
+        # A newer upload owns the row now; its own task will record it.
+        if not image_in_use(name, exclude=(model, pk)):
+            delete_image_variants(variants, keep=_paths(previous))
+        return False
+
+    if previous and not image_in_use(previous.get('source'), exclude=(model, pk)):
+        delete_image_variants(previous, keep=_paths(variants))
+    # update() sends no post_save, so invalidate explicitly.
+    if model is Recipe:
+        bump(recipe_namespace(pk), RECIPE_LIST)
+    else:
+        bump(CATALOG, RECIPE_LIST)
+    return True
+
+
+def image_in_use(name, exclude):
+    """Whether any row other than ``exclude`` (a ``(model, pk)`` pair) stores the image ``name``."""
+    if not name:
+        return False
+    excluded_model, excluded_pk = exclude
+    for model, field in IMAGE_FIELDS.items():
+        rows = model.objects.filter(**{field: name})
+        if model is excluded_model:
+            rows = rows.exclude(pk=excluded_pk)
+        if rows.exists():
+            return True
+    return False
+
+
+def _shared_variants(name):
+    """Variants already generated for ``name`` by another row sharing the same stored file."""
+    for model, field in IMAGE_FIELDS.items():
+        field_name = variants_field(field)
+        variants = model.objects.filter(**{field: name, f'{field_name}__source': name}).values_list(field_name, flat=True).first()
+        if variants:
+            return variants
+    return None
+
+
+def needs_variants(instance):
+    field = IMAGE_FIELDS[type(instance)]
+    return (getattr(instance, field).name or None) != getattr(instance, variants_field(field)).get('source')
+
+
+def refresh_image_variants(model, pk):
+    """Regenerate the variants of one row's image. Returns whether anything was recorded."""
+    field = IMAGE_FIELDS[model]
+    row = model.objects.filter(pk=pk).values_list(field, variants_field(field)).first()
+    if row is None:
+        return False
+    name, previous = row
+    variants = (_shared_variants(name) or build_image_variants(name)) if name else {}
+    if variants is None:
+        return False
+    return save_image_variants(model, pk, name, variants, previous)
@@ -0,0 +1,45 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from app.images import IMAGE_FIELDS, build_image_variants, save_image_variants, variants_field
+
+
+class Command(BaseCommand):
+    help = "Generate missing image derivatives for recipe thumbnails, ingredient images and step pictures."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes resizing images.")
+        parser.add_argument('--force', action='store_true', help="Regenerate derivatives that are already up to date.")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for model, field in IMAGE_FIELDS.items():
+                rows = (
+                    (pk, name, previous)
+                    for pk, name, previous in model.objects.exclude(**{field: ''})
+                    .values_list('pk', field, variants_field(field))
+                    .iterator(chunk_size=2000)
+                    if options['force'] or (previous or {}).get('source') != name
+                )
+
+                written = failed = 0
+                in_flight = deque()
+                for row in rows:
+                    in_flight.append((row, pool.submit(build_image_variants, row[1])))
+                    if len(in_flight) >= 4 * workers:
+                        written, failed = self._save(model, in_flight.popleft(), written, failed)
+                while in_flight:
+                    written, failed = self._save(model, in_flight.popleft(), written, failed)
+
+                self.stdout.write(f"{model.__name__}.{field}: {written} updated, {failed} failed")
+
+    def _save(self, model, entry, written, failed):
+        (pk, name, previous), future = entry
+        variants = future.result()
+        if variants is None:
+            return written, failed + 1
+        if save_image_variants(model, pk, name, variants, previous):
+            written += 1
+        return written, failed
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from app.aggregates import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized recipe/rating counters on Recipe and Cuisine."
+
+    def handle(self, *args, **options):
+        rebuild_rating_aggregates()
+        self.stdout.write(self.style.SUCCESS("Rating aggregates rebuilt."))
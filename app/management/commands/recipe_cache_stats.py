@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from app.cache import cache_stats
+
+
+class Command(BaseCommand):
+    help = "Print hit/miss counters of the recipe read cache."
+
+    def handle(self, *args, **options):
+        for view_name, counters in cache_stats(['recipe-list', 'recipe-detail', 'cuisine-stats']).items():
+            total = counters['hits'] + counters['misses']
+            ratio = counters['hits'] / total if total else 0
+            self.stdout.write(f"{view_name}: {counters['hits']} hits, {counters['misses']} misses ({ratio:.1%} hit rate)")
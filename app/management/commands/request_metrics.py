@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand
+from app.profiling import LATENCY_BUCKETS_MS, endpoint_stats, slow_profiles
+
+
+class Command(BaseCommand):
+    help = "Print per-endpoint latency and query histograms collected by RequestMetricsMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print the full summary as JSON.")
+        parser.add_argument('--profiles', action='store_true', help="Also print the kept profiles of slow sampled requests.")
+
+    def handle(self, *args, **options):
+        stats = endpoint_stats()
+        if options['json']:
+            data = {"endpoints": stats}
+            if options['profiles']:
+                data["profiles"] = slow_profiles(stats)
+            self.stdout.write(json.dumps(data, indent=2))
+            return
+
+        def bound(value):
+            return f"<= {value}" if value is not None else f"> {LATENCY_BUCKETS_MS[-1]}"
+
+        for endpoint, summary in stats.items():
+            self.stdout.write(
+                f"{endpoint}: {summary['requests']} requests, mean {summary['mean_ms']} ms "
+                f"(p50 {bound(summary['p50_ms'])}, p95 {bound(summary['p95_ms'])}, p99 {bound(summary['p99_ms'])}, max {summary['max_ms']}), "
+                f"{summary['mean_queries']} queries / {summary['mean_db_ms']} ms SQL, "
+                f"serialize {summary['mean_serialize_ms']} ms, render {summary['mean_render_ms']} ms"
+            )
+        if options['profiles']:
+            for endpoint, profiles in slow_profiles(stats).items():
+                for profile in profiles:
+                    self.stdout.write(f"\n== {endpoint} {profile['path']} {profile['total_ms']} ms at {profile['recorded_at']}\n")
+                    self.stdout.write(profile['stats'])
@@ -0,0 +1,58 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import DEFAULT_MIX, run
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise CommandError(f"Unknown endpoint {name!r}; choose from {', '.join(DEFAULT_MIX)}.")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise CommandError(f"Invalid weight for {name!r}.")
+    return mix
+
+
+class Command(BaseCommand):
+    help = "Replay a weighted request mix against seeded benchmark data and report latency, throughput and queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help="Measured requests.")
+        parser.add_argument('--concurrency', type=int, default=4, help="Threads sending requests.")
+        parser.add_argument(
+            '--mix',
+            help="Comma-separated endpoint=weight pairs, e.g. 'list-recipes=3,detail-recipe=1'. "
+                 f"Defaults to {','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items())}.",
+        )
+        parser.add_argument('--warmup', type=int, default=50, help="Unmeasured requests sent first to warm caches.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the request sequence.")
+        parser.add_argument(
+            '--url',
+            help="Send requests over HTTP to a server running with the same database, e.g. http://localhost:8000, "
+                 "instead of in process.",
+        )
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix']) if options['mix'] else None
+        try:
+            report = run(
+                options['requests'],
+                options['concurrency'],
+                mix=mix,
+                warmup=options['warmup'],
+                seed=options['seed'],
+                url=options['url'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,78 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import benchmark_bulk_import, benchmark_matching, benchmark_sheet_memory, benchmark_similarity
+
+
+class Command(BaseCommand):
+    help = "Time one component against its naive alternative on seeded benchmark data and report a JSON summary."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='component', required=True)
+
+        matching = subparsers.add_parser('matching', help="what-can-i-cook index against the ORM query.")
+        matching.add_argument('--queries', type=int, default=200)
+        matching.add_argument('--ingredients-per-query', type=int, default=8)
+        matching.add_argument('--max-missing', type=int, default=1)
+        matching.add_argument('--limit', type=int, default=20)
+        matching.add_argument('--replays', type=int, default=50, help="Published changes caught up with by replay.")
+        matching.add_argument('--seed', type=int, default=0)
+
+        similarity = subparsers.add_parser('similarity', help="Incremental recommendation refresh against a full rebuild.")
+        similarity.add_argument('--refreshes', type=int, default=20)
+        similarity.add_argument('--recipes-per-refresh', type=int, default=1)
+        similarity.add_argument('--changes', type=int, default=5, help="Ratings re-scored per refreshed recipe.")
+        similarity.add_argument('--seed', type=int, default=0)
+
+        bulk_import = subparsers.add_parser('bulk-import', help="Set-based bulk import against the row-by-row ORM import.")
+        bulk_import.add_argument('--rows', type=int, default=1000)
+        bulk_import.add_argument('--ingredients-per-row', type=int, default=3)
+        bulk_import.add_argument('--invalid-every', type=int, default=50, help="Make every Nth row reference an unknown cuisine; 0 for none.")
+        bulk_import.add_argument('--seed', type=int, default=0)
+
+        sheet_memory = subparsers.add_parser('sheet-memory', help="Peak RSS of reading bulk-upload sheets, streamed and fully loaded.")
+        sheet_memory.add_argument('--rows', type=int, nargs='+', default=[1000, 100000])
+        sheet_memory.add_argument('--full-load-max-rows', type=int, default=100000, help="Largest sheet also read fully into memory.")
+        sheet_memory.add_argument('--seed', type=int, default=0)
+
+        for subparser in subparsers.choices.values():
+            subparser.add_argument('--output', help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            if options['component'] == 'matching':
+                report = benchmark_matching(
+                    queries=options['queries'],
+                    ingredients_per_query=options['ingredients_per_query'],
+                    max_missing=options['max_missing'],
+                    limit=options['limit'],
+                    replays=options['replays'],
+                    seed=options['seed'],
+                )
+            elif options['component'] == 'similarity':
+                report = benchmark_similarity(
+                    refreshes=options['refreshes'],
+                    recipes_per_refresh=options['recipes_per_refresh'],
+                    changes=options['changes'],
+                    seed=options['seed'],
+                )
+            elif options['component'] == 'bulk-import':
+                report = benchmark_bulk_import(
+                    rows=options['rows'],
+                    ingredients_per_row=options['ingredients_per_row'],
+                    invalid_every=options['invalid_every'],
+                    seed=options['seed'],
+                )
+            elif options['component'] == 'sheet-memory':
+                report = benchmark_sheet_memory(
+                    rows=options['rows'],
+                    full_load_max_rows=options['full_load_max_rows'],
+                    seed=options['seed'],
+                )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand
+from app.benchmark import reset, seed
+
+
+class Command(BaseCommand):
+    help = "Fill the database with reproducible synthetic data for run_benchmark."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Benchmark users; a tenth of them are creators.")
+        parser.add_argument('--cuisines', type=int, default=30)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ratings', type=int, default=50000)
+        parser.add_argument('--favourites', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed produces the same data.")
+        parser.add_argument('--reset', action='store_true', help="Delete previously seeded benchmark data first.")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset()
+        created = seed(
+            users=options['users'],
+            cuisines=options['cuisines'],
+            ingredients=options['ingredients'],
+            recipes=options['recipes'],
+            ratings=options['ratings'],
+            favourites=options['favourites'],
+            seed=options['seed'],
+        )
+        self.stdout.write(json.dumps(created))
@@ -0,0 +1,307 @@
+import heapq
+import re
+import threading
+import time
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .cache import KEY_PREFIX, get_versions
+from .models import RecipeIngredient
+
+INDEX_NAMESPACE = 'ingredient-index'
+# Seconds the recipe ids changed in a version stay available for replay.
+CHANGES_TIMEOUT = 3600
+
+_nonzero_byte = re.compile(rb'[^\x00]')
+
+
+def _planes_add(planes, mask):
+    """Add ``mask`` (one bit per recipe) to bit-sliced per-recipe counters."""
+    carry = mask
+    for k, plane in enumerate(planes):
+        planes[k] = plane ^ carry
+        carry &= plane
+        if not carry:
+            return
+    planes.append(carry)
+
+
+def _set_bit(mask, position, value):
+    return mask | (1 << position) if value else mask & ~(1 << position)
+
+
+class IngredientIndex:
+    """
+    In-memory inverted index from ingredient id to the recipes using it.
+
+    Recipes are mapped to dense integer positions and every ingredient's
+    posting list is a Python int used as a bitset over those positions.
+    Recipe sizes are stored bit-sliced (``size_planes[k]`` has the bit of
+    every recipe whose ingredient count has bit ``k`` set), so a query can
+    count matches and compare them against sizes for all recipes at once
+    with a few big-int operations per query ingredient.
+    """
+
+    _state = ('recipe_ids', 'positions', 'free_positions', 'recipe_ingredients', 'postings', 'size_planes')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._reset()
+
+    def _reset(self):
+        self.recipe_ids = []
+        self.positions = {}
+        self.free_positions = []
+        self.recipe_ingredients = {}
+        self.postings = {}
+        self.size_planes = []
+
+    def _version_key(self):
+        return f'{KEY_PREFIX}:version:{INDEX_NAMESPACE}'
+
+    def _changes_key(self, version):
+        return f'{KEY_PREFIX}:{INDEX_NAMESPACE}:changes:{version}'
+
+    def ensure_fresh(self):
+        """
+        Catch up with ingredient changes made by other processes, checking at
+        most every INGREDIENT_INDEX_REFRESH seconds. Changes are replayed from
+        the recipe ids published with each version; the index is rebuilt only
+        when they are too many or have expired. One thread catches up while
+        the others keep answering from the current index.
+        """
+        if self._version is not None and time.monotonic() - self._checked_at < settings.INGREDIENT_INDEX_REFRESH:
+            return
+        if not self._refresh_lock.acquire(blocking=self._version is None):
+            return
+        try:
+            now = time.monotonic()
+            if self._version is not None and now - self._checked_at < settings.INGREDIENT_INDEX_REFRESH:
+                return
+            current, = get_versions([INDEX_NAMESPACE])
+            if current != self._version and not self._replay(current):
+                self.rebuild(current)
+                # Changes committed while rebuilding are in the change log.
+                current, = get_versions([INDEX_NAMESPACE])
+                if current != self._version:
+                    self._replay(current)
+            self._checked_at = now
+        finally:
+            self._refresh_lock.release()
+
+    def _replay(self, current):
+        """
+        Re-read the recipes published with every version after ours up to
+        ``current``. Returns False, leaving the index untouched, when some
+        versions have expired or they changed more than
+        INGREDIENT_INDEX_MAX_REPLAY recipes.
+        """
+        limit = settings.INGREDIENT_INDEX_MAX_REPLAY
+        if self._version is None or not 0 < current - self._version <= limit:
+            return False
+        keys = [self._changes_key(version) for version in range(self._version + 1, current + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return False
+        recipe_ids = set().union(*changes.values())
+        if len(recipe_ids) > limit:
+            return False
+        with self._lock:
+            for recipe_id, ingredient_ids in self._load(recipe_ids).items():
+                self._apply(recipe_id, ingredient_ids)
+            self._version = max(self._version, current)
+        return True
+
+    def _load(self, recipe_ids):
+        rows = RecipeIngredient.objects.filter(recipe_id__in=recipe_ids).values_list('recipe_id', 'ingredient_id')
+        grouped = {recipe_id: set() for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in rows:
+            grouped[recipe_id].add(ingredient_id)
+        return grouped
+
+    def rebuild(self, version=None):
+        """
+        Build the index from every RecipeIngredient row. The new index is
+        built aside and swapped in, so queries are not blocked meanwhile.
+        """
+        if version is None:
+            version, = get_versions([INDEX_NAMESPACE])
+        fresh = IngredientIndex()
+        rows = RecipeIngredient.objects.order_by().values_list('recipe_id', 'ingredient_id')
+        grouped = {}
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=10000):
+            grouped.setdefault(recipe_id, set()).add(ingredient_id)
+        for recipe_id, ingredient_ids in grouped.items():
+            fresh._apply(recipe_id, ingredient_ids)
+        with self._lock:
+            for name in self._state:
+                setattr(self, name, getattr(fresh, name))
+            self._version = version
+
+    def _apply(self, recipe_id, ingredient_ids):
+        position = self.positions.get(recipe_id)
+        if position is None:
+            if not ingredient_ids:
+                return
+            position = self.free_positions.pop() if self.free_positions else len(self.recipe_ids)
+            if position == len(self.recipe_ids):
+                self.recipe_ids.append(recipe_id)
+            else:
+                self.recipe_ids[position] = recipe_id
+            self.positions[recipe_id] = position
+
+        old = self.recipe_ingredients.get(position, frozenset())
+        new = frozenset(ingredient_ids)
+        bit = 1 << position
+        for ingredient_id in old - new:
+            remaining = self.postings[ingredient_id] & ~bit
+            if remaining:
+                self.postings[ingredient_id] = remaining
+            else:
+                del self.postings[ingredient_id]
+        for ingredient_id in new - old:
+            self.postings[ingredient_id] = self.postings.get(ingredient_id, 0) | bit
+
+        size = len(new)
+        while size >> len(self.size_planes):
+            self.size_planes.append(0)
+        for k in range(len(self.size_planes)):
+            self.size_planes[k] = _set_bit(self.size_planes[k], position, (size >> k) & 1)
+
+        if new:
+            self.recipe_ingredients[position] = new
+        else:
+            self.recipe_ingredients.pop(position, None)
+            del self.positions[recipe_id]
+            self.recipe_ids[position] = None
+            self.free_positions.append(position)
+
+    def refresh_recipes(self, recipe_ids):
+        """
+        Re-read the ingredient rows of the given recipes and patch them into
+        the index, then publish them with a new version so other processes
+        can replay the change.
+        """
+        recipe_ids = set(recipe_ids)
+        grouped = self._load(recipe_ids)
+
+        with self._lock:
+            previous, = get_versions([INDEX_NAMESPACE])
+            current = cache.incr(self._version_key())
+            cache.set(self._changes_key(current), recipe_ids, timeout=CHANGES_TIMEOUT)
+            if self._version is None:
+                return
+            for recipe_id, ingredient_ids in grouped.items():
+                self._apply(recipe_id, ingredient_ids)
+            # Only claim the new version if nobody else changed anything in
+            # between; otherwise the next ensure_fresh() replays their change.
+            if self._version == previous:
+                self._version = current
+
+    def match(self, ingredient_ids, max_missing=0, limit=20):
+        """
+        Recipes sharing at least one of ``ingredient_ids`` and missing at most
+        ``max_missing`` of their own ingredients, best covered first.
+        Returns ``[(recipe_id, matched_count, total_count), ...]``.
+        """
+        assert max_missing >= 0, max_missing
+        self.ensure_fresh()
+        with self._lock:
+            masks = [self.postings[i] for i in set(ingredient_ids) if i in self.postings]
+            if not masks:
+                return []
+
+            counts = []
+            for mask in masks:
+                _planes_add(counts, mask)
+            candidates = 0
+            for plane in counts:
+                candidates |= plane
+
+            # missing = size - matched, computed bit-sliced with a borrow chain.
+            width = max(len(counts), len(self.size_planes))
+            sizes = self.size_planes + [0] * (width - len(self.size_planes))
+            counts += [0] * (width - len(counts))
+            missing = []
+            borrow = 0
+            for size, count in zip(sizes, counts):
+                missing.append((size ^ count ^ borrow) & candidates)
+                borrow = ((~size & count) | (~(size ^ count) & borrow)) & candidates
+
+            # missing <= max_missing, compared most significant bit first.
+            if max_missing >> width:
+                within = candidates
+            else:
+                equal, less = candidates, 0
+                for k in reversed(range(width)):
+                    if (max_missing >> k) & 1:
+                        less |= equal & ~missing[k]
+                        equal &= missing[k]
+                    else:
+                        equal &= ~missing[k]
+                within = (less | equal) & candidates
+
+            if not within:
+                return []
+            nbytes = (within.bit_length() + 7) // 8
+            count_bytes = [plane.to_bytes(nbytes, 'little') for plane in (c & within for c in counts)]
+            missing_bytes = [plane.to_bytes(nbytes, 'little') for plane in (m & within for m in missing)]
+
+            def value(planes_bytes, position):
+                byte, bit = position >> 3, position & 7
+                return sum(((planes_bytes[k][byte] >> bit) & 1) << k for k in range(len(planes_bytes)))
+
+            results = []
+            for found in _nonzero_byte.finditer(within.to_bytes(nbytes, 'little')):
+                byte_index, byte = found.start(), found.group()[0]
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        position = byte_index * 8 + bit
+                        matched = value(count_bytes, position)
+                        results.append((value(missing_bytes, position), -matched, position))
+
+            best = heapq.nsmallest(limit, results)
+            return [
+                (self.recipe_ids[position], -negative_matched, -negative_matched + missing_count)
+                for missing_count, negative_matched, position in best
+            ]
+
+
+ingredient_index = IngredientIndex()
+
+
+_pending = threading.local()
+
+
+def _refresh_pending(recipe_ids):
+    _pending.callback = None
+    ingredient_index.refresh_recipes(recipe_ids)
+
+
+def recipe_ingredients_changed(recipe_ids):
+    """
+    Patch the index for recipes whose ingredient rows changed once the
+    current transaction commits; a rollback discards the refresh with it.
+    Every call within one transaction adds to the same set of ids, which a
+    single on_commit callback refreshes.
+    """
+    recipe_ids = set(recipe_ids)
+    if not recipe_ids:
+        return
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        ingredient_index.refresh_recipes(recipe_ids)
+        return
+
+    callback = getattr(_pending, 'callback', None)
+    # A rollback drops the callback from run_on_commit; its ids are then
+    # stale and a new set starts. Ids left over from a rolled-back savepoint
+    # only cause a harmless re-read.
+    if callback is None or not any(entry[1] is callback for entry in connection.run_on_commit):
+        callback = _pending.callback = partial(_refresh_pending, set())
+        transaction.on_commit(callback)
+    callback.args[0].update(recipe_ids)
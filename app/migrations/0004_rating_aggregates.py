@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:34
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_aggregates(apps, schema_editor):
+    Cuisine = apps.get_model('app', 'Cuisine')
+    Recipe = apps.get_model('app', 'Recipe')
+    Rating = apps.get_model('app', 'Rating')
+
+    totals = Rating.objects.values('recipe').annotate(count=Count('id'), total=Sum('score')).order_by()
+    for row in totals:
+        Recipe.objects.filter(pk=row['recipe']).update(rating_count=row['count'], rating_sum=row['total'])
+
+    totals = Recipe.objects.filter(cuisine__isnull=False).values('cuisine').annotate(
+        recipes=Count('id'), count=Sum('rating_count'), total=Sum('rating_sum')
+    ).order_by()
+    for row in totals:
+        Cuisine.objects.filter(pk=row['cuisine']).update(
+            recipe_count=row['recipes'], rating_count=row['count'], rating_sum=row['total']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_bulk_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuisine',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cuisine',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cuisine',
+            name='recipe_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
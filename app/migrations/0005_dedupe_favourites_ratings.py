@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def dedupe_favourites_ratings(apps, schema_editor):
+    Cuisine = apps.get_model('app', 'Cuisine')
+    Recipe = apps.get_model('app', 'Recipe')
+    Favourite = apps.get_model('app', 'Favourite')
+    Rating = apps.get_model('app', 'Rating')
+
+    duplicates = Favourite.objects.values('user', 'recipe').annotate(n=Count('id')).filter(n__gt=1).order_by()
+    for row in duplicates:
+        ids = list(Favourite.objects.filter(user=row['user'], recipe=row['recipe']).order_by('id').values_list('id', flat=True))
+        Favourite.objects.filter(id__in=ids[1:]).delete()
+
+    affected_recipes = set()
+    duplicates = Rating.objects.values('user', 'recipe').annotate(n=Count('id')).filter(n__gt=1).order_by()
+    for row in duplicates:
+        ids = list(Rating.objects.filter(user=row['user'], recipe=row['recipe']).order_by('id').values_list('id', flat=True))
+        Rating.objects.filter(id__in=ids[1:]).delete()
+        affected_recipes.add(row['recipe'])
+
+    # The duplicates were counted in the denormalized aggregates as well.
+    affected_cuisines = set()
+    for recipe in Recipe.objects.filter(pk__in=affected_recipes):
+        totals = Rating.objects.filter(recipe=recipe).aggregate(count=Count('id'), total=Sum('score'))
+        recipe.rating_count = totals['count']
+        recipe.rating_sum = totals['total'] or 0
+        recipe.save(update_fields=['rating_count', 'rating_sum'])
+        if recipe.cuisine_id:
+            affected_cuisines.add(recipe.cuisine_id)
+
+    for cuisine in Cuisine.objects.filter(pk__in=affected_cuisines):
+        totals = Recipe.objects.filter(cuisine=cuisine).aggregate(count=Sum('rating_count'), total=Sum('rating_sum'))
+        cuisine.rating_count = totals['count'] or 0
+        cuisine.rating_sum = totals['total'] or 0
+        cuisine.save(update_fields=['rating_count', 'rating_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_favourites_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:40
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx')
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes and tsvector only exist on Postgres; on SQLite the column is
+    # left empty and search falls back to icontains.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    Recipe = apps.get_model('app', 'Recipe')
+    RecipeIngredient = apps.get_model('app', 'RecipeIngredient')
+    schema_editor.add_index(Recipe, SEARCH_INDEX)
+
+    # Frozen copy of app.search.recipe_search_vector() as of this migration.
+    ingredient_names = Subquery(
+        RecipeIngredient.objects.filter(recipe=OuterRef('pk'))
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    Recipe.objects.update(search_vector=(
+        SearchVector('title', weight='A')
+        + SearchVector(ingredient_names, weight='B')
+        + SearchVector('description', weight='C')
+        + SearchVector('instructions', weight='D')
+    ))
+
+
+def drop_search_index(apps, schema_editor):
+    # Later migrations that rebuild the table on SQLite recreate the index
+    # from the model state, so drop it on every backend if present.
+    schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(SEARCH_INDEX.name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_unique_favourite_rating_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='recipe', index=SEARCH_INDEX),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
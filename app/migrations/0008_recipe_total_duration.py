@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:43
+
+import django.db.models.expressions
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_recipe_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='total_duration',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('prep_duration'), '+', models.F('cook_duration')), help_text='in minutes', output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['total_duration'], name='recipe_total_duration_idx'),
+        ),
+    ]
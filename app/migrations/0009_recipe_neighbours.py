@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_recipe_total_duration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeNeighbours',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='app.recipe')),
+                ('neighbour_ids', models.JSONField(default=list, help_text='most similar recipe ids, best first')),
+                ('scores', models.JSONField(default=list, help_text='cosine similarity for each neighbour_ids entry')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:47
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_recipe_neighbours'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favourite',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='favourite',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='favourite_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:52
+
+import app.storage
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='image',
+            field=models.ImageField(storage=app.storage.ContentAddressedStorage(), upload_to='ingredient_images/'),
+        ),
+        migrations.AlterField(
+            model_name='steppicture',
+            name='image',
+            field=models.ImageField(storage=app.storage.ContentAddressedStorage(), upload_to='step_pictures/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ref_count', 'updated_at'], name='stored_blob_unused_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_stored_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeneighbours',
+            name='norm',
+            field=models.FloatField(help_text="length of the recipe's interaction vector, reused by incremental refreshes", null=True),
+        ),
+    ]
@@ -1,15 +1,30 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 import uuid
 from users.models import CustomUser
+from .storage import ContentAddressedStorage
 
 class Cuisine(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     name = models.CharField(max_length=100, unique=True)
+    recipe_count = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
 
 class Ingredient(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     name = models.CharField(max_length=100)
-    image = models.ImageField(upload_to='ingredient_images/')
+    image = models.ImageField(upload_to='ingredient_images/', storage=ContentAddressedStorage())
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+class RecipeQuerySet(models.QuerySet):
+    def for_detail(self):
+        return self.select_related('cuisine').prefetch_related(
+            models.Prefetch('ingredients', queryset=Ingredient.objects.all()),
+            models.Prefetch('step_pictures', queryset=StepPicture.objects.all()),
+        )
 
 class Recipe(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
@@ -22,7 +37,30 @@ class Recipe(models.Model):
     prep_duration = models.IntegerField(help_text="in minutes")
     cook_duration = models.IntegerField(help_text="in minutes")
     thumbnail = models.ImageField(upload_to='thumbnails/')
+    thumbnail_variants = models.JSONField(default=dict, blank=True, editable=False)
     step_pictures = models.ManyToManyField('StepPicture')
+    created_at = models.DateTimeField(default=timezone.now)
+    total_duration = models.GeneratedField(
+        expression=models.F('prep_duration') + models.F('cook_duration'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+        help_text="in minutes",
+    )
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='recipe_created_id_idx'),
+            models.Index(fields=['creator', '-created_at'], name='recipe_creator_created_idx'),
+            models.Index(fields=['cuisine', '-created_at'], name='recipe_cuisine_created_idx'),
+            models.Index(fields=['total_duration'], name='recipe_total_duration_idx'),
+            GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ]
 
 class RecipeIngredient(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
@@ -31,15 +69,101 @@ class RecipeIngredient(models.Model):
 
 class StepPicture(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
-    image = models.ImageField(upload_to='step_pictures/')
+    image = models.ImageField(upload_to='step_pictures/', storage=ContentAddressedStorage())
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+class FavouriteQuerySet(models.QuerySet):
+    def with_recipes(self):
+        return self.select_related('recipe__cuisine').prefetch_related(
+            models.Prefetch('recipe__ingredients', queryset=Ingredient.objects.all()),
+            models.Prefetch('recipe__step_pictures', queryset=StepPicture.objects.all()),
+        )
 
 class Favourite(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='favourites')
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = FavouriteQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'], name='unique_favourite_user_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='favourite_user_created_idx'),
+        ]
 
 class Rating(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    score = models.IntegerField() 
+    score = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'], name='unique_rating_user_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['recipe', 'score'], name='rating_recipe_score_idx'),
+        ]
+
+class BulkImportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='bulk_import_jobs')
+    file_path = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total_rows = models.IntegerField(null=True, blank=True, help_text="set once the whole sheet has been dispatched")
+    processed_rows = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def pending_rows(self):
+        if self.total_rows is None:
+            return None
+        return self.total_rows - self.processed_rows - self.failed_rows
+
+class BulkImportRowError(models.Model):
+    job = models.ForeignKey(BulkImportJob, on_delete=models.CASCADE, related_name='row_errors')
+    row = models.IntegerField()
+    error = models.TextField()
+
+    class Meta:
+        ordering = ['row']
+        indexes = [
+            models.Index(fields=['job', 'row'], name='bulk_error_job_row_idx'),
+        ]
+
+class RecipeNeighbours(models.Model):
+    recipe = models.OneToOneField(Recipe, on_delete=models.CASCADE, primary_key=True, related_name='neighbours')
+    neighbour_ids = models.JSONField(default=list, help_text="most similar recipe ids, best first")
+    scores = models.JSONField(default=list, help_text="cosine similarity for each neighbour_ids entry")
+    norm = models.FloatField(null=True, help_text="length of the recipe's interaction vector, reused by incremental refreshes")
+    updated_at = models.DateTimeField(auto_now=True)
+
+class StoredBlob(models.Model):
+    """Reference count of a file kept by ContentAddressedStorage."""
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at'], name='stored_blob_unused_idx'),
+        ]
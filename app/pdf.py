@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import multiprocessing
+import threading
+import zipfile
+from collections import deque
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.utils.text import slugify
+from xhtml2pdf import pisa
+from .cache import CATALOG, KEY_PREFIX, get_versions, recipe_namespace
+
+logger = logging.getLogger(__name__)
+
+PDF_DIR = 'recipe_pdfs'
+
+
+def render_recipe_html(recipe):
+    return render_to_string("pdf/recipe_card.html", {"recipe": recipe})
+
+
+def html_to_pdf(html):
+    buffer = BytesIO()
+    if pisa.CreatePDF(html, dest=buffer).err:
+        return None
+    return buffer.getvalue()
+
+
+def html_digest(html):
+    return hashlib.sha256(html.encode()).hexdigest()
+
+
+def recipe_pdf_dir(recipe_id):
+    return f'{PDF_DIR}/{recipe_id}'
+
+
+def recipe_pdf_path(recipe_id, digest):
+    return f'{recipe_pdf_dir(recipe_id)}/{digest}.pdf'
+
+
+def _digest_key(recipe_id):
+    versions = get_versions([recipe_namespace(recipe_id), CATALOG])
+    return f"{KEY_PREFIX}:pdf-digest:{recipe_id}:{':'.join(map(str, versions))}"
+
+
+def cached_card(recipe_id):
+    """
+    ``(digest, title)`` of the card for the recipe's current cache version,
+    if known. Lets repeat downloads skip both the database and the template
+    render.
+    """
+    return cache.get(_digest_key(recipe_id))
+
+
+def remember_card(recipe_id, digest, title):
+    cache.set(_digest_key(recipe_id), (digest, title), timeout=settings.RECIPE_CACHE_TIMEOUT)
+
+
+def pending_key(recipe_id, digest):
+    return f'{KEY_PREFIX}:pdf-pending:{recipe_id}:{digest}'
+
+
+def failed_key(recipe_id, digest):
+    return f'{KEY_PREFIX}:pdf-failed:{recipe_id}:{digest}'
+
+
+def delete_recipe_pdfs(recipe_id, keep=None):
+    directory = recipe_pdf_dir(recipe_id)
+    if not default_storage.exists(directory):
+        return
+    _, files = default_storage.listdir(directory)
+    for name in files:
+        if name != keep:
+            default_storage.delete(f'{directory}/{name}')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _render_pool(broken=None):
+    """
+    The process pool shared by every export in this process, started on
+    first use with PDF_EXPORT_WORKERS processes. Workers are started by a
+    fork server, never forked from this multi-threaded process. Pass the
+    pool that turned out to be ``broken`` to replace it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool is broken:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PDF_EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver'),
+            )
+        return _pool
+
+
+def _submit_render(html):
+    pool = _render_pool()
+    try:
+        return pool.submit(html_to_pdf, html)
+    except BrokenProcessPool:
+        return _render_pool(broken=pool).submit(html_to_pdf, html)
+
+
+def render_card(recipe_id, digest, html, wait):
+    """
+    Render a card in the shared process pool and store it under ``digest``,
+    waiting at most ``wait`` seconds. Returns True once the card is stored
+    and False if rendering failed. Returns None if the render is still
+    running; the pool then stores the card, or records the failure, when it
+    finishes. ``pending_key`` is cleared either way.
+    """
+    future = _submit_render(html)
+    if not futures.wait([future], timeout=wait).done:
+        future.add_done_callback(lambda done: _store_card(recipe_id, digest, done))
+        return None
+    return _store_card(recipe_id, digest, future)
+
+
+def _store_card(recipe_id, digest, future):
+    try:
+        pdf = future.result()
+    except Exception:
+        logger.exception("PDF rendering crashed for recipe %s", recipe_id)
+        pdf = None
+
+    if pdf is None:
+        logger.error("PDF generation failed for recipe %s", recipe_id)
+        cache.set(failed_key(recipe_id, digest), True, timeout=300)
+    else:
+        default_storage.save(recipe_pdf_path(recipe_id, digest), ContentFile(pdf))
+        delete_recipe_pdfs(recipe_id, keep=f'{digest}.pdf')
+    cache.delete(pending_key(recipe_id, digest))
+    return pdf is not None
+
+
+def _rendered_cards(recipes):
+    """
+    Yield ``(recipe, pdf_bytes)`` in the order of ``recipes``. Cards already
+    stored for the recipe's current version are read from storage; the rest
+    are rendered in the shared process pool. At most
+    ``2 * PDF_EXPORT_WORKERS`` cards are in flight per export, so memory
+    stays bounded however many recipes are exported.
+    """
+    in_flight = deque()
+    for recipe in recipes:
+        html = render_recipe_html(recipe)
+        path = recipe_pdf_path(recipe.pk, html_digest(html))
+        if default_storage.exists(path):
+            with default_storage.open(path, 'rb') as stored:
+                in_flight.append((recipe, stored.read()))
+        else:
+            in_flight.append((recipe, _submit_render(html)))
+
+        if len(in_flight) >= 2 * settings.PDF_EXPORT_WORKERS:
+            yield _resolve(*in_flight.popleft())
+    while in_flight:
+        yield _resolve(*in_flight.popleft())
+
+
+def _resolve(recipe, pdf):
+    if not isinstance(pdf, bytes):
+        pdf = pdf.result()
+    return recipe, pdf
+
+
+class _ZipSink:
+    """Write-only file object that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self.buffer = BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def stream_recipe_cards_zip(recipes):
+    """
+    Generate a zip archive of recipe cards chunk by chunk, one card per
+    yielded chunk, for use with ``StreamingHttpResponse``.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for recipe, pdf in _rendered_cards(recipes):
+            if pdf is None:
+                logger.error("PDF generation failed for recipe %s during export", recipe.pk)
+                continue
+            archive.writestr(f"{slugify(recipe.title) or 'recipe'}-{str(recipe.pk)[:8]}.pdf", pdf)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,306 @@
+"""
+Per-endpoint request metrics: query count, SQL time, serializer and render
+time, reported in a ``Server-Timing`` header and aggregated into histograms.
+
+Each process keeps its own histograms and publishes a snapshot to the cache
+every REQUEST_METRICS_FLUSH_INTERVAL seconds; ``endpoint_stats()`` merges the
+snapshots of all processes for the ``request_metrics`` command and the
+``request-metrics/`` endpoint. With REQUEST_PROFILE_SAMPLE_RATE above zero a
+sample of requests runs under cProfile and the profiles of those slower than
+REQUEST_PROFILE_SLOW_MS are kept for inspection.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import socket
+import threading
+import time
+from bisect import bisect_left
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from .cache import KEY_PREFIX
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SECTIONS = ('db', 'serialize', 'render')
+
+PROFILES_KEPT = 5
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters for one request."""
+
+    __slots__ = ('queries', 'sections')
+
+    def __init__(self):
+        self.queries = 0
+        self.sections = dict.fromkeys(SECTIONS, 0.0)
+
+
+def count_queries(execute, sql, params, many, context):
+    """``execute_wrapper`` feeding the metrics of the request being served, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.sections['db'] += time.perf_counter() - start
+
+
+def instrument_connection(connection):
+    """
+    Install ``count_queries`` on a database connection for good. Connections
+    are per thread, so wrapping them per request would miss the queries an
+    async view runs in ``sync_to_async`` threads; the request is found
+    through a context variable instead, which follows it into those threads.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block to ``section`` of the current request, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.sections[section] += time.perf_counter() - start
+
+
+class InstrumentedViewMixin:
+    """
+    APIView mixin that attributes serializer and render time to the request
+    being measured by RequestMetricsMiddleware.
+    """
+
+    def serialize(self, serializer):
+        with timed('serialize'):
+            return serializer.data
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Rendered here rather than lazily by the handler so it can be timed.
+        if _current.get() is not None and hasattr(response, 'render') and not response.is_rendered:
+            with timed('render'):
+                response.render()
+        return response
+
+
+def _empty_stats():
+    return {
+        'count': 0,
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        'query_buckets': [0] * (len(QUERY_BUCKETS) + 1),
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'queries': 0,
+        **{f'{section}_ms': 0.0 for section in SECTIONS},
+    }
+
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = time.monotonic()
+_processes_key = f'{KEY_PREFIX}:metrics:processes'
+
+
+def _record(endpoint, total_ms, metrics):
+    global _last_flush
+    with _lock:
+        stats = _stats.get(endpoint)
+        if stats is None:
+            stats = _stats[endpoint] = _empty_stats()
+        stats['count'] += 1
+        stats['latency_buckets'][bisect_left(LATENCY_BUCKETS_MS, total_ms)] += 1
+        stats['query_buckets'][bisect_left(QUERY_BUCKETS, metrics.queries)] += 1
+        stats['total_ms'] += total_ms
+        stats['max_ms'] = max(stats['max_ms'], total_ms)
+        stats['queries'] += metrics.queries
+        for section, seconds in metrics.sections.items():
+            stats[f'{section}_ms'] += seconds * 1000
+
+        now = time.monotonic()
+        if now - _last_flush < settings.REQUEST_METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = now
+        snapshot = _snapshot()
+    flush(snapshot)
+
+
+def _snapshot():
+    return {
+        endpoint: {**stats, 'latency_buckets': list(stats['latency_buckets']), 'query_buckets': list(stats['query_buckets'])}
+        for endpoint, stats in _stats.items()
+    }
+
+
+def flush(snapshot=None):
+    """Publish this process's histograms so other processes can read them."""
+    if snapshot is None:
+        with _lock:
+            snapshot = _snapshot()
+    # Resolved per call: pre-forking servers import this module before forking.
+    process_key = f'{KEY_PREFIX}:metrics:process:{socket.gethostname()}:{os.getpid()}'
+    cache.set(process_key, snapshot, timeout=SNAPSHOT_TIMEOUT)
+    processes = cache.get(_processes_key) or []
+    if process_key not in processes:
+        cache.set(_processes_key, processes + [process_key], timeout=None)
+
+
+def _quantile(buckets, count, q):
+    """Upper bound of the bucket holding the q-quantile (``None`` past the last bound)."""
+    target = q * count
+    seen = 0
+    for index, bucket_count in enumerate(buckets):
+        seen += bucket_count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def endpoint_stats():
+    """Merged per-endpoint summary of every process that published metrics, slowest mean first."""
+    processes = cache.get(_processes_key) or []
+    snapshots = cache.get_many(processes)
+    live = [key for key in processes if key in snapshots]
+    if len(live) != len(processes):
+        cache.set(_processes_key, live, timeout=None)
+
+    merged = {}
+    for snapshot in snapshots.values():
+        for endpoint, stats in snapshot.items():
+            total = merged.setdefault(endpoint, _empty_stats())
+            for key, value in stats.items():
+                if key == 'max_ms':
+                    total[key] = max(total[key], value)
+                elif isinstance(value, list):
+                    total[key] = [a + b for a, b in zip(total[key], value)]
+                else:
+                    total[key] += value
+
+    summary = {}
+    for endpoint, stats in merged.items():
+        count = stats['count']
+        summary[endpoint] = {
+            'requests': count,
+            'mean_ms': round(stats['total_ms'] / count, 2),
+            'p50_ms': _quantile(stats['latency_buckets'], count, 0.50),
+            'p95_ms': _quantile(stats['latency_buckets'], count, 0.95),
+            'p99_ms': _quantile(stats['latency_buckets'], count, 0.99),
+            'max_ms': round(stats['max_ms'], 2),
+            'mean_queries': round(stats['queries'] / count, 2),
+            **{f'mean_{section}_ms': round(stats[f'{section}_ms'] / count, 2) for section in SECTIONS},
+            'latency_buckets_ms': dict(zip([*map(str, LATENCY_BUCKETS_MS), 'inf'], stats['latency_buckets'])),
+            'query_buckets': dict(zip([*map(str, QUERY_BUCKETS), 'inf'], stats['query_buckets'])),
+        }
+    return dict(sorted(summary.items(), key=lambda item: item[1]['mean_ms'], reverse=True))
+
+
+def _profiles_key(endpoint):
+    return f'{KEY_PREFIX}:metrics:profiles:{endpoint}'
+
+
+def _keep_profile(endpoint, profiler, total_ms, path):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+    profile = {
+        'path': path,
+        'total_ms': round(total_ms, 2),
+        'recorded_at': timezone.now().isoformat(),
+        'stats': output.getvalue(),
+    }
+    key = _profiles_key(endpoint)
+    profiles = cache.get(key) or []
+    cache.set(key, ([profile] + profiles)[:PROFILES_KEPT], timeout=SNAPSHOT_TIMEOUT)
+
+
+def slow_profiles(endpoints):
+    profiles = cache.get_many([_profiles_key(endpoint) for endpoint in endpoints])
+    return {endpoint: profiles[_profiles_key(endpoint)] for endpoint in endpoints if _profiles_key(endpoint) in profiles}
+
+
+def _endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name if match.url_name else match.route
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        profiler = None
+        if settings.REQUEST_PROFILE_SAMPLE_RATE and random.random() < settings.REQUEST_PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _current.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        endpoint = self.finish(request, response, metrics, total_ms)
+        if profiler is not None and total_ms >= settings.REQUEST_PROFILE_SLOW_MS:
+            _keep_profile(endpoint, profiler, total_ms, request.get_full_path())
+        return response
+
+    async def __acall__(self, request):
+        # Not profiled: cProfile follows a thread, and the event loop thread
+        # interleaves many requests.
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        self.finish(request, response, metrics, total_ms)
+        return response
+
+    def finish(self, request, response, metrics, total_ms):
+        endpoint = _endpoint(request)
+        response['Server-Timing'] = ', '.join(
+            [f'db;dur={metrics.sections["db"] * 1000:.1f};desc="{metrics.queries} queries"']
+            + [f'{section};dur={metrics.sections[section] * 1000:.1f}' for section in SECTIONS[1:] if metrics.sections[section]]
+            + [f'total;dur={total_ms:.1f}']
+        )
+        _record(endpoint, total_ms, metrics)
+        return endpoint
@@ -0,0 +1,49 @@
+import uuid
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from .cache import KEY_PREFIX
+from .models import Favourite, Rating, RecipeNeighbours
+
+# Ratings at or above this score count as "liked" alongside favourites.
+LIKED_SCORE = 4
+
+
+def recommend_recipe_ids(user, limit):
+    """
+    Merge the precomputed neighbour lists of the recipes ``user`` liked,
+    summing similarities per candidate. Three queries, no matrix maths.
+    """
+    ratings = dict(Rating.objects.filter(user=user).values_list('recipe_id', 'score'))
+    liked = set(Favourite.objects.filter(user=user).values_list('recipe_id', flat=True))
+    liked.update(recipe_id for recipe_id, score in ratings.items() if score >= LIKED_SCORE)
+    if not liked:
+        return []
+
+    seen = {str(recipe_id) for recipe_id in liked.union(ratings)}
+
+    totals = defaultdict(float)
+    for neighbour_ids, scores in RecipeNeighbours.objects.filter(recipe_id__in=liked).values_list('neighbour_ids', 'scores'):
+        for neighbour_id, score in zip(neighbour_ids, scores):
+            if neighbour_id not in seen:
+                totals[neighbour_id] += score
+
+    best = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(uuid.UUID(recipe_id), score) for recipe_id, score in best]
+
+
+def schedule_similarity_refresh(*recipe_ids):
+    """
+    Queue an incremental neighbour refresh for recipes whose interactions
+    changed, at most once per recipe every RECOMMENDATION_REFRESH_DELAY
+    seconds. Recipes that are due share a single task.
+    """
+    from .tasks import refresh_recipe_similarity
+
+    delay = settings.RECOMMENDATION_REFRESH_DELAY
+    due = [
+        str(recipe_id) for recipe_id in recipe_ids
+        if cache.add(f'{KEY_PREFIX}:similarity-pending:{recipe_id}', True, timeout=delay)
+    ]
+    if due:
+        refresh_recipe_similarity.apply_async(args=[due], countdown=delay)
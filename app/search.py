@@ -0,0 +1,61 @@
+import re
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery
+from .models import Recipe, RecipeIngredient
+
+
+def search_supported():
+    return connection.vendor == 'postgresql'
+
+
+def recipe_search_vector(recipe_ingredient_model=RecipeIngredient):
+    ingredient_names = Subquery(
+        recipe_ingredient_model.objects.filter(recipe=OuterRef('pk'))
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', ' '))
+        .values('names')
+    )
+    return (
+        SearchVector('title', weight='A')
+        + SearchVector(ingredient_names, weight='B')
+        + SearchVector('description', weight='C')
+        + SearchVector('instructions', weight='D')
+    )
+
+
+def refresh_search_vectors(recipe_ids):
+    """
+    Recompute the stored search vector of the given recipes in one UPDATE.
+    A no-op on databases without full-text search (SQLite in local tests).
+    """
+    if not search_supported() or not recipe_ids:
+        return
+    Recipe.objects.filter(pk__in=list(recipe_ids)).update(search_vector=recipe_search_vector())
+
+
+def search_recipes(queryset, text):
+    """
+    Filter ``queryset`` down to recipes matching ``text`` and order them by
+    relevance. Every word is prefix-matched, so "tom sou" finds "tomato soup".
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return queryset.none()
+
+    if not search_supported():
+        matches = Q()
+        for word in words:
+            matches &= (
+                Q(title__icontains=word) | Q(description__icontains=word)
+                | Q(instructions__icontains=word) | Q(ingredients__name__icontains=word)
+            )
+        return queryset.filter(pk__in=Recipe.objects.filter(matches).values('pk'))
+
+    query = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw')
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', '-created_at', '-id')
+    )
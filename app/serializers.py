@@ -1,5 +1,34 @@
 from rest_framework import serializers
-from .models import Cuisine, Ingredient, Recipe, StepPicture, Favourite, Rating, RecipeIngredient
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .aggregates import apply_rating_delta, apply_recipe_delta, move_recipe_cuisine
+from .cache import CUISINE_STATS, RECIPE_LIST, bump, recipe_namespace
+from .matching import recipe_ingredients_changed
+from .recommendations import schedule_similarity_refresh
+from .search import refresh_search_vectors
+from .models import Cuisine, Ingredient, Recipe, StepPicture, Favourite, Rating, RecipeIngredient, BulkImportJob, BulkImportRowError
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """Derivative URLs, dimensions and blur placeholder of an image, or null until generated."""
+
+    def to_representation(self, variants):
+        if not variants:
+            return None
+        request = self.context.get('request')
+
+        def url(path):
+            url = default_storage.url(path)
+            return request.build_absolute_uri(url) if request else url
+
+        return {
+            'width': variants['width'],
+            'height': variants['height'],
+            'placeholder': variants['placeholder'],
+            **{
+                label: {'width': size['width'], 'height': size['height'], 'webp': url(size['webp']), 'jpeg': url(size['jpeg'])}
+                for label, size in variants['sizes'].items()
+            },
+        }
 
 class CuisineSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,14 +36,18 @@ class CuisineSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 class IngredientSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Ingredient
-        fields = ['id','name', 'image']
+        fields = ['id','name', 'image', 'image_variants']
 
 class StepPictureSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = StepPicture
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_variants']
 
 class RecipeSerializer(serializers.ModelSerializer):
     cuisine = serializers.UUIDField(write_only=True)
@@ -29,6 +62,23 @@ class RecipeSerializer(serializers.ModelSerializer):
             'cuisine', 'ingredients', 'step_pictures'
         ]
 
+    def validate(self, attrs):
+        # Check every referenced id up front (one query per model) so a bad
+        # UUID is a 400 instead of an IntegrityError after partial writes.
+        cuisine_id = attrs.get('cuisine')
+        if cuisine_id and not Cuisine.objects.filter(pk=cuisine_id).exists():
+            raise serializers.ValidationError({'cuisine': f'Cuisine {cuisine_id} does not exist.'})
+
+        for field, model in (('ingredients', Ingredient), ('step_pictures', StepPicture)):
+            ids = set(attrs.get(field) or [])
+            missing = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+            if missing:
+                raise serializers.ValidationError(
+                    {field: f"Unknown {field.replace('_', ' ')}: {', '.join(sorted(map(str, missing)))}"}
+                )
+        return attrs
+
+    @transaction.atomic
     def create(self, validated_data):
         cuisine_id = validated_data.pop('cuisine')
         ingredient_ids = validated_data.pop('ingredients', [])
@@ -40,34 +90,64 @@ class RecipeSerializer(serializers.ModelSerializer):
             **validated_data
         )
 
-        for ingredient_id in ingredient_ids:
-            RecipeIngredient.objects.create(recipe=recipe, ingredient_id=ingredient_id)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id)
+            for ingredient_id in dict.fromkeys(ingredient_ids)
+        )
+        recipe_ingredients_changed([recipe.pk])
         
         recipe.step_pictures.set(step_picture_ids)
+        apply_recipe_delta(recipe.cuisine_id, 1)
+        refresh_search_vectors([recipe.pk])
         return recipe
     
+    @transaction.atomic
     def update(self, instance, validated_data):
         cuisine_id = validated_data.pop('cuisine', None)
         ingredient_ids = validated_data.pop('ingredients', None)
         step_picture_ids = validated_data.pop('step_pictures', None)
 
+        old_cuisine_id = instance.cuisine_id
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        # Only the edited columns are written: the rating counters, image
+        # variants and search vector are maintained by their own UPDATEs and
+        # a full-row save would overwrite them with the values read earlier.
+        update_fields = list(validated_data)
 
         if cuisine_id:
             instance.cuisine_id = cuisine_id
+            update_fields.append('cuisine')
 
         if ingredient_ids is not None:
-            instance.recipeingredient_set.all().delete()
-            for ingredient_id in ingredient_ids:
-                RecipeIngredient.objects.create(recipe=instance, ingredient_id=ingredient_id)
+            self._sync_ingredients(instance, ingredient_ids)
 
         if step_picture_ids is not None:
             instance.step_pictures.set(step_picture_ids)
 
-        instance.save()
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        else:
+            # No post_save when only related rows changed.
+            bump(recipe_namespace(instance.pk), RECIPE_LIST, CUISINE_STATS)
+        move_recipe_cuisine(instance, old_cuisine_id)
+        refresh_search_vectors([instance.pk])
         return instance
 
+    def _sync_ingredients(self, recipe, ingredient_ids):
+        """Apply only the difference between the stored and requested ingredients."""
+        wanted = dict.fromkeys(ingredient_ids)
+        existing = set(recipe.recipeingredient_set.values_list('ingredient_id', flat=True))
+
+        removed = existing.difference(wanted)
+        if removed:
+            recipe.recipeingredient_set.filter(ingredient_id__in=removed).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id)
+            for ingredient_id in wanted if ingredient_id not in existing
+        )
+        recipe_ingredients_changed([recipe.pk])
+
 class FavouriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Favourite
@@ -81,22 +161,88 @@ class RatingSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context['request'].user
-        rating, created = Rating.objects.update_or_create(
-            user=user,
-            recipe=validated_data['recipe'],
-            defaults={'score': validated_data['score']}
-        )
+        recipe = validated_data['recipe']
+        score = validated_data['score']
+
+        with transaction.atomic():
+            # Locking the recipe row serializes concurrent raters of the same
+            # recipe, so the previous row read below is the one the upsert
+            # replaces and the aggregate delta stays exact.
+            Recipe.objects.select_for_update().filter(pk=recipe.pk).values_list('pk', flat=True).first()
+            previous = Rating.objects.filter(user=user, recipe=recipe).values_list('id', 'score').first()
+
+            # INSERT ... ON CONFLICT (user_id, recipe_id) DO UPDATE, relying on
+            # the unique_rating_user_recipe constraint.
+            rating, = Rating.objects.bulk_create(
+                [Rating(user=user, recipe=recipe, score=score)],
+                update_conflicts=True,
+                unique_fields=['user', 'recipe'],
+                update_fields=['score'],
+            )
+            if previous is None:
+                apply_rating_delta(recipe.pk, recipe.cuisine_id, 1, score)
+            else:
+                # The conflicting row keeps its id; the one generated for the
+                # INSERT attempt was discarded.
+                rating.pk, previous_score = previous
+                apply_rating_delta(recipe.pk, recipe.cuisine_id, 0, score - previous_score)
+            # bulk_create sends no post_save, so invalidate explicitly.
+            bump(recipe_namespace(recipe.pk), RECIPE_LIST, CUISINE_STATS)
+        schedule_similarity_refresh(recipe.pk)
         return rating
     
+class RatingBatchItemSerializer(serializers.Serializer):
+    recipe = serializers.UUIDField()
+    score = serializers.IntegerField()
+
+
+class FavouriteBatchItemSerializer(serializers.Serializer):
+    recipe = serializers.UUIDField()
+    action = serializers.ChoiceField(choices=['add', 'remove'])
+
+
 class RecipeDetailSerializer(serializers.ModelSerializer):
     ingredients = IngredientSerializer(many=True)
     step_pictures = StepPictureSerializer(many=True)
     cuisine = CuisineSerializer()
+    thumbnail_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = [
             'id', 'title', 'description', 'instructions',
-            'prep_duration', 'cook_duration', 'thumbnail',
+            'prep_duration', 'cook_duration', 'thumbnail', 'thumbnail_variants',
             'cuisine', 'ingredients', 'step_pictures'
         ]
+
+
+class FavouriteRecipeSerializer(serializers.ModelSerializer):
+    recipe = RecipeDetailSerializer()
+    favourited_at = serializers.DateTimeField(source='created_at')
+    rating_count = serializers.IntegerField(source='recipe.rating_count')
+    average_rating = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Favourite
+        fields = ['id', 'favourited_at', 'recipe', 'rating_count', 'average_rating']
+
+    def get_average_rating(self, favourite):
+        recipe = favourite.recipe
+        return round(recipe.rating_sum / recipe.rating_count, 2) if recipe.rating_count else None
+
+
+class BulkImportRowErrorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BulkImportRowError
+        fields = ['row', 'error']
+
+
+class BulkImportJobSerializer(serializers.ModelSerializer):
+    pending_rows = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = BulkImportJob
+        fields = [
+            'id', 'status', 'total_rows', 'processed_rows', 'failed_rows',
+            'pending_rows', 'error', 'created_at', 'updated_at'
+        ]
@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from users.models import CustomUser
+from .aggregates import remove_user_contributions
+from .cache import CATALOG, CUISINE_STATS, RECIPE_LIST, bump, recipe_namespace
+from .images import IMAGE_FIELDS, delete_image_variants, image_in_use, needs_variants, variants_field
+from .matching import recipe_ingredients_changed
+from .pdf import delete_recipe_pdfs
+from .profiling import instrument_connection
+from .search import refresh_search_vectors
+from .tasks import generate_image_variants
+from .models import Cuisine, Ingredient, Rating, Recipe, RecipeIngredient, StepPicture
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    bump(recipe_namespace(instance.pk), RECIPE_LIST, CUISINE_STATS)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_cards(sender, instance, **kwargs):
+    # A rolled-back delete must keep the recipe's cached cards.
+    pk = instance.pk
+    transaction.on_commit(lambda: delete_recipe_pdfs(pk))
+
+
+# Ingredient rows are written in bulk by RecipeSerializer and process_chunk,
+# which invalidate the cache and update the ingredient index themselves;
+# deletions cascade here.
+@receiver(post_delete, sender=Recipe)
+def drop_recipe_from_index(sender, instance, **kwargs):
+    recipe_ingredients_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=Ingredient)
+def drop_ingredient_from_index(sender, instance, **kwargs):
+    recipe_ingredients_changed(RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(pre_delete, sender=CustomUser)
+def remove_user_aggregates(sender, instance, **kwargs):
+    # Runs inside the deletion's transaction, before the cascade removes the
+    # user's recipes and ratings.
+    remove_user_contributions(instance.pk)
+
+
+@receiver(m2m_changed, sender=Recipe.step_pictures.through)
+def invalidate_recipe_step_pictures(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # Only reachable from the StepPicture side, which already bumps the catalog.
+        bump(CATALOG, RECIPE_LIST)
+    else:
+        bump(recipe_namespace(instance.pk), RECIPE_LIST)
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def invalidate_rating(sender, instance, **kwargs):
+    bump(recipe_namespace(instance.recipe_id), RECIPE_LIST, CUISINE_STATS)
+
+
+@receiver([post_save, post_delete], sender=Cuisine)
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver([post_save, post_delete], sender=StepPicture)
+def invalidate_catalog(sender, instance, **kwargs):
+    # Cuisines, ingredients and step pictures are embedded in any number of
+    # recipe payloads, so they bump a version shared by all of them.
+    bump(CATALOG, RECIPE_LIST, CUISINE_STATS)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_search(sender, instance, created, **kwargs):
+    if not created:
+        refresh_search_vectors(
+            RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=StepPicture)
+def queue_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(lambda: generate_image_variants.delay(sender._meta.label, str(instance.pk)))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=StepPicture)
+def delete_image_derivatives(sender, instance, **kwargs):
+    image = getattr(instance, IMAGE_FIELDS[sender])
+    # Deduplicated uploads share their file and derivatives with other rows.
+    if not image_in_use(image.name, exclude=(sender, instance.pk)):
+        delete_image_variants(getattr(instance, variants_field(IMAGE_FIELDS[sender])))
+
+
+@receiver(pre_save, sender=Ingredient)
+@receiver(pre_save, sender=StepPicture)
+def remember_stored_image(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or (update_fields is not None and 'image' not in update_fields):
+        return
+    instance._stored_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=StepPicture)
+def release_replaced_image(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_stored_image', None)
+    if previous and previous != instance.image.name:
+        release_blob(instance.image.storage, previous)
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=StepPicture)
+def release_image(sender, instance, **kwargs):
+    if instance.image.name:
+        release_blob(instance.image.storage, instance.image.name)
+
+
+def release_blob(storage, name):
+    # A rolled-back save or delete must keep its reference.
+    transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(connection_created)
+def count_connection_queries(sender, connection, **kwargs):
+    instrument_connection(connection)
@@ -0,0 +1,290 @@
+"""
+Offline item-item similarity model. Only imported by Celery tasks, so web
+processes never load NumPy/SciPy.
+"""
+from collections import defaultdict
+from itertools import islice
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+from .models import Favourite, Rating, RecipeNeighbours
+
+# A favourite counts as a top rating; a rating alone weighs score / 5.
+FAVOURITE_WEIGHT = 1.0
+COLUMN_BLOCK = 2048
+BATCH_SIZE = 1000
+
+
+def _build_matrix(ratings, favourites):
+    """
+    User x recipe CSC matrix of interaction weights from ``(user_id,
+    recipe_id, score)`` and ``(user_id, recipe_id)`` rows. Returns
+    ``(matrix, recipe_ids)`` where column ``i`` is ``recipe_ids[i]``.
+    """
+    user_index = {}
+    recipe_index = {}
+    rows, cols, weights = [], [], []
+
+    def add(user_id, recipe_id, weight):
+        rows.append(user_index.setdefault(user_id, len(user_index)))
+        cols.append(recipe_index.setdefault(recipe_id, len(recipe_index)))
+        weights.append(weight)
+
+    for user_id, recipe_id, score in ratings:
+        add(user_id, recipe_id, score / 5.0)
+    for user_id, recipe_id in favourites:
+        add(user_id, recipe_id, FAVOURITE_WEIGHT)
+
+    shape = (len(user_index), len(recipe_index))
+    matrix = sparse.coo_matrix(
+        (np.asarray(weights, dtype=np.float32), (np.asarray(rows, dtype=np.int32), np.asarray(cols, dtype=np.int32))),
+        shape=shape,
+    ).tocsc()
+    # A rated-and-favourited recipe was added twice; keep the stronger signal.
+    matrix.sum_duplicates()
+    matrix.data = np.minimum(matrix.data, FAVOURITE_WEIGHT)
+
+    recipe_ids = [None] * len(recipe_index)
+    for recipe_id, column in recipe_index.items():
+        recipe_ids[column] = recipe_id
+    return matrix, recipe_ids
+
+
+def _normalized(matrix, norms):
+    norms = norms.copy()
+    norms[norms == 0] = 1
+    return (matrix @ sparse.diags(1 / norms)).tocsc()
+
+
+def load_interaction_matrix():
+    """
+    Build the user x recipe interaction matrix as a column-normalized CSC
+    matrix, so ``X[:, a].T @ X[:, b]`` is the cosine similarity of a and b.
+    Returns ``(matrix, recipe_ids, norms)`` where column ``i`` is
+    ``recipe_ids[i]`` and had norm ``norms[i]`` before normalization.
+    """
+    matrix, recipe_ids = _build_matrix(
+        Rating.objects.order_by().values_list('user_id', 'recipe_id', 'score').iterator(chunk_size=20000),
+        Favourite.objects.order_by().values_list('user_id', 'recipe_id').iterator(chunk_size=20000),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    return _normalized(matrix, norms), recipe_ids, norms
+
+
+def column_norms(recipe_ids, changed=()):
+    """
+    Norm of each recipe's interaction column over all users. Norms stored
+    with the neighbour lists are reused unless the recipe is in
+    ``changed``; the others are aggregated in the database with the
+    weights of ``_build_matrix()``.
+    """
+    changed = set(changed)
+    norms = {}
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = [recipe_id for recipe_id in recipe_ids[start:start + BATCH_SIZE] if recipe_id not in changed]
+        norms.update(
+            RecipeNeighbours.objects.filter(recipe_id__in=batch, norm__isnull=False).values_list('recipe_id', 'norm')
+        )
+
+    missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in norms]
+    squares = dict.fromkeys(missing, 0.0)
+    favourited = Favourite.objects.filter(user_id=OuterRef('user_id'), recipe_id=OuterRef('recipe_id'))
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start:start + BATCH_SIZE]
+        favourites = (
+            Favourite.objects.filter(recipe_id__in=batch).order_by()
+            .values('recipe_id').annotate(count=Count('id')).values_list('recipe_id', 'count')
+        )
+        for recipe_id, count in favourites:
+            squares[recipe_id] += count * FAVOURITE_WEIGHT ** 2
+        ratings = (
+            Rating.objects.filter(recipe_id__in=batch).exclude(Exists(favourited)).order_by()
+            .values('recipe_id').annotate(total=Sum(F('score') * F('score'))).values_list('recipe_id', 'total')
+        )
+        for recipe_id, total in ratings:
+            squares[recipe_id] += total / 25.0
+    norms.update((recipe_id, square ** 0.5) for recipe_id, square in squares.items())
+    return np.array([norms[recipe_id] for recipe_id in recipe_ids], dtype=np.float32)
+
+
+def load_neighbourhood(recipe_ids, changed=()):
+    """
+    Like ``load_interaction_matrix()``, but only with the rows of users who
+    interacted with ``recipe_ids``, and so only the columns of recipes
+    sharing a user with them. Columns are still normalized over all users,
+    so similarities involving ``recipe_ids`` are exact as long as the
+    stored norms of other recipes are current or they are in ``changed``.
+    """
+    users = (
+        Q(user_id__in=Rating.objects.filter(recipe_id__in=recipe_ids).values('user_id'))
+        | Q(user_id__in=Favourite.objects.filter(recipe_id__in=recipe_ids).values('user_id'))
+    )
+    matrix, column_recipe_ids = _build_matrix(
+        Rating.objects.filter(users).order_by().values_list('user_id', 'recipe_id', 'score').iterator(chunk_size=20000),
+        Favourite.objects.filter(users).order_by().values_list('user_id', 'recipe_id').iterator(chunk_size=20000),
+    )
+    norms = column_norms(column_recipe_ids, changed={*recipe_ids, *changed})
+    return _normalized(matrix, norms), column_recipe_ids, norms
+
+
+def similarity_columns(matrix, columns):
+    """
+    Yield ``(column, other_columns, scores)`` with every non-zero similarity
+    of each of ``columns``, computing the similarity block by block so the
+    full recipe x recipe matrix is never materialized.
+    """
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(columns), COLUMN_BLOCK):
+        block = columns[start:start + COLUMN_BLOCK]
+        similarities = (transposed @ matrix[:, block]).tocsc()
+        for offset, column in enumerate(block):
+            lo, hi = similarities.indptr[offset], similarities.indptr[offset + 1]
+            candidates = similarities.indices[lo:hi]
+            scores = similarities.data[lo:hi]
+            keep = candidates != column
+            yield column, candidates[keep], scores[keep]
+
+
+def _best(candidates, scores, k):
+    if len(scores) > k:
+        best = np.argpartition(-scores, k)[:k]
+        candidates, scores = candidates[best], scores[best]
+    order = np.argsort(-scores, kind='stable')
+    return candidates[order], scores[order]
+
+
+def top_neighbours(matrix, columns, k):
+    """Yield ``(column, neighbour_columns, scores)``, best first, for each of ``columns``."""
+    for column, candidates, scores in similarity_columns(matrix, columns):
+        yield column, *_best(candidates, scores, k)
+
+
+def _neighbours_row(recipe_id, neighbour_ids, scores, norm):
+    return RecipeNeighbours(
+        recipe_id=recipe_id,
+        neighbour_ids=[str(neighbour_id) for neighbour_id in neighbour_ids],
+        scores=[round(float(score), 4) for score in scores],
+        norm=float(norm),
+    )
+
+
+def _save(rows):
+    written = 0
+    for batch in iter(lambda: list(islice(rows, 1000)), []):
+        RecipeNeighbours.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=['recipe'],
+            update_fields=['neighbour_ids', 'scores', 'norm', 'updated_at'],
+        )
+        written += len(batch)
+    return written
+
+
+def _merge(neighbour_ids, scores, changed, k):
+    """
+    Replace the entries of the ``changed`` recipes (id -> new score) in a
+    stored neighbour list. Scores of the other entries did not change, and
+    every recipe left off a full list scored at most its last entry, so a
+    changed recipe can only be placed above that. Returns the new
+    ``(neighbour_ids, scores)``, or None when the list would end up short
+    and has to be recomputed.
+    """
+    full = len(neighbour_ids) >= k
+    floor = scores[-1] if full else 0
+    entering = [(score, recipe_id) for recipe_id, score in changed.items() if score > 0 and (not full or score >= floor)]
+    if not entering and changed.keys().isdisjoint(neighbour_ids):
+        return neighbour_ids, scores
+    merged = [(score, recipe_id) for recipe_id, score in zip(neighbour_ids, scores) if recipe_id not in changed]
+    merged += entering
+    if full and len(merged) < k:
+        return None
+    merged.sort(key=lambda entry: -entry[0])
+    return [recipe_id for _, recipe_id in merged[:k]], [score for score, _ in merged[:k]]
+
+
+def refresh_neighbours(recipe_ids):
+    """
+    Recompute the neighbour lists of ``recipe_ids`` after their interactions
+    changed, and patch their new similarities into the lists of the other
+    recipes. Only the interactions of the users of ``recipe_ids`` are
+    loaded, and only lists that change are written. Returns the number of
+    rows written.
+    """
+    k = settings.RECOMMENDATION_NEIGHBOURS
+    touched = set(recipe_ids)
+    matrix, column_recipe_ids, norms = load_neighbourhood(touched)
+    column_of = {recipe_id: column for column, recipe_id in enumerate(column_recipe_ids)}
+
+    rows = []
+    # Similarity to each touched recipe, keyed by the other recipe.
+    changed = defaultdict(dict)
+    for column, candidates, scores in similarity_columns(matrix, [column_of[r] for r in touched if r in column_of]):
+        recipe_id = column_recipe_ids[column]
+        for candidate, score in zip(candidates, scores):
+            changed[column_recipe_ids[candidate]][str(recipe_id)] = round(float(score), 4)
+        neighbours, scores = _best(candidates, scores, k)
+        rows.append(_neighbours_row(recipe_id, [column_recipe_ids[n] for n in neighbours], scores, norms[column]))
+    no_longer_similar = {str(recipe_id): 0.0 for recipe_id in touched}
+    without_interactions = touched - set(column_of)
+
+    with transaction.atomic():
+        stored = RecipeNeighbours.objects.select_for_update().exclude(recipe_id__in=touched)
+        others = list(changed)
+        patched = []
+        for start in range(0, len(others), BATCH_SIZE):
+            patched += stored.filter(recipe_id__in=others[start:start + BATCH_SIZE])
+        # Lists still holding a touched recipe that no longer shares a user
+        # with them. A text match works on every backend, and ids are UUIDs.
+        holding = Q()
+        for recipe_id in touched:
+            holding |= Q(neighbour_ids__icontains=str(recipe_id))
+        patched += (row for row in stored.filter(holding) if row.recipe_id not in changed)
+
+        recompute = []
+        for row in patched:
+            merged = _merge(row.neighbour_ids, row.scores, {**no_longer_similar, **changed.get(row.recipe_id, {})}, k)
+            if merged is None:
+                recompute.append(row.recipe_id)
+            elif merged != (row.neighbour_ids, row.scores):
+                row.neighbour_ids, row.scores = merged
+                rows.append(row)
+        if recompute:
+            # The touched recipes' new norms are not stored yet.
+            matrix, column_recipe_ids, norms = load_neighbourhood(recompute, changed=touched)
+            column_of = {recipe_id: column for column, recipe_id in enumerate(column_recipe_ids)}
+            rows += (
+                _neighbours_row(column_recipe_ids[column], [column_recipe_ids[n] for n in neighbours], scores, norms[column])
+                for column, neighbours, scores in top_neighbours(matrix, [column_of[r] for r in recompute], k)
+            )
+
+        RecipeNeighbours.objects.filter(recipe_id__in=without_interactions).delete()
+        return _save(iter(rows))
+
+
+def rebuild_neighbours(recipe_ids=None):
+    """
+    Recompute and store the top-K neighbour lists of every recipe with
+    interactions, or refresh just ``recipe_ids`` with
+    ``refresh_neighbours()``. Returns the number of rows written.
+    """
+    if recipe_ids is not None:
+        return refresh_neighbours(recipe_ids)
+
+    k = settings.RECOMMENDATION_NEIGHBOURS
+    matrix, column_recipe_ids, norms = load_interaction_matrix()
+
+    started_at = timezone.now()
+    rows = (
+        _neighbours_row(column_recipe_ids[column], [column_recipe_ids[n] for n in neighbours], scores, norms[column])
+        for column, neighbours, scores in top_neighbours(matrix, list(range(len(column_recipe_ids))), k)
+    )
+
+    with transaction.atomic():
+        written = _save(rows)
+        # Recipes that lost all their interactions since the last build.
+        RecipeNeighbours.objects.filter(updated_at__lt=started_at).delete()
+    return written
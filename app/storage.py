@@ -0,0 +1,137 @@
+"""
+Deduplicating file storage for user uploads. Each distinct file is kept
+once under its SHA-256 digest and reference-counted in ``StoredBlob``, so
+re-uploading an identical image costs a hash pass and one UPDATE instead of
+a new file on disk.
+"""
+import hashlib
+import os
+from datetime import timedelta
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, FileField
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIR = 'blobs'
+
+# Blobs nobody references are kept this long before collect_unused_blobs()
+# removes them, so a quick re-upload can still reuse the file.
+UNUSED_BLOB_GRACE = timedelta(days=1)
+
+
+def _stored_blob():
+    # Resolved lazily: this module is imported by app.models itself.
+    return apps.get_model('app', 'StoredBlob')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    ``FileSystemStorage`` that ignores the requested file name and stores
+    the content at ``blobs/<aa>/<bb>/<sha256><ext>``. ``delete()`` drops one
+    reference; files are only removed by ``collect_unused_blobs()``.
+    """
+
+    def blob_name(self, digest, name):
+        _, extension = os.path.splitext(name)
+        return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        name = self.blob_name(digest.hexdigest(), name)
+
+        StoredBlob = _stored_blob()
+        now = timezone.now()
+        referenced = StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_at=now)
+        if referenced and self.exists(name):
+            return name
+
+        if not self.exists(name):
+            stored = super()._save(name, content)
+            if stored != name:
+                # Another upload of the same content won the race to create
+                # the file; keep theirs.
+                super().delete(stored)
+        if not referenced:
+            StoredBlob.objects.bulk_create([StoredBlob(name=name, size=size, ref_count=0, updated_at=now)], ignore_conflicts=True)
+            StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_at=now)
+        return name
+
+    def delete(self, name):
+        StoredBlob = _stored_blob()
+        if not StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1, updated_at=timezone.now()):
+            # Stored before deduplication, so owned by a single row.
+            super().delete(name)
+
+    def delete_unreferenced(self, name):
+        """Remove the file itself, bypassing the reference count."""
+        super().delete(name)
+
+
+def _blob_fields():
+    return [
+        (model, field.name)
+        for model in apps.get_app_config('app').get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def reconcile_blob_references(cutoff, batch_size=1000):
+    """
+    Reset the reference count of blobs untouched since ``cutoff`` to the
+    number of rows that point at them. ``_save()`` takes its reference when
+    the file is stored, so a row insert that then fails or rolls back leaves
+    a reference nobody will release. The UPDATE only applies while the blob
+    is still idle, so a concurrent upload keeps its reference.
+    """
+    StoredBlob = _stored_blob()
+    fields = _blob_fields()
+    idle = StoredBlob.objects.filter(updated_at__lt=cutoff).order_by('name')
+    last = ''
+    while True:
+        counts = dict(idle.filter(name__gt=last).values_list('name', 'ref_count')[:batch_size])
+        if not counts:
+            return
+        last = max(counts)
+
+        references = dict.fromkeys(counts, 0)
+        for model, field in fields:
+            rows = model.objects.filter(**{f'{field}__in': counts}).order_by().values(field).annotate(total=Count('pk'))
+            for row in rows:
+                references[row[field]] += row['total']
+        for name, total in references.items():
+            if total != counts[name]:
+                idle.filter(name=name).update(ref_count=total)
+
+
+def collect_unused_blobs(storage=None):
+    """
+    Delete blobs whose reference count has been zero for longer than
+    UNUSED_BLOB_GRACE, after reconciling the counts of idle blobs with the
+    rows that use them. Each row is locked while its file is removed, so an
+    upload of the same content either re-references it first or waits and
+    writes a fresh copy. Returns the number of blobs removed.
+    """
+    storage = storage or ContentAddressedStorage()
+    StoredBlob = _stored_blob()
+    cutoff = timezone.now() - UNUSED_BLOB_GRACE
+    reconcile_blob_references(cutoff)
+    names = list(StoredBlob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff).values_list('name', flat=True)[:1000])
+
+    removed = 0
+    for name in names:
+        with transaction.atomic():
+            blob = StoredBlob.objects.select_for_update(skip_locked=True).filter(name=name, ref_count__lte=0).first()
+            if blob is None:
+                continue
+            storage.delete_unreferenced(name)
+            blob.delete()
+            removed += 1
+    return removed
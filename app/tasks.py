@@ -1,55 +1,257 @@
 import os
+import uuid
+import logging
+from collections import Counter
+from itertools import islice
 from celery import shared_task
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from openpyxl import load_workbook
-from app.models import Cuisine, Recipe, RecipeIngredient
-from users.models import CustomUser as User
+from app.aggregates import apply_recipe_delta
+from app.cache import CUISINE_STATS, RECIPE_LIST, bump
+from app.matching import recipe_ingredients_changed
+from app.search import refresh_search_vectors
+from app.images import refresh_image_variants
+from app.storage import collect_unused_blobs
+from app.uploads import collect_staged_uploads
+from app.models import BulkImportJob, BulkImportRowError, Cuisine, Ingredient, Recipe, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100
 
 
 @shared_task
-def process_bulk_recipes(file_path, user_id):
-    user = User.objects.get(id=user_id)
+def process_bulk_recipes(job_id):
+    """
+    Stream the uploaded sheet and fan it out as one ``import_recipe_chunk``
+    task per chunk, so chunks are imported in parallel across workers. The
+    job's ``total_rows`` is only known once the whole sheet has been read; the
+    job is marked completed by whichever side (this task or the last chunk)
+    observes that every row has been accounted for.
+    """
+    job = BulkImportJob.objects.select_related('user').get(pk=job_id)
+
+    if not os.path.exists(job.file_path):
+        job.status = BulkImportJob.STATUS_FAILED
+        job.error = "Uploaded file no longer exists."
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return
+
+    job.status = BulkImportJob.STATUS_PROCESSING
+    job.save(update_fields=['status', 'updated_at'])
 
-    if not os.path.exists(file_path):
+    total_rows = 0
+    try:
+        for chunk in iter_sheet_chunks(job.file_path, CHUNK_SIZE):
+            import_recipe_chunk.delay(str(job.id), chunk)
+            total_rows += len(chunk)
+    except Exception as e:
+        logger.exception("Bulk upload %s could not be read", job_id)
+        BulkImportJob.objects.filter(pk=job.pk).update(
+            status=BulkImportJob.STATUS_FAILED, error=str(e), total_rows=total_rows, updated_at=timezone.now()
+        )
         return
+    finally:
+        os.remove(job.file_path)
+
+    BulkImportJob.objects.filter(pk=job.pk).update(total_rows=total_rows, updated_at=timezone.now())
+    finish_job_if_done(job.pk)
+
+
+@shared_task
+def import_recipe_chunk(job_id, chunk):
+    job = BulkImportJob.objects.select_related('user').get(pk=job_id)
+
+    try:
+        with transaction.atomic():
+            created, errors = process_chunk(chunk, job.user)
+            record_chunk_result(job, created, errors)
+    except Exception as e:
+        # Account for every row of the chunk, or the job never completes.
+        logger.exception("Chunk of bulk upload %s failed", job_id)
+        created, errors = 0, [{"row": row_number, "error": f"Import failed: {e}"} for row_number, _ in chunk]
+        with transaction.atomic():
+            record_chunk_result(job, created, errors)
+
+    finish_job_if_done(job.pk)
+    return {"created": created, "failed": len(errors)}
+
 
-    wb = load_workbook(file_path)
-    sheet = wb.active
-    rows = list(sheet.iter_rows(min_row=2, values_only=True))
+def record_chunk_result(job, created, errors):
+    BulkImportRowError.objects.bulk_create(
+        BulkImportRowError(job=job, row=error["row"], error=error["error"]) for error in errors
+    )
+    BulkImportJob.objects.filter(pk=job.pk).update(
+        processed_rows=F('processed_rows') + created,
+        failed_rows=F('failed_rows') + len(errors),
+        updated_at=timezone.now(),
+    )
 
-    chunk_size = 100
-    for i in range(0, len(rows), chunk_size):
-        chunk = rows[i:i+chunk_size]
-        process_chunk(chunk, user)
 
-    os.remove(file_path)
+def finish_job_if_done(job_id):
+    # A single conditional UPDATE, so concurrent chunk tasks cannot race
+    # each other into completing (or missing the completion of) the job.
+    done = BulkImportJob.objects.filter(
+        pk=job_id,
+        status=BulkImportJob.STATUS_PROCESSING,
+        total_rows__isnull=False,
+        total_rows__lte=F('processed_rows') + F('failed_rows'),
+    ).update(status=BulkImportJob.STATUS_COMPLETED, updated_at=timezone.now())
+    if done:
+        logger.info("Bulk upload %s completed", job_id)
+
+
+def iter_chunks(rows, chunk_size):
+    """
+    Lazily group ``rows`` into lists of at most ``chunk_size`` items. Only one
+    chunk is held at a time.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_sheet_chunks(file_path, chunk_size):
+    """
+    Lazily read the non-empty data rows of the sheet at ``file_path`` as
+    chunks of ``(row_number, row)`` pairs. read_only streams rows out of the
+    sheet XML instead of building the whole workbook in memory, so worker
+    RSS stays flat as sheets grow.
+    """
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(min_row=2, values_only=True)
+        numbered_rows = (
+            (row_number, list(row))
+            for row_number, row in enumerate(rows, start=2)
+            if any(cell is not None for cell in row)
+        )
+        yield from iter_chunks(numbered_rows, chunk_size)
+    finally:
+        wb.close()
+
+
+def parse_ingredient_ids(value):
+    ids = []
+    for part in str(value or "").split(","):
+        part = part.strip().strip('[]"\' ')
+        if part:
+            ids.append(uuid.UUID(part))
+    return ids
+
+
+def parse_row(row):
+    title, description, instructions, prep_duration, cook_duration, cuisine_id, ingredient_ids_str = row
+    return {
+        "title": title.strip(),
+        "description": description.strip(),
+        "instructions": instructions.strip(),
+        "prep_duration": int(prep_duration),
+        "cook_duration": int(cook_duration),
+        "cuisine_id": uuid.UUID(str(cuisine_id).strip()),
+        "ingredient_ids": parse_ingredient_ids(ingredient_ids_str),
+    }
 
 
 def process_chunk(chunk, user):
-    for row in chunk:
-        try:
-            title, description, instructions, prep_duration, cook_duration, cuisine_id, ingredient_ids_str = row
-            title = title.strip()
-            description = description.strip()
-            instructions = instructions.strip()
-            cuisine = Cuisine.objects.get(pk=cuisine_id)
-
-            recipe = Recipe.objects.create(
-                creator=user,
-                title=title,
-                description=description,
-                instructions=instructions,
-                prep_duration=int(prep_duration),
-                cook_duration=int(cook_duration),
-                cuisine=cuisine
-            )
-
-            ingredient_ids = [id.strip() for id in ingredient_ids_str.split(",")]
-            for ing_id in ingredient_ids:
-                if ing_id:
-                    RecipeIngredient.objects.create(recipe=recipe, ingredient_id=ing_id)
-
-            print(f"✅ Created recipe: {recipe.title}")
+    """
+    Import a chunk of ``(row_number, row)`` pairs with a fixed number of
+    queries: one lookup for the referenced cuisines, one for the ingredients,
+    and one bulk insert each for recipes and their ingredient rows, all in a
+    single transaction.
 
+    Returns ``(created_count, errors)`` where each error is
+    ``{"row": <sheet row number>, "error": <message>}``.
+    """
+    errors = []
+    parsed = []
+    for row_number, row in chunk:
+        try:
+            parsed.append((row_number, parse_row(row)))
         except Exception as e:
-            print(f"❌ Failed to process row: {row} -> Error: {e}")
+            errors.append({"row": row_number, "error": str(e)})
+
+    cuisine_ids = {data["cuisine_id"] for _, data in parsed}
+    ingredient_ids = {ing_id for _, data in parsed for ing_id in data["ingredient_ids"]}
+    known_cuisines = set(Cuisine.objects.filter(pk__in=cuisine_ids).values_list("pk", flat=True))
+    known_ingredients = set(Ingredient.objects.filter(pk__in=ingredient_ids).values_list("pk", flat=True))
+
+    recipes = []
+    recipe_ingredients = []
+    for row_number, data in parsed:
+        if data["cuisine_id"] not in known_cuisines:
+            errors.append({"row": row_number, "error": f"Cuisine {data['cuisine_id']} does not exist."})
+            continue
+        missing = [str(ing_id) for ing_id in data["ingredient_ids"] if ing_id not in known_ingredients]
+        if missing:
+            errors.append({"row": row_number, "error": f"Ingredients do not exist: {', '.join(missing)}"})
             continue
+
+        recipe = Recipe(
+            creator=user,
+            title=data["title"],
+            description=data["description"],
+            instructions=data["instructions"],
+            prep_duration=data["prep_duration"],
+            cook_duration=data["cook_duration"],
+            cuisine_id=data["cuisine_id"],
+        )
+        recipes.append(recipe)
+        recipe_ingredients.extend(
+            RecipeIngredient(recipe=recipe, ingredient_id=ing_id)
+            for ing_id in dict.fromkeys(data["ingredient_ids"])
+        )
+
+    with transaction.atomic():
+        Recipe.objects.bulk_create(recipes)
+        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        for cuisine_id, count in Counter(recipe.cuisine_id for recipe in recipes).items():
+            apply_recipe_delta(cuisine_id, count)
+        refresh_search_vectors([recipe.pk for recipe in recipes])
+        recipe_ingredients_changed([recipe.pk for recipe in recipes])
+        if recipes:
+            bump(RECIPE_LIST, CUISINE_STATS)
+
+    errors.sort(key=lambda error: error["row"])
+    return len(recipes), errors
+
+
+@shared_task
+def generate_image_variants(model_label, pk):
+    return refresh_image_variants(apps.get_model(model_label), pk)
+
+
+@shared_task
+def collect_stale_bulk_uploads():
+    removed = collect_staged_uploads()
+    logger.info("Removed %d stale staged bulk uploads", removed)
+    return removed
+
+
+@shared_task
+def collect_unused_media_blobs():
+    removed = collect_unused_blobs()
+    logger.info("Removed %d unused media blobs", removed)
+    return removed
+
+
+@shared_task
+def build_recipe_similarity():
+    from app.similarity import rebuild_neighbours
+
+    written = rebuild_neighbours()
+    logger.info("Recipe similarity model rebuilt for %d recipes", written)
+    return written
+
+
+@shared_task
+def refresh_recipe_similarity(recipe_ids):
+    from app.similarity import rebuild_neighbours
+
+    return rebuild_neighbours([uuid.UUID(recipe_id) for recipe_id in recipe_ids])
@@ -1,3 +1,961 @@
-from django.test import TestCase
+import os
+import random
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import Future
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from openpyxl import Workbook
+from PIL import Image
+from rest_framework.test import APIClient
+from users.models import CustomUser
+from users.tokens import UserRefreshToken
+from . import pdf, profiling
+from .aggregates import rebuild_rating_aggregates
+from .batch import MAX_BATCH_SIZE
+from .celery import close_database_pools
+from .serializers import RecipeSerializer
+from .filters import RecipeFilters
+from .matching import IngredientIndex, ingredient_index, recipe_ingredients_changed
+from .models import BulkImportJob, Cuisine, Favourite, Ingredient, Rating, Recipe, RecipeIngredient, RecipeNeighbours, StepPicture, StoredBlob
+from .search import refresh_search_vectors
+from .similarity import rebuild_neighbours
+from .storage import UNUSED_BLOB_GRACE, collect_unused_blobs
+from .tasks import import_recipe_chunk
+from .uploads import BULK_UPLOAD_COLUMNS, collect_staged_uploads
 
-# Create your tests here.
+
+def create_recipe(creator, cuisine, ingredients=(), **fields):
+    recipe = Recipe.objects.create(
+        creator=creator,
+        cuisine=cuisine,
+        title=fields.pop('title', 'Test recipe'),
+        description='A test dish.',
+        instructions='Mix well.',
+        prep_duration=fields.pop('prep_duration', 10),
+        cook_duration=fields.pop('cook_duration', 20),
+        thumbnail='',
+        **fields,
+    )
+    RecipeIngredient.objects.bulk_create([RecipeIngredient(recipe=recipe, ingredient=i) for i in ingredients])
+    return recipe
+
+
+class RecipeTestData:
+    @classmethod
+    def setUpTestData(cls):
+        cls.creator = CustomUser.objects.create(email='creator@test.local', user_type='creator')
+        cls.viewer = CustomUser.objects.create(email='viewer@test.local', user_type='viewer')
+        cls.cuisine = Cuisine.objects.create(name='Test cuisine')
+        cls.ingredients = [Ingredient.objects.create(name=f'ingredient {i}', image='') for i in range(4)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+
+class IngredientIndexTests(RecipeTestData, TestCase):
+    def test_change_after_rolled_back_change_is_still_applied(self):
+        recipe = create_recipe(self.creator, self.cuisine, self.ingredients[:2])
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    recipe_ingredients_changed([recipe.pk])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            recipe_ingredients_changed([recipe.pk])
+        self.assertEqual(len(callbacks), 1)
+
+    def test_changes_in_one_transaction_are_refreshed_together(self):
+        recipes = [create_recipe(self.creator, self.cuisine, self.ingredients[:1]) for _ in range(3)]
+        with mock.patch.object(ingredient_index, 'refresh_recipes') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    recipe_ingredients_changed([recipes[0].pk])
+                    recipe_ingredients_changed([recipes[1].pk, recipes[2].pk])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.creator.delete()
+        self.assertEqual(
+            refresh.call_args_list, [mock.call({recipe.pk for recipe in recipes})] * 2,
+        )
+
+    def test_deleted_ingredient_leaves_the_index(self):
+        recipe = create_recipe(self.creator, self.cuisine, self.ingredients[:2])
+        index = IngredientIndex()
+        index.rebuild()
+        with mock.patch('app.matching.ingredient_index', index), self.captureOnCommitCallbacks(execute=True):
+            self.ingredients[1].delete()
+        self.assertEqual(index.match([self.ingredients[0].pk]), [(recipe.pk, 1, 1)])
+
+    def test_match_ranks_by_missing_ingredients(self):
+        full = create_recipe(self.creator, self.cuisine, self.ingredients[:2])
+        partial = create_recipe(self.creator, self.cuisine, self.ingredients[:3])
+        create_recipe(self.creator, self.cuisine, self.ingredients[3:])
+        index = IngredientIndex()
+        index.rebuild()
+        have = [i.pk for i in self.ingredients[:2]]
+
+        self.assertEqual(index.match(have), [(full.pk, 2, 2)])
+        self.assertEqual(index.match(have, max_missing=1), [(full.pk, 2, 2), (partial.pk, 2, 3)])
+        with self.assertRaises(AssertionError):
+            index.match(have, max_missing=-1)
+
+    @override_settings(INGREDIENT_INDEX_REFRESH=0)
+    def test_other_process_replays_published_change(self):
+        recipe = create_recipe(self.creator, self.cuisine, self.ingredients[:1])
+        local, remote = IngredientIndex(), IngredientIndex()
+        local.rebuild()
+        remote.rebuild()
+        RecipeIngredient.objects.create(recipe=recipe, ingredient=self.ingredients[1])
+        local.refresh_recipes([recipe.pk])
+
+        with mock.patch.object(remote, 'rebuild', wraps=remote.rebuild) as rebuild:
+            self.assertEqual(remote.match([i.pk for i in self.ingredients[:2]]), [(recipe.pk, 2, 2)])
+        rebuild.assert_not_called()
+
+    @override_settings(INGREDIENT_INDEX_REFRESH=0, INGREDIENT_INDEX_MAX_REPLAY=1)
+    def test_other_process_rebuilds_after_too_many_changes(self):
+        recipes = [create_recipe(self.creator, self.cuisine, self.ingredients[:1]) for _ in range(2)]
+        local, remote = IngredientIndex(), IngredientIndex()
+        local.rebuild()
+        remote.rebuild()
+        local.refresh_recipes([recipe.pk for recipe in recipes])
+
+        with mock.patch.object(remote, 'rebuild', wraps=remote.rebuild) as rebuild:
+            remote.match([self.ingredients[0].pk])
+        rebuild.assert_called_once()
+
+    def test_what_can_i_cook_rejects_negative_max_missing_and_limit(self):
+        ingredients = ','.join(str(i.pk) for i in self.ingredients[:2])
+        for params in ({'max_missing': -1}, {'limit': 0}, {'limit': 'x'}):
+            response = self.client.get('/api/v1/app/what-can-i-cook/', {'ingredients': ingredients, **params})
+            self.assertEqual(response.status_code, 400, params)
+
+
+class RecipeQueryCountTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        pictures = [StepPicture.objects.create(image='') for _ in range(3)]
+        cls.recipes = []
+        for i in range(12):
+            recipe = create_recipe(cls.creator, cls.cuisine, cls.ingredients[:i % 4 + 1], title=f'Recipe {i}')
+            recipe.step_pictures.set(pictures[:i % 3 + 1])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        for limit in (2, 5, 10):
+            # count, page, ingredients, step pictures, facets
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get('/api/v1/app/list-recipes/', {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_cursor_list_queries_do_not_grow_with_page_size(self):
+        for limit in (2, 5, 10):
+            # page, ingredients, step pictures, facets
+            with self.subTest(limit=limit), self.assertNumQueries(4):
+                response = self.client.get('/api/v1/app/list-recipes/', {'pagination': 'cursor', 'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_facets_only_on_first_page_unless_requested(self):
+        cases = (({'offset': 0}, True), ({'offset': 4}, False), ({'offset': 4, 'facets': 1}, True))
+        for params, with_facets in cases:
+            with self.subTest(**params), self.assertNumQueries(5 if with_facets else 4):
+                response = self.client.get('/api/v1/app/list-recipes/', {'limit': 4, **params})
+            self.assertEqual('facets' in response.data, with_facets)
+
+        first = self.client.get('/api/v1/app/list-recipes/', {'pagination': 'cursor', 'limit': 4})
+        second = self.client.get(first.data['next'])
+        self.assertIn('facets', first.data)
+        self.assertNotIn('facets', second.data)
+
+    def test_facet_counts_keep_largest_buckets(self):
+        facets = RecipeFilters({}).facet_counts(buckets=2)
+        # Recipe i has the first i % 4 + 1 ingredients, so the first two are the most common.
+        self.assertEqual(facets['ingredient'], {str(self.ingredients[0].pk): 12, str(self.ingredients[1].pk): 9})
+        self.assertTrue(all(len(counts) <= 2 for counts in facets.values()))
+
+    def test_detail_queries_do_not_grow_with_related_rows(self):
+        for recipe in self.recipes[:4]:
+            # recipe with cuisine, ingredients, step pictures
+            with self.subTest(ingredients=recipe.ingredients.count()), self.assertNumQueries(3):
+                response = self.client.get(f'/api/v1/app/detail-recipe/{recipe.pk}/')
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(RECOMMENDATION_NEIGHBOURS=3)
+class SimilarityRefreshTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        rng = random.Random(0)
+        cls.users = [CustomUser.objects.create(email=f'rater{i}@test.local', user_type='viewer') for i in range(30)]
+        cls.recipes = [create_recipe(cls.creator, cls.cuisine, title=f'Recipe {i}') for i in range(15)]
+        Rating.objects.bulk_create(
+            Rating(user=user, recipe=recipe, score=rng.randint(1, 5))
+            for user in cls.users for recipe in cls.recipes if rng.random() < 0.3
+        )
+        Favourite.objects.bulk_create(
+            Favourite(user=user, recipe=recipe)
+            for user in cls.users for recipe in cls.recipes if rng.random() < 0.1
+        )
+
+    def stored_scores(self):
+        return {
+            recipe_id: [round(score, 3) for score in scores]
+            for recipe_id, scores in RecipeNeighbours.objects.values_list('recipe_id', 'scores')
+        }
+
+    def test_refresh_matches_full_rebuild(self):
+        rebuild_neighbours()
+        rng = random.Random(1)
+        for round in range(5):
+            touched = rng.sample(self.recipes, 3)
+            for recipe in touched:
+                for user in rng.sample(self.users, 5):
+                    Rating.objects.update_or_create(user=user, recipe=recipe, defaults={'score': rng.randint(1, 5)})
+            Favourite.objects.get_or_create(user=rng.choice(self.users), recipe=touched[0])
+
+            rebuild_neighbours([recipe.pk for recipe in touched])
+            refreshed = self.stored_scores()
+            rebuild_neighbours()
+            self.assertEqual(refreshed, self.stored_scores(), round)
+
+    def test_refresh_drops_recipe_without_interactions(self):
+        rebuild_neighbours()
+        recipe = self.recipes[0]
+        Rating.objects.filter(recipe=recipe).delete()
+        Favourite.objects.filter(recipe=recipe).delete()
+
+        rebuild_neighbours([recipe.pk])
+        self.assertFalse(RecipeNeighbours.objects.filter(recipe=recipe).exists())
+        for neighbour_ids in RecipeNeighbours.objects.values_list('neighbour_ids', flat=True):
+            self.assertNotIn(str(recipe.pk), neighbour_ids)
+
+    def test_recommendations_validate_limit(self):
+        rebuild_neighbours()
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        self.assertEqual(client.get('/api/v1/app/recommendations/', {'limit': 'x'}).status_code, 400)
+        for limit, expected in ((0, 1), (-5, 1), (3, 3)):
+            response = client.get('/api/v1/app/recommendations/', {'limit': limit})
+            self.assertEqual(len(response.data['results']), expected)
+
+
+class CookbookExportTests(RecipeTestData, TestCase):
+    def test_exports_share_one_render_pool(self):
+        for i in range(3):
+            create_recipe(self.creator, self.cuisine, self.ingredients[:2], title=f'Card {i}')
+        client = APIClient()
+        client.force_authenticate(self.creator)
+
+        pools = set()
+        for _ in range(2):
+            response = client.get('/api/v1/app/export-recipes-pdf/')
+            archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(len(archive.namelist()), 3)
+            pools.add(pdf._pool)
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(pdf._pool._mp_context.get_start_method(), 'forkserver')
+
+
+class BulkImportChunkTests(RecipeTestData, TestCase):
+    def test_failed_chunk_counts_every_row_and_completes_job(self):
+        job = BulkImportJob.objects.create(
+            user=self.creator, file_path='gone.xlsx', status=BulkImportJob.STATUS_PROCESSING, total_rows=3,
+        )
+        chunk = [[row_number, ['Title', 'Desc', 'Mix', 1, 2, str(self.cuisine.pk), '']] for row_number in (2, 3, 4)]
+
+        with mock.patch('app.tasks.process_chunk', side_effect=RuntimeError('boom')), self.assertLogs('app.tasks', 'ERROR'):
+            result = import_recipe_chunk(str(job.pk), chunk)
+
+        job.refresh_from_db()
+        self.assertEqual(result, {"created": 0, "failed": 3})
+        self.assertEqual((job.status, job.processed_rows, job.failed_rows), (BulkImportJob.STATUS_COMPLETED, 0, 3))
+        self.assertEqual(list(job.row_errors.values_list('row', flat=True)), [2, 3, 4])
+
+
+class RecipeCardCleanupTests(RecipeTestData, TestCase):
+    def test_cards_are_deleted_only_after_commit(self):
+        recipe = create_recipe(self.creator, self.cuisine)
+        with mock.patch('app.signals.delete_recipe_pdfs') as delete:
+            try:
+                with transaction.atomic():
+                    Recipe.objects.filter(pk=recipe.pk).delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            with self.captureOnCommitCallbacks(execute=True):
+                Recipe.objects.filter(pk=recipe.pk).delete()
+        delete.assert_called_once_with(recipe.pk)
+
+
+class RecipeSearchTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        tomato = Ingredient.objects.create(name='tomato', image='')
+        cls.soup = create_recipe(cls.creator, cls.cuisine, [tomato], title='Tomato soup')
+        cls.salad = create_recipe(cls.creator, cls.cuisine, [tomato], title='Green salad')
+        cls.stew = create_recipe(cls.creator, cls.cuisine, title='Bean stew')
+        refresh_search_vectors([cls.soup.pk, cls.salad.pk, cls.stew.pk])
+
+    def search(self, q):
+        response = self.client.get('/api/v1/app/search-recipes/', {'q': q})
+        return [recipe['title'] for recipe in response.data['results']]
+
+    def test_every_word_is_prefix_matched(self):
+        self.assertEqual(self.search('tom sou'), ['Tomato soup'])
+        self.assertEqual(self.search('bean'), ['Bean stew'])
+        self.assertEqual(self.search('bean soup'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', "full-text search needs PostgreSQL")
+    def test_title_matches_rank_above_ingredient_matches(self):
+        self.assertEqual(self.search('tomato'), ['Tomato soup', 'Green salad'])
+
+    @skipUnless(connection.vendor == 'postgresql', "full-text search needs PostgreSQL")
+    def test_renamed_ingredient_is_searchable(self):
+        ingredient = Ingredient.objects.get(name='tomato')
+        ingredient.name = 'heirloom tomato'
+        ingredient.save()
+        self.assertCountEqual(self.search('heirloom'), ['Tomato soup', 'Green salad'])
+
+
+class FavouriteListTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [create_recipe(cls.creator, cls.cuisine, cls.ingredients[:2], title=f'Recipe {i}') for i in range(7)]
+        for recipe in cls.recipes:
+            Favourite.objects.create(user=cls.viewer, recipe=recipe)
+        Favourite.objects.create(user=cls.creator, recipe=cls.recipes[0])
+
+    def test_cursor_pages_walk_every_favourite_newest_first(self):
+        titles, url, params = [], '/api/v1/app/create-favourites/', {'limit': 3}
+        while url:
+            # favourites with recipes and cuisines, ingredients, step pictures
+            with self.assertNumQueries(3):
+                response = self.client.get(url, params)
+            titles += [favourite['recipe']['title'] for favourite in response.data['results']]
+            url, params = response.data['next'], None
+        self.assertEqual(titles, [recipe.title for recipe in reversed(self.recipes)])
+
+    def test_favourite_status_answers_every_id_in_one_query(self):
+        other = create_recipe(self.creator, self.cuisine)
+        ids = [self.recipes[0].pk, self.recipes[1].pk, other.pk]
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/app/favourite-status/', {'recipe_ids': ','.join(map(str, ids))})
+        self.assertEqual(
+            response.data['favourited'], {str(ids[0]): True, str(ids[1]): True, str(other.pk): False}
+        )
+        self.assertEqual(self.client.get('/api/v1/app/favourite-status/', {'recipe_ids': 'x'}).status_code, 400)
+
+
+class BatchWriteTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipes = [create_recipe(cls.creator, cls.cuisine, title=f'Recipe {i}') for i in range(3)]
+
+    def post(self, path, key, items):
+        return self.client.post(f'/api/v1/app/{path}/', {key: items}, format='json')
+
+    def test_rating_batch_applies_valid_items_and_reports_the_rest(self):
+        first, second, third = self.recipes
+        self.post('batch-ratings', 'ratings', [{'recipe': str(second.pk), 'score': 2}, {'recipe': str(third.pk), 'score': 4}])
+        missing = uuid.uuid4()
+
+        response = self.post('batch-ratings', 'ratings', [
+            {'recipe': str(first.pk), 'score': 1},
+            {'recipe': str(second.pk), 'score': 5},
+            {'recipe': str(third.pk), 'score': 4},
+            {'recipe': str(missing), 'score': 3},
+            {'recipe': str(first.pk), 'score': 'x'},
+            {'recipe': str(first.pk), 'score': 3},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['superseded', 'updated', 'unchanged', 'not_found', 'invalid', 'created'],
+        )
+        self.assertEqual(
+            dict(Rating.objects.filter(user=self.viewer).values_list('recipe_id', 'score')),
+            {first.pk: 3, second.pk: 5, third.pk: 4},
+        )
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.rating_count, first.rating_sum), (1, 3))
+        self.assertEqual((second.rating_count, second.rating_sum), (1, 5))
+
+    def test_favourite_batch_applies_valid_items_and_reports_the_rest(self):
+        first, second, third = self.recipes
+        Favourite.objects.create(user=self.viewer, recipe=second)
+
+        response = self.post('batch-favourites', 'favourites', [
+            {'recipe': str(first.pk), 'action': 'remove'},
+            {'recipe': str(first.pk), 'action': 'add'},
+            {'recipe': str(second.pk), 'action': 'remove'},
+            {'recipe': str(third.pk), 'action': 'toggle'},
+            {'recipe': str(uuid.uuid4()), 'action': 'add'},
+            {'recipe': str(third.pk), 'action': 'remove'},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['superseded', 'added', 'removed', 'invalid', 'not_found', 'unchanged'],
+        )
+        self.assertEqual(list(Favourite.objects.filter(user=self.viewer).values_list('recipe_id', flat=True)), [first.pk])
+
+    def test_batches_must_be_non_empty_and_bounded(self):
+        item = {'recipe': str(self.recipes[0].pk), 'score': 3}
+        for items in ([], [item] * (MAX_BATCH_SIZE + 1), 'x'):
+            self.assertEqual(self.post('batch-ratings', 'ratings', items).status_code, 400)
+        self.assertFalse(Rating.objects.exists())
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class StoredBlobTests(MediaRootMixin, RecipeTestData, TestCase):
+    def setUp(self):
+        super().setUp()
+        # The uploads are not real images.
+        patcher = mock.patch('app.signals.generate_image_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, name, content=b'same picture'):
+        return Ingredient.objects.create(name=name, image=ContentFile(content, name=f'{name}.png'))
+
+    def test_identical_uploads_share_one_reference_counted_file(self):
+        first, second = self.upload('first'), self.upload('second')
+        other = self.upload('other', b'another picture')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(StoredBlob.objects.get(name=first.image.name).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(StoredBlob.objects.get(name=second.image.name).ref_count, 1)
+        self.assertTrue(second.image.storage.exists(second.image.name))
+
+    def test_unused_blob_is_collected_after_the_grace_period(self):
+        ingredient = self.upload('first')
+        name, storage = ingredient.image.name, ingredient.image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+
+        self.assertEqual(StoredBlob.objects.get(name=name).ref_count, 0)
+        self.assertEqual(collect_unused_blobs(), 0)
+        self.assertTrue(storage.exists(name))
+
+        StoredBlob.objects.filter(name=name).update(updated_at=timezone.now() - UNUSED_BLOB_GRACE - timedelta(minutes=1))
+        self.assertEqual(collect_unused_blobs(), 1)
+        self.assertFalse(StoredBlob.objects.filter(name=name).exists())
+        self.assertFalse(storage.exists(name))
+
+    def test_reupload_within_grace_period_reuses_the_file(self):
+        name = self.upload('first').image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.get(name='first').delete()
+
+        self.assertEqual(self.upload('again').image.name, name)
+        self.assertEqual(StoredBlob.objects.get(name=name).ref_count, 1)
+
+    def age(self, *names):
+        StoredBlob.objects.filter(name__in=names).update(updated_at=timezone.now() - UNUSED_BLOB_GRACE - timedelta(minutes=1))
+
+    def test_replaced_image_is_released_on_commit(self):
+        ingredient = self.upload('first')
+        old = ingredient.image.name
+        ingredient.image = ContentFile(b'new picture', name='new.png')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            ingredient.save()
+        self.assertEqual(StoredBlob.objects.get(name=old).ref_count, 1)
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(StoredBlob.objects.get(name=old).ref_count, 0)
+        self.assertEqual(StoredBlob.objects.get(name=ingredient.image.name).ref_count, 1)
+
+    def test_saving_without_a_new_image_keeps_the_reference(self):
+        ingredient = self.upload('first')
+        ingredient.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(StoredBlob.objects.get(name=ingredient.image.name).ref_count, 1)
+
+    def test_collection_drops_references_left_by_failed_saves(self):
+        kept = self.upload('kept').image.name
+        # A stored file whose row was never written, as after a rolled-back save.
+        leaked = Ingredient._meta.get_field('image').storage.save('leaked.png', ContentFile(b'orphan'))
+        StoredBlob.objects.filter(name=kept).update(ref_count=3)
+        self.age(kept, leaked)
+
+        self.assertEqual(collect_unused_blobs(), 1)
+        self.assertFalse(StoredBlob.objects.filter(name=leaked).exists())
+        self.assertEqual(StoredBlob.objects.get(name=kept).ref_count, 1)
+
+
+class ServerTimingTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = create_recipe(cls.creator, cls.cuisine, cls.ingredients[:2])
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def timings(self, response):
+        return {
+            name: {key: value.strip('"') for key, _, value in (param.partition('=') for param in params)}
+            for name, *params in (entry.split(';') for entry in response['Server-Timing'].split(', '))
+        }
+
+    def test_header_reports_every_query_and_section(self):
+        before = profiling._stats.get('recipe-detail', {}).get('count', 0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/v1/app/detail-recipe/{self.recipe.pk}/')
+
+        timings = self.timings(response)
+        self.assertEqual(timings['db']['desc'], f'{len(queries)} queries')
+        self.assertIn('serialize', timings)
+        self.assertIn('render', timings)
+        self.assertGreaterEqual(float(timings['total']['dur']), float(timings['db']['dur']))
+        self.assertEqual(profiling._stats['recipe-detail']['count'], before + 1)
+
+    async def test_async_view_counts_queries_run_in_worker_threads(self):
+        access = await sync_to_async(lambda: str(UserRefreshToken.for_user(self.viewer).access_token))()
+        response = await self.async_client.get(
+            '/api/v1/app/list-recipes/', headers={'Authorization': f'Bearer {access}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        # count, page, ingredients, step pictures, facets
+        self.assertEqual(self.timings(response)['db']['desc'], '5 queries')
+
+
+def image_file(name, size, mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 80, 40, 128)[:len(mode)]).save(buffer, format='PNG')
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+class ImageVariantTests(MediaRootMixin, RecipeTestData, TestCase):
+    def upload(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(name='tomato', image=image)
+        ingredient.refresh_from_db()
+        return ingredient
+
+    def test_variants_are_resized_without_upscaling(self):
+        ingredient = self.upload(image_file('tomato.png', (1200, 600)))
+        variants = ingredient.image_variants
+        storage = ingredient.image.storage
+
+        self.assertEqual((variants['source'], variants['width'], variants['height']), (ingredient.image.name, 1200, 600))
+        self.assertEqual(
+            {label: (size['width'], size['height']) for label, size in variants['sizes'].items()},
+            {'small': (320, 160), 'large': (960, 480)},
+        )
+        for size in variants['sizes'].values():
+            self.assertTrue(storage.exists(size['webp']))
+            self.assertTrue(storage.exists(size['jpeg']))
+        self.assertTrue(variants['placeholder'].startswith('data:image/jpeg;base64,'))
+
+        small = self.upload(image_file('small.png', (100, 50), mode='RGB')).image_variants
+        self.assertEqual({size['width'] for size in small['sizes'].values()}, {100})
+
+    def test_replaced_image_drops_old_variants(self):
+        ingredient = self.upload(image_file('tomato.png', (400, 400)))
+        old = ingredient.image_variants
+        storage = ingredient.image.storage
+
+        ingredient.image = image_file('tomato.png', (500, 500), mode='RGB')
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        ingredient.refresh_from_db()
+
+        self.assertEqual(ingredient.image_variants['width'], 500)
+        for size in old['sizes'].values():
+            self.assertFalse(storage.exists(size['webp']))
+
+    def test_unreadable_image_records_no_variants(self):
+        with self.assertLogs('app.images', 'ERROR'):
+            ingredient = self.upload(ContentFile(b'not an image', name='broken.png'))
+        self.assertEqual(ingredient.image_variants, {})
+
+
+def upload_sheet(rows, columns=BULK_UPLOAD_COLUMNS, name='recipes.xlsx'):
+    wb = Workbook()
+    wb.active.append(list(columns))
+    for row in rows:
+        wb.active.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class BulkUploadStagingTests(RecipeTestData, TestCase):
+    def setUp(self):
+        super().setUp()
+        staging = tempfile.TemporaryDirectory()
+        self.addCleanup(staging.cleanup)
+        self.staging_dir = staging.name
+        settings_override = override_settings(BULK_UPLOAD_STAGING_DIR=self.staging_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_authenticate(self.creator)
+
+    def post(self, upload):
+        return self.client.post('/api/v1/app/upload-excel/', {'file': upload}, format='multipart')
+
+    def test_staged_upload_is_imported_and_removed(self):
+        ingredient_ids = ','.join(str(i.pk) for i in self.ingredients[:2])
+        response = self.post(upload_sheet([
+            ['Soup', 'Hot', 'Boil.', 5, 20, str(self.cuisine.pk), ingredient_ids],
+            ['Stew', 'Thick', 'Simmer.', 10, 60, str(uuid.uuid4()), ''],
+        ]))
+
+        self.assertEqual(response.status_code, 202)
+        job = BulkImportJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual((job.status, job.processed_rows, job.failed_rows), (BulkImportJob.STATUS_COMPLETED, 1, 1))
+        self.assertEqual(Recipe.objects.get(title='Soup').ingredients.count(), 2)
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    @override_settings(BULK_UPLOAD_MAX_SIZE=1024)
+    def test_rejected_uploads_leave_nothing_staged(self):
+        uploads = {
+            'extension': upload_sheet([], name='recipes.csv'),
+            'size': upload_sheet([['x' * 2000, '', '', 1, 1, '', '']]),
+            'content': SimpleUploadedFile('recipes.xlsx', b'title,description\n'),
+            'header': upload_sheet([], columns=('name', 'cuisine')),
+        }
+        for reason, upload in uploads.items():
+            with self.subTest(reason):
+                self.assertEqual(self.post(upload).status_code, 400)
+                self.assertEqual(os.listdir(self.staging_dir), [])
+        self.assertFalse(BulkImportJob.objects.exists())
+
+    @override_settings(BULK_UPLOAD_STAGING_TTL=60)
+    def test_collect_removes_only_stale_files_without_a_live_job(self):
+        def stage(name, age):
+            path = os.path.join(self.staging_dir, name)
+            open(path, 'wb').close()
+            os.utime(path, (time.time() - age, time.time() - age))
+            return path
+
+        stale, fresh, live = stage('stale.xlsx', 120), stage('fresh.xlsx', 10), stage('live.xlsx', 120)
+        BulkImportJob.objects.create(user=self.creator, file_path=live, status=BulkImportJob.STATUS_PROCESSING)
+
+        self.assertEqual(collect_staged_uploads(), 1)
+        self.assertEqual(sorted(os.listdir(self.staging_dir)), ['fresh.xlsx', 'live.xlsx'])
+
+
+class CachedPayloadTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = create_recipe(cls.creator, cls.cuisine, cls.ingredients[:2])
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.writer = APIClient()
+        self.writer.force_authenticate(self.creator)
+
+    def assertCached(self, path, params=None):
+        first = self.client.get(path, params)
+        with self.assertNumQueries(0):
+            second = self.client.get(path, params)
+        self.assertEqual(first.data, second.data)
+        return second.data
+
+    def test_detail_is_fresh_after_its_ingredients_change(self):
+        path = f'/api/v1/app/detail-recipe/{self.recipe.pk}/'
+        self.assertCached(path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.writer.patch(
+                f'/api/v1/app/update-receipe/{self.recipe.pk}/?pk={self.recipe.pk}',
+                {'ingredients': [str(self.ingredients[3].pk)]}, format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i['name'] for i in self.assertCached(path)['ingredients']], ['ingredient 3'])
+
+    def test_list_is_fresh_after_a_recipe_is_created(self):
+        self.assertEqual(self.assertCached('/api/v1/app/list-recipes/')['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.writer.post('/api/v1/app/create-receipe/', {
+                'title': 'Soup', 'description': 'Hot.', 'instructions': 'Boil.', 'prep_duration': 5,
+                'cook_duration': 10, 'cuisine': str(self.cuisine.pk), 'ingredients': [str(self.ingredients[0].pk)],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.assertCached('/api/v1/app/list-recipes/')['count'], 2)
+
+    def test_cuisine_stats_are_fresh_after_a_rating(self):
+        self.assertIsNone(self.assertCached('/api/v1/app/cuisine-stats/')['results'][0]['average_rating'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/app/create-ratings/', {'recipe': str(self.recipe.pk), 'score': 4}, format='json')
+        self.assertEqual(self.assertCached('/api/v1/app/cuisine-stats/')['results'][0]['average_rating'], 4)
+
+
+class RecipeWriteQueryCountTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.many = [Ingredient.objects.create(name=f'pantry {i}', image='') for i in range(80)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.creator)
+
+    def create(self, ingredients):
+        return self.client.post('/api/v1/app/create-receipe/', {
+            'title': 'Soup', 'description': 'Hot.', 'instructions': 'Boil.', 'prep_duration': 5, 'cook_duration': 10,
+            'cuisine': str(self.cuisine.pk), 'ingredients': [str(i.pk) for i in ingredients],
+        }, format='json')
+
+    def edit(self, pk, ingredients):
+        return self.client.patch(
+            f'/api/v1/app/update-receipe/{pk}/?pk={pk}', {'ingredients': [str(i.pk) for i in ingredients]}, format='json',
+        )
+
+    def test_create_queries_do_not_grow_with_ingredients(self):
+        for count in (1, 40):
+            # cuisine and ingredient checks, savepoint, recipe, ingredient rows,
+            # step pictures, cuisine counter, release
+            with self.subTest(ingredients=count), self.assertNumQueries(8):
+                self.assertEqual(self.create(self.many[:count]).status_code, 201)
+
+    def test_edit_queries_do_not_grow_with_changed_ingredients(self):
+        pk = self.create(self.many[:40]).data['id']
+        for label, ingredients in (('one swapped', self.many[1:41]), ('all replaced', self.many[40:80])):
+            # recipe, ingredient check, savepoint, stored ingredients, delete,
+            # insert, release
+            with self.subTest(label), self.assertNumQueries(7):
+                self.assertEqual(self.edit(pk, ingredients).status_code, 200)
+            self.assertEqual(set(Recipe.objects.get(pk=pk).ingredients.all()), set(ingredients))
+
+
+class RatingAggregateTests(RecipeTestData, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.writer = APIClient()
+        self.writer.force_authenticate(self.creator)
+
+    def rate(self, client, recipe, score):
+        return client.post('/api/v1/app/create-ratings/', {'recipe': str(recipe.pk), 'score': score})
+
+    def totals(self, instance):
+        instance.refresh_from_db()
+        return tuple(getattr(instance, field) for field in ('recipe_count', 'rating_count', 'rating_sum') if hasattr(instance, field))
+
+    def assertMatchesRebuild(self):
+        expected = [self.totals(row) for row in (*Recipe.objects.all(), *Cuisine.objects.all())]
+        rebuild_rating_aggregates()
+        self.assertEqual([self.totals(row) for row in (*Recipe.objects.all(), *Cuisine.objects.all())], expected)
+
+    def test_re_rating_applies_the_score_delta(self):
+        recipe = create_recipe(self.creator, self.cuisine)
+        self.assertEqual(self.rate(self.client, recipe, 2).status_code, 201)
+        self.assertEqual(self.rate(self.client, recipe, 5).status_code, 201)
+
+        self.assertEqual(self.totals(recipe), (1, 5))
+        self.assertEqual(self.totals(self.cuisine), (0, 1, 5))
+
+    def test_recipe_create_and_delete_update_cuisine_counters(self):
+        response = self.writer.post('/api/v1/app/create-receipe/', {
+            'title': 'Soup', 'description': 'Hot.', 'instructions': 'Boil.', 'prep_duration': 5, 'cook_duration': 10,
+            'cuisine': str(self.cuisine.pk), 'ingredients': [str(self.ingredients[0].pk)],
+        }, format='json')
+        self.assertEqual(self.totals(self.cuisine), (1, 0, 0))
+
+        self.rate(self.client, Recipe.objects.get(pk=response.data['id']), 4)
+        self.assertEqual(self.totals(self.cuisine), (1, 1, 4))
+
+        self.assertEqual(self.writer.delete(f"/api/v1/app/delete-receipe/?id={response.data['id']}").status_code, 204)
+        self.assertEqual(self.totals(self.cuisine), (0, 0, 0))
+
+    def test_recipe_update_keeps_rating_totals(self):
+        recipe = create_recipe(self.creator, self.cuisine)
+        stale = Recipe.objects.get(pk=recipe.pk)
+        self.rate(self.client, recipe, 4)
+
+        request = mock.Mock(user=self.creator)
+        serializer = RecipeSerializer(stale, data={'title': 'Renamed'}, partial=True, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.assertEqual(self.totals(recipe), (1, 4))
+        self.assertEqual(recipe.title, 'Renamed')
+
+    def test_deleting_a_user_removes_their_recipes_and_ratings_from_the_aggregates(self):
+        other = CustomUser.objects.create(email='other@test.local', user_type='creator')
+        own = create_recipe(self.creator, self.cuisine)
+        theirs = create_recipe(other, self.cuisine)
+        Cuisine.objects.filter(pk=self.cuisine.pk).update(recipe_count=2)
+        self.rate(self.client, own, 4)
+        self.rate(self.writer, own, 2)
+        self.rate(self.writer, theirs, 3)
+        self.rate(self.client, theirs, 5)
+
+        self.creator.delete()
+
+        self.assertEqual(self.totals(theirs), (1, 5))
+        self.assertEqual(self.totals(self.cuisine), (1, 1, 5))
+        self.assertMatchesRebuild()
+
+
+class RecipePDFDownloadTests(MediaRootMixin, RecipeTestData, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.recipe = create_recipe(self.creator, self.cuisine, self.ingredients[:2])
+
+    def download(self, **headers):
+        return self.client.get(f'/api/v1/app/recipe-pdf/?recipe_id={self.recipe.pk}', headers=headers)
+
+    def test_first_download_renders_the_card_and_repeats_are_not_modified(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        response = self.download(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_render_outliving_the_wait_is_accepted_and_stored_when_done(self):
+        render = Future()
+        with mock.patch('app.pdf._submit_render', return_value=render) as submit, override_settings(PDF_RENDER_WAIT=0):
+            for _ in range(2):
+                response = self.download()
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response['Retry-After'], '2')
+            render.set_result(b'%PDF-card')
+
+            response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-card')
+        submit.assert_called_once()
+
+    def test_failed_render_is_reported_without_rendering_again(self):
+        render = Future()
+        render.set_result(None)
+        with mock.patch('app.pdf._submit_render', return_value=render) as submit, self.assertLogs('app.pdf', 'ERROR'):
+            self.assertEqual(self.download().status_code, 500)
+            self.assertEqual(self.download().status_code, 500)
+        submit.assert_called_once()
+
+
+class DuplicateWriteTests(RecipeTestData, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe = create_recipe(cls.creator, cls.cuisine)
+
+    def test_repeated_favourite_is_stored_once(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post(f'/api/v1/app/create-favourites/?recipe_id={self.recipe.pk}').status_code, 200)
+        self.assertEqual(Favourite.objects.filter(user=self.viewer, recipe=self.recipe).count(), 1)
+
+    def test_repeated_rating_is_counted_once(self):
+        for _ in range(2):
+            response = self.client.post('/api/v1/app/create-ratings/', {'recipe': str(self.recipe.pk), 'score': 4})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(Rating.objects.filter(user=self.viewer, recipe=self.recipe).count(), 1)
+        self.recipe.refresh_from_db()
+        self.cuisine.refresh_from_db()
+        self.assertEqual((self.recipe.rating_count, self.recipe.rating_sum), (1, 4))
+        self.assertEqual((self.cuisine.rating_count, self.cuisine.rating_sum), (1, 4))
+
+
+class DedupeMigrationTests(TransactionTestCase):
+    before = [('app', '0004_rating_aggregates')]
+    after = [('app', '0005_dedupe_favourites_ratings')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicate_favourites_and_ratings_are_collapsed(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('users', 'CustomUser').objects.create(email='viewer@test.local', user_type='viewer')
+        creator = apps.get_model('users', 'CustomUser').objects.create(email='creator@test.local', user_type='creator')
+        cuisine = apps.get_model('app', 'Cuisine').objects.create(name='Test cuisine', rating_count=3, rating_sum=11)
+        recipe = apps.get_model('app', 'Recipe').objects.create(
+            creator=creator, cuisine=cuisine, title='Soup', description='Hot.', instructions='Boil.',
+            prep_duration=5, cook_duration=10, thumbnail='', rating_count=3, rating_sum=11,
+        )
+        for _ in range(3):
+            apps.get_model('app', 'Favourite').objects.create(user=user, recipe=recipe)
+        for score in (4, 4, 3):
+            apps.get_model('app', 'Rating').objects.create(user=user, recipe=recipe, score=score)
+
+        apps = self.migrate(self.after)
+
+        self.assertEqual(apps.get_model('app', 'Favourite').objects.count(), 1)
+        self.assertEqual(apps.get_model('app', 'Rating').objects.count(), 1)
+        recipe = apps.get_model('app', 'Recipe').objects.get()
+        cuisine = apps.get_model('app', 'Cuisine').objects.get()
+        self.assertEqual((recipe.rating_count, recipe.rating_sum), (1, 4))
+        self.assertEqual((cuisine.rating_count, cuisine.rating_sum), (1, 4))
+
+
+class WorkerPoolShutdownTests(SimpleTestCase):
+    def setUp(self):
+        self.connections = ConnectionHandler({'default': {'ENGINE': 'django.db.backends.dummy'}, 'pooled': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': 'recipes',
+            'OPTIONS': {'pool': {'min_size': 1, 'max_size': 2}},
+        }})
+        patcher = mock.patch('app.celery.connections', self.connections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pools = self.connections['pooled']._connection_pools
+
+    def test_closing_does_not_create_a_pool(self):
+        with mock.patch('psycopg_pool.ConnectionPool') as pool_class:
+            close_database_pools()
+        pool_class.assert_not_called()
+        self.assertNotIn('pooled', self.pools)
+
+    def test_open_pool_is_closed_and_dropped(self):
+        pool = self.connections['pooled'].pool
+        close_database_pools()
+        self.assertNotIn('pooled', self.pools)
+        self.assertTrue(pool.closed)
@@ -0,0 +1,164 @@
+"""
+Bulk-upload staging. Spreadsheets are streamed by the upload handler
+straight into BULK_UPLOAD_STAGING_DIR, outside MEDIA_ROOT, instead of being
+buffered by Django and copied again by the view.
+"""
+import os
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from openpyxl import load_workbook
+from .models import BulkImportJob
+
+BULK_UPLOAD_COLUMNS = (
+    'title', 'description', 'instructions', 'prep_duration', 'cook_duration', 'cuisine_id', 'ingredient_ids',
+)
+
+# Every .xlsx file is a zip archive, which starts with a local file header.
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+class StagedUpload(UploadedFile):
+    """An upload already written to the staging area; closing it leaves the file in place."""
+
+    def __init__(self, path, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(open(path, 'rb'), name, content_type, size, charset, content_type_extra)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class XlsxStagingUploadHandler(FileUploadHandler):
+    """
+    Writes the ``file`` field of a multipart request chunk by chunk into the
+    staging area, so memory use stays flat however large the upload is.
+    Uploads that are not xlsx files or exceed BULK_UPLOAD_MAX_SIZE are
+    rejected as soon as that is known, without keeping any data; the reason
+    is left in ``error``.
+    """
+
+    field_name = 'file'
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self.destination = None
+        self.part_path = None
+        self.head = b''
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        if field_name != self.field_name:
+            return
+        if not file_name.lower().endswith('.xlsx'):
+            self.reject("Only .xlsx files are supported.")
+        if content_length and content_length > settings.BULK_UPLOAD_MAX_SIZE:
+            self.reject_too_large()
+
+        os.makedirs(settings.BULK_UPLOAD_STAGING_DIR, exist_ok=True)
+        self.part_path = os.path.join(settings.BULK_UPLOAD_STAGING_DIR, f'{uuid.uuid4()}.xlsx.part')
+        self.destination = open(self.part_path, 'xb')
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.destination is None:
+            return None
+        if start + len(raw_data) > settings.BULK_UPLOAD_MAX_SIZE:
+            self.reject_too_large()
+        if len(self.head) < len(ZIP_MAGIC):
+            self.head += raw_data[:len(ZIP_MAGIC) - len(self.head)]
+            if not ZIP_MAGIC.startswith(self.head):
+                self.reject("File is not a valid .xlsx workbook.")
+        self.destination.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.destination is None:
+            return None
+        self.destination.close()
+        self.destination = None
+        if len(self.head) < len(ZIP_MAGIC):
+            self.discard()
+            self.error = "File is not a valid .xlsx workbook."
+            return None
+
+        path = self.part_path[:-len('.part')]
+        os.replace(self.part_path, path)
+        self.part_path = None
+        return StagedUpload(path, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra)
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def upload_complete(self):
+        self.discard()
+
+    def reject_too_large(self):
+        self.reject(f"File exceeds the {filesizeformat(settings.BULK_UPLOAD_MAX_SIZE)} upload limit.")
+
+    def reject(self, error):
+        self.error = error
+        self.discard()
+        raise SkipFile()
+
+    def discard(self):
+        if self.destination is not None:
+            self.destination.close()
+            self.destination = None
+        if self.part_path is not None:
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+            self.part_path = None
+
+
+def validate_bulk_upload_header(path):
+    """
+    Check the header row of a staged sheet without loading the workbook.
+    Raises ``ValueError`` with a client-facing message when it is wrong.
+    """
+    try:
+        wb = load_workbook(path, read_only=True)
+    except Exception:
+        raise ValueError("File is not a valid .xlsx workbook.")
+    try:
+        header = next(wb.active.iter_rows(max_row=1, values_only=True), ())
+    finally:
+        wb.close()
+
+    header = tuple(str(cell).strip().lower() if cell is not None else '' for cell in header)
+    if header[:len(BULK_UPLOAD_COLUMNS)] != BULK_UPLOAD_COLUMNS:
+        raise ValueError(f"Header row must be: {', '.join(BULK_UPLOAD_COLUMNS)}.")
+
+
+def collect_staged_uploads():
+    """
+    Remove staged files older than BULK_UPLOAD_STAGING_TTL seconds that no
+    live import job still needs: uploads whose job was never queued, partial
+    uploads of killed workers, and files of jobs whose worker died before
+    cleaning up. Returns the number of files removed.
+    """
+    directory = settings.BULK_UPLOAD_STAGING_DIR
+    if not os.path.isdir(directory):
+        return 0
+
+    ttl = settings.BULK_UPLOAD_STAGING_TTL
+    live = set(
+        BulkImportJob.objects.filter(
+            status__in=[BulkImportJob.STATUS_PENDING, BulkImportJob.STATUS_PROCESSING],
+            updated_at__gte=timezone.now() - timedelta(seconds=ttl),
+        ).values_list('file_path', flat=True)
+    )
+    cutoff = time.time() - ttl
+
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.path not in live and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+    return removed
@@ -6,17 +6,26 @@ urlpatterns = [
     path('update-receipe/<uuid:pk>/', RecipeCreateView.as_view()),
     path('delete-receipe/', DeleteRecipeView.as_view()),
     path('upload-excel/', BulkRecipeUploadView.as_view()),
+    path('upload-excel/<uuid:pk>/', BulkImportJobStatusView.as_view()),
     
     path('create-ingredients/', IngredientCreateAPIView.as_view()),
     path('create-cuisine/', CuisineCreateAPIView.as_view()),
     path('create-step-picture/',StepPictureCreateAPIView.as_view()),
     
     path('create-favourites/', FavouriteView.as_view(), name='favourite-recipe'),   
+    path('batch-favourites/', FavouriteBatchView.as_view(), name='batch-favourites'),
+    path('favourite-status/', FavouriteStatusView.as_view(), name='favourite-status'),
     path('create-ratings/', RatingCreateView.as_view(), name='create-rating'), 
+    path('batch-ratings/', RatingBatchView.as_view(), name='batch-ratings'),
+    path('recommendations/', RecommendationView.as_view(), name='recommendations'),
     
     path('list-recipes/', RecipeListView.as_view(), name='recipe-list'),
+    path('search-recipes/', RecipeSearchView.as_view(), name='recipe-search'),
+    path('what-can-i-cook/', WhatCanICookView.as_view(), name='what-can-i-cook'),
     path('detail-recipe/<uuid:pk>/', RecipeDetailView.as_view(), name='recipe-detail'),
     path('recipe-pdf/', RecipePDFDownloadView.as_view()),
+    path('export-recipes-pdf/', RecipePDFExportView.as_view()),
     
-    path('cuisine-stats/', CuisineStatsView.as_view())
+    path('cuisine-stats/', CuisineStatsView.as_view()),
+    path('request-metrics/', RequestMetricsView.as_view(), name='request-metrics'),
 ]
\ No newline at end of file
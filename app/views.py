@@ -2,23 +2,37 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, permissions
 from rest_framework.permissions import IsAuthenticated
-from django.shortcuts import get_object_or_404
-from django.db.models import Count, Avg
-from .models import Recipe, Favourite, Rating, Cuisine
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.db import transaction
+from .models import Recipe, Favourite, Rating, Cuisine, BulkImportJob
 from .serializers import RecipeSerializer, FavouriteSerializer, RatingSerializer, CuisineSerializer, IngredientSerializer, StepPictureSerializer
 from users.permissions import *
 from rest_framework.pagination import LimitOffsetPagination
-from .serializers import RecipeDetailSerializer
+from .pagination import FavouriteCursorPagination, RecipeCursorPagination
+from .search import search_recipes
+from .filters import RecipeFilters
+from .matching import ingredient_index
+from .recommendations import recommend_recipe_ids, schedule_similarity_refresh
+from .serializers import RecipeDetailSerializer, FavouriteRecipeSerializer, BulkImportJobSerializer, BulkImportRowErrorSerializer
 from .tasks import process_bulk_recipes
+from .uploads import XlsxStagingUploadHandler, validate_bulk_upload_header
+from .profiling import InstrumentedViewMixin, endpoint_stats, flush as flush_request_metrics, slow_profiles
+from .pdf import cached_card, failed_key, html_digest, pending_key, recipe_pdf_path, remember_card, render_card, render_recipe_html, stream_recipe_cards_zip
+from .aggregates import apply_recipe_delta
+from .batch import MAX_BATCH_SIZE, apply_favourite_batch, apply_rating_batch
+from .cache import CATALOG, CUISINE_STATS, RECIPE_LIST, acached_payload, recipe_namespace
+from .async_views import AsyncAPIView, stream_in_thread
+from asgiref.sync import sync_to_async
 import uuid
 import os
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-from xhtml2pdf import pisa
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 
 
 
-class RecipeCreateView(APIView):
+class RecipeCreateView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreatorOrReadOnly]
 
     def post(self, request):
@@ -45,7 +59,7 @@ class RecipeCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     
-class DeleteRecipeView(APIView):
+class DeleteRecipeView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreatorOrReadOnly]
 
     def delete(self, request):
@@ -54,15 +68,18 @@ class DeleteRecipeView(APIView):
             return Response({'error': 'Missing id query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            recipe = Recipe.objects.get(pk=recipe_id, creator=request.user)
+            with transaction.atomic():
+                # The lock keeps a concurrent rating from changing the totals
+                # between reading them and taking them off the cuisine.
+                recipe = Recipe.objects.select_for_update().get(pk=recipe_id, creator=request.user)
+                recipe.delete()
+                apply_recipe_delta(recipe.cuisine_id, -1, recipe.rating_count, recipe.rating_sum)
         except Recipe.DoesNotExist:
             return Response({'error': 'Not found or not authorized'}, status=status.HTTP_404_NOT_FOUND)
-
-        recipe.delete()
         return Response({'message': 'Recipe deleted successfully.'}, status=status.HTTP_204_NO_CONTENT)
 
     
-class IngredientCreateAPIView(APIView):
+class IngredientCreateAPIView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreator]
 
     def post(self, request):
@@ -76,7 +93,7 @@ class IngredientCreateAPIView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST) 
     
     
-class CuisineCreateAPIView(APIView):
+class CuisineCreateAPIView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreator]
 
     def post(self, request):
@@ -89,7 +106,7 @@ class CuisineCreateAPIView(APIView):
             }, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-class StepPictureCreateAPIView(APIView):
+class StepPictureCreateAPIView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreator]
 
     def post(self, request):
@@ -104,16 +121,26 @@ class StepPictureCreateAPIView(APIView):
     
     
     
-class FavouriteView(APIView):
+class FavouriteView(InstrumentedViewMixin, APIView):
     permission_classes = [IsAuthenticated]
 
+    def get(self, request):
+        favourites = Favourite.objects.filter(user=request.user).with_recipes()
+        paginator = FavouriteCursorPagination()
+
+        result_page = paginator.paginate_queryset(favourites, request)
+        serializer = FavouriteRecipeSerializer(result_page, many=True)
+        return paginator.get_paginated_response(self.serialize(serializer))
+
     def post(self, request):
         recipe_id = request.query_params.get('recipe_id')
         if not recipe_id:
             return Response({'error': 'Missing recipe_id query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
         
         recipe = get_object_or_404(Recipe, pk=recipe_id)
-        Favourite.objects.get_or_create(user=request.user, recipe=recipe)
+        # INSERT ... ON CONFLICT DO NOTHING against unique_favourite_user_recipe.
+        Favourite.objects.bulk_create([Favourite(user=request.user, recipe=recipe)], ignore_conflicts=True)
+        schedule_similarity_refresh(recipe.pk)
         return Response({'status': 'added to favourites'})
 
     def delete(self, request):
@@ -121,11 +148,71 @@ class FavouriteView(APIView):
         if not recipe_id:
             return Response({'error': 'Missing recipe_id query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        Favourite.objects.filter(user=request.user, recipe_id=recipe_id).delete()
+        if Favourite.objects.filter(user=request.user, recipe_id=recipe_id).delete()[0]:
+            schedule_similarity_refresh(recipe_id)
         return Response({'status': 'removed from favourites'})
 
 
-class RatingCreateView(APIView):
+def _batch_items(request, key):
+    items = request.data.get(key) if isinstance(request.data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, Response({'error': f'Expected a non-empty "{key}" list.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_BATCH_SIZE:
+        return None, Response({'error': f'At most {MAX_BATCH_SIZE} items per batch.'}, status=status.HTTP_400_BAD_REQUEST)
+    return items, None
+
+
+class FavouriteBatchView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items, error = _batch_items(request, 'favourites')
+        if error:
+            return error
+        return Response({"results": apply_favourite_batch(request.user, items)})
+
+
+class FavouriteStatusView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            recipe_ids = {
+                uuid.UUID(value) for value in request.query_params.get('recipe_ids', '').split(',') if value.strip()
+            }
+        except ValueError:
+            return Response({'error': 'Invalid recipe_ids.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not recipe_ids:
+            return Response({'error': 'Missing recipe_ids query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(recipe_ids) > 100:
+            return Response({'error': 'At most 100 recipe_ids per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        favourited = set(
+            Favourite.objects.filter(user=request.user, recipe_id__in=recipe_ids).values_list('recipe_id', flat=True)
+        )
+        return Response({"favourited": {str(recipe_id): recipe_id in favourited for recipe_id in recipe_ids}})
+
+
+class RecommendationView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+        except ValueError:
+            return Response({'error': 'Invalid limit.'}, status=status.HTTP_400_BAD_REQUEST)
+        ranked = recommend_recipe_ids(request.user, limit)
+        recipes = Recipe.objects.for_detail().in_bulk([recipe_id for recipe_id, _ in ranked])
+
+        results = [
+            {"recipe": self.serialize(RecipeDetailSerializer(recipes[recipe_id])), "score": round(score, 4)}
+            for recipe_id, score in ranked
+            if recipe_id in recipes
+        ]
+        return Response({"results": results})
+
+
+class RatingCreateView(InstrumentedViewMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -135,91 +222,242 @@ class RatingCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class RecipeListView(APIView):
+class RatingBatchView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items, error = _batch_items(request, 'ratings')
+        if error:
+            return error
+        return Response({"results": apply_rating_batch(request.user, items)})
+
+class RecipeListView(InstrumentedViewMixin, AsyncAPIView):
+    async def get(self, request):
+        try:
+            filters = RecipeFilters(request.query_params)
+        except ValueError:
+            return Response({'error': 'Invalid filter value.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        async def build():
+            recipes = filters.apply(Recipe.objects.for_detail())
+            if request.query_params.get('pagination') == 'cursor':
+                paginator = RecipeCursorPagination()
+            else:
+                paginator = LimitOffsetPagination()
+                paginator.default_limit = 10
+
+            result_page = await sync_to_async(paginator.paginate_queryset)(recipes, request)
+            serializer = RecipeDetailSerializer(result_page, many=True)
+            data = paginator.get_paginated_response(self.serialize(serializer)).data
+            # Facets describe the whole filtered set, so later pages only
+            # recompute them when asked to with ?facets=1.
+            if request.query_params.get('facets') == '1' or self.first_page(paginator):
+                data['facets'] = await sync_to_async(filters.facet_counts)()
+            return data
+
+        return Response(await acached_payload('recipe-list', [RECIPE_LIST, CATALOG], request, build))
+
+    @staticmethod
+    def first_page(paginator):
+        if isinstance(paginator, RecipeCursorPagination):
+            return paginator.cursor is None
+        return not paginator.offset
+    
+class RecipeSearchView(InstrumentedViewMixin, APIView):
     def get(self, request):
-        recipes = Recipe.objects.all()
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Missing q query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        recipes = search_recipes(Recipe.objects.for_detail(), query)
         paginator = LimitOffsetPagination()
         paginator.default_limit = 10
 
         result_page = paginator.paginate_queryset(recipes, request)
         serializer = RecipeDetailSerializer(result_page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(self.serialize(serializer))
     
-class RecipeDetailView(APIView):
-    def get(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = RecipeDetailSerializer(recipe)
-        return Response(serializer.data)
-    
-class CuisineStatsView(APIView):
+class WhatCanICookView(InstrumentedViewMixin, APIView):
     def get(self, request):
+        try:
+            ingredient_ids = [
+                uuid.UUID(value) for value in request.query_params.get('ingredients', '').split(',') if value.strip()
+            ]
+            max_missing = int(request.query_params.get('max_missing', 0))
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({'error': 'Invalid ingredients, max_missing or limit.'}, status=status.HTTP_400_BAD_REQUEST)
+        if max_missing < 0 or limit < 1:
+            return Response({'error': 'Invalid ingredients, max_missing or limit.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids:
+            return Response({'error': 'Missing ingredients query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = ingredient_index.match(ingredient_ids, max_missing=max_missing, limit=limit)
+        recipes = Recipe.objects.for_detail().in_bulk([recipe_id for recipe_id, _, _ in matches])
+
+        results = [
+            {
+                "recipe": self.serialize(RecipeDetailSerializer(recipes[recipe_id])),
+                "matched_ingredients": matched,
+                "total_ingredients": total,
+                "missing_ingredients": total - matched,
+            }
+            for recipe_id, matched, total in matches
+            if recipe_id in recipes
+        ]
+        return Response({"results": results})
+    
+class RecipeDetailView(InstrumentedViewMixin, AsyncAPIView):
+    async def get(self, request, pk):
+        async def build():
+            recipe = await aget_object_or_404(Recipe.objects.for_detail(), pk=pk)
+            return self.serialize(RecipeDetailSerializer(recipe))
+
+        return Response(await acached_payload('recipe-detail', [recipe_namespace(pk), CATALOG], request, build))
+    
+class CuisineStatsView(InstrumentedViewMixin, AsyncAPIView):
+    async def get(self, request):
         offset = int(request.query_params.get('offset', 0))
         limit = int(request.query_params.get('limit', 10))
 
-        cuisines = Cuisine.objects.annotate(
-            recipe_count=Count('recipe'),
-            average_rating=Avg('recipe__rating__score')
-        )
+        async def build():
+            cuisines = Cuisine.objects.order_by('name')
 
-        total = cuisines.count()
+            total = await cuisines.acount()
 
-        cuisines = cuisines[offset:offset + limit]
+            cuisines = cuisines[offset:offset + limit]
 
-        data = [
-            {
-                "cuisine_id": str(cuisine.id),
-                "cuisine_name": cuisine.name,
-                "recipe_count": cuisine.recipe_count,
-                "average_rating": round(cuisine.average_rating, 2) if cuisine.average_rating else None
+            data = [
+                {
+                    "cuisine_id": str(cuisine.id),
+                    "cuisine_name": cuisine.name,
+                    "recipe_count": cuisine.recipe_count,
+                    "average_rating": round(cuisine.rating_sum / cuisine.rating_count, 2) if cuisine.rating_count else None
+                }
+                async for cuisine in cuisines
+            ]
+
+            return {
+                "count": total,
+                "offset": offset,
+                "limit": limit,
+                "results": data
             }
-            for cuisine in cuisines
-        ]
 
-        return Response({
-            "count": total,
-            "offset": offset,
-            "limit": limit,
-            "results": data
-        }, status=status.HTTP_200_OK)
+        return Response(await acached_payload('cuisine-stats', [CUISINE_STATS], request, build), status=status.HTTP_200_OK)
 
 
 
-class BulkRecipeUploadView(APIView):
+class BulkRecipeUploadView(InstrumentedViewMixin, APIView):
     permission_classes = [IsCreator]
 
     def post(self, request):
-        
+        # Must be installed before request.FILES is first read.
+        upload_handler = XlsxStagingUploadHandler(request)
+        request.upload_handlers = [upload_handler]
+
         excel_file = request.FILES.get('file')
+        if upload_handler.error:
+            return Response({"error": upload_handler.error}, status=status.HTTP_400_BAD_REQUEST)
         if not excel_file:
             return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save to tmp folder
-        tmp_filename = f"media/bulk_uploads/{uuid.uuid4()}.xlsx"
-        os.makedirs(os.path.dirname(tmp_filename), exist_ok=True)
-        with open(tmp_filename, 'wb+') as destination:
-            for chunk in excel_file.chunks():
-                destination.write(chunk)
+        staged_path = excel_file.temporary_file_path()
+        excel_file.close()
+        try:
+            validate_bulk_upload_header(staged_path)
+        except ValueError as e:
+            os.remove(staged_path)
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = BulkImportJob.objects.create(user=request.user, file_path=staged_path)
+        process_bulk_recipes.delay(str(job.id))
+
+        return Response({
+            "message": "File uploaded. Processing started.",
+            "job_id": str(job.id)
+        }, status=status.HTTP_202_ACCEPTED)
 
 
-        process_bulk_recipes.delay(tmp_filename, request.user.id)
+class BulkImportJobStatusView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsCreator]
+
+    def get(self, request, pk):
+        job = get_object_or_404(BulkImportJob, pk=pk, user=request.user)
 
-        return Response({"message": "File uploaded. Processing started."}, status=status.HTTP_202_ACCEPTED)
+        paginator = LimitOffsetPagination()
+        paginator.default_limit = 100
+        result_page = paginator.paginate_queryset(job.row_errors.all(), request)
+        response = paginator.get_paginated_response(BulkImportRowErrorSerializer(result_page, many=True).data)
+        response.data['job'] = BulkImportJobSerializer(job).data
+        return response
     
-class RecipePDFDownloadView(APIView):
+class RecipePDFDownloadView(InstrumentedViewMixin, APIView):
     permission_classes = [IsAuthenticated] 
 
     def get(self, request):
-        recipe_id = request.query_params.get('recipe_id')
-        recipe = get_object_or_404(Recipe, pk=recipe_id)
-
-        html = render_to_string("pdf/recipe_card.html", {"recipe": recipe})
+        try:
+            recipe_id = uuid.UUID(request.query_params.get('recipe_id', ''))
+        except ValueError:
+            return Response({'error': 'Missing or invalid recipe_id query parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        html = None
+        card = cached_card(recipe_id)
+        if card is None:
+            recipe = get_object_or_404(Recipe.objects.for_detail(), pk=recipe_id)
+            html = render_recipe_html(recipe)
+            card = (html_digest(html), recipe.title)
+            remember_card(recipe_id, *card)
+        digest, title = card
+
+        etag = f'"{digest}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        path = recipe_pdf_path(recipe_id, digest)
+        if not default_storage.exists(path):
+            if cache.get(failed_key(recipe_id, digest)):
+                return HttpResponse("PDF generation failed", status=500)
+            rendered = None
+            if cache.add(pending_key(recipe_id, digest), True, timeout=60):
+                if html is None:
+                    html = render_recipe_html(get_object_or_404(Recipe.objects.for_detail(), pk=recipe_id))
+                rendered = render_card(recipe_id, digest, html, settings.PDF_RENDER_WAIT)
+            if rendered is False:
+                return HttpResponse("PDF generation failed", status=500)
+            if rendered is None:
+                # Still rendering here or in another request.
+                return Response({'status': 'PDF is being generated, retry shortly.'},
+                                status=status.HTTP_202_ACCEPTED, headers={'Retry-After': '2'})
+
+        response = FileResponse(default_storage.open(path, 'rb'), content_type="application/pdf",
+                                as_attachment=True, filename=f"{title}.pdf")
+        response["ETag"] = etag
+        return stream_in_thread(request, response)
+
+
+class RecipePDFExportView(InstrumentedViewMixin, APIView):
+    permission_classes = [IsCreator]
 
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="{recipe.title}.pdf"'
+    def get(self, request):
+        recipes = Recipe.objects.for_detail().filter(creator=request.user).iterator(chunk_size=100)
+        response = StreamingHttpResponse(
+            stream_recipe_cards_zip(recipes),
+            content_type="application/zip"
+        )
+        response["Content-Disposition"] = 'attachment; filename="cookbook.zip"'
+        return stream_in_thread(request, response)
 
-        pisa_status = pisa.CreatePDF(html, dest=response)
 
-        if pisa_status.err:
-            return HttpResponse("PDF generation failed", status=500)
+class RequestMetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
 
-        return response
\ No newline at end of file
+    def get(self, request):
+        flush_request_metrics()
+        stats = endpoint_stats()
+        data = {"endpoints": stats}
+        if request.query_params.get('profiles'):
+            data["profiles"] = slow_profiles(stats)
+        return Response(data)
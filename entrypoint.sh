@@ -1,14 +1,40 @@
 #!/bin/bash
+# Usage: entrypoint.sh [web|migrate|dev]
+#   web      production server (gunicorn, see gunicorn.conf.py); the default
+#   migrate  apply migrations and collect static files, then exit
+#   dev      apply migrations and run the autoreloading development server
+set -e
 
-echo "Starting up the container..."
+wait_for_db() {
+    echo "Waiting for the database..."
+    until nc -z "${POSTGRES_HOST:-localhost}" "${POSTGRES_PORT:-5432}"; do
+        sleep 1
+    done
+}
 
-echo "Applying migrations..."
-python manage.py makemigrations users
-python manage.py makemigrations app
-python manage.py migrate
+case "${1:-web}" in
+    migrate)
+        wait_for_db
+        echo "Applying migrations..."
+        python manage.py migrate --noinput
 
-echo "Collecting static files..."
-python manage.py collectstatic --noinput
+        echo "Collecting static files..."
+        python manage.py collectstatic --noinput
+        ;;
+    dev)
+        wait_for_db
+        echo "Applying migrations..."
+        python manage.py migrate --noinput
 
-echo "Starting server..."
-exec python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+        echo "Starting development server..."
+        exec python manage.py runserver 0.0.0.0:8000
+        ;;
+    web)
+        echo "Starting server..."
+        exec gunicorn --config gunicorn.conf.py
+        ;;
+    *)
+        echo "Unknown command: $1" >&2
+        exit 64
+        ;;
+esac
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for ``entrypoint.sh web``.
+
+WEB_INTERFACE=asgi (default) runs the ASGI application on uvicorn workers:
+async views, slow clients and file downloads are served from the event
+loop, and blocking code runs in per-request threads. WEB_INTERFACE=wsgi runs
+the WSGI application on threaded sync workers instead.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+if os.getenv("WEB_INTERFACE", "asgi") == "wsgi":
+    wsgi_app = "receipe_management_system.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.getenv("WEB_THREADS", 4))
+    default_workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    wsgi_app = "receipe_management_system.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    default_workers = multiprocessing.cpu_count() + 1
+
+workers = int(os.getenv("WEB_CONCURRENCY", default_workers))
+timeout = int(os.getenv("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot accumulate; the jitter
+# keeps them from all restarting at once.
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,46 @@
+"""
+Settings for the benchmark suite (``seed_benchmark_data`` and
+``run_benchmark``), which has to run without the docker-compose services:
+SQLite under BENCHMARK_DIR by default, or a local Postgres when
+BENCHMARK_POSTGRES is set (using the usual POSTGRES_* variables); an
+in-process cache; Celery tasks executed eagerly inside the request.
+
+    python manage.py seed_benchmark_data --settings=receipe_management_system.benchmark_settings
+    python manage.py run_benchmark --settings=receipe_management_system.benchmark_settings
+"""
+import tempfile
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, os
+
+DEBUG = False
+
+BENCHMARK_DIR = os.getenv("BENCHMARK_DIR", os.path.join(tempfile.gettempdir(), "receipe_management_benchmark"))
+os.makedirs(BENCHMARK_DIR, exist_ok=True)
+
+if os.getenv("BENCHMARK_POSTGRES"):
+    DATABASES["default"]["HOST"] = os.getenv("POSTGRES_HOST", "localhost")
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(BENCHMARK_DIR, "db.sqlite3"),
+            # Concurrent benchmark writers queue for the write lock up front
+            # instead of failing when a read transaction tries to upgrade.
+            "OPTIONS": {
+                "timeout": 30,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": "PRAGMA journal_mode=WAL;",
+            },
+        }
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+CELERY_TASK_ALWAYS_EAGER = True
+
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, "media")
+BULK_UPLOAD_STAGING_DIR = os.path.join(BENCHMARK_DIR, "staging")
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
+from celery.schedules import crontab
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
     'users',
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.profiling.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +82,16 @@ WSGI_APPLICATION = 'receipe_management_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Connection reuse. With DB_POOL on (the default) each process borrows
+# connections from a psycopg 3 pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE
+# connections, waiting up to DB_POOL_TIMEOUT seconds for a free one. ASGI
+# workers need the pool: they serve every request from a new thread, so a
+# per-thread persistent connection would never be reused. With DB_POOL off,
+# each thread keeps its connection for DB_CONN_MAX_AGE seconds. Either way a
+# connection is health-checked before it is reused. docker-compose sizes the
+# pool per process type.
+DB_POOL = os.getenv("DB_POOL", "true").lower() in ("1", "true", "yes")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -87,6 +100,19 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST", "db"),
         "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "pool": {
+                "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+                "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+                "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+                # Recycle connections periodically, and let idle ones above
+                # min_size go after a while.
+                "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME", 30 * 60)),
+                "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", 5 * 60)),
+            },
+        } if DB_POOL else {},
     }
 }
 
@@ -131,6 +157,14 @@ STATIC_ROOT = BASE_DIR / "staticfiles_build" / "static"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Bulk-upload spreadsheets are staged here (outside MEDIA_ROOT, so never
+# served) until the import task has read them. Must be shared with the Celery
+# workers. Files older than BULK_UPLOAD_STAGING_TTL seconds that no live job
+# needs are removed by a periodic task.
+BULK_UPLOAD_STAGING_DIR = os.getenv("BULK_UPLOAD_STAGING_DIR", os.path.join(BASE_DIR, 'staging', 'bulk_uploads'))
+BULK_UPLOAD_MAX_SIZE = int(os.getenv("BULK_UPLOAD_MAX_SIZE", 20 * 1024 * 1024))
+BULK_UPLOAD_STAGING_TTL = int(os.getenv("BULK_UPLOAD_STAGING_TTL", 24 * 60 * 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -141,7 +175,7 @@ AUTH_USER_MODEL = 'users.CustomUser'
 REST_FRAMEWORK = {
     "DEFAULT_THROTTLE_RATES": {"user": "1000/day", "anon": "100/day"},
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.StatelessJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
 }
@@ -155,4 +189,57 @@ SIMPLE_JWT = {
 }
 
 CELERY_BROKER_URL = 'redis://redis_receipe_management_system:6379/0'
-CELERY_RESULT_BACKEND = 'redis://redis_receipe_management_system:6379/0'
\ No newline at end of file
+CELERY_RESULT_BACKEND = 'redis://redis_receipe_management_system:6379/0'
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_CACHE_URL", "redis://redis_receipe_management_system:6379/1"),
+    }
+}
+
+# Seconds a cached recipe/cuisine-stats payload lives; writes invalidate it sooner.
+RECIPE_CACHE_TIMEOUT = int(os.getenv("RECIPE_CACHE_TIMEOUT", 300))
+
+# Processes each web process keeps for rendering recipe cards, shared by all
+# of its cookbook exports.
+PDF_EXPORT_WORKERS = int(os.getenv("PDF_EXPORT_WORKERS", os.cpu_count() or 1))
+
+# Seconds a recipe card download waits for a first render before answering
+# 202 + Retry-After; the render finishes in the background either way.
+PDF_RENDER_WAIT = float(os.getenv("PDF_RENDER_WAIT", 10))
+
+# Seconds between checks for ingredient changes made by other processes to
+# the in-memory "what can I cook" index, and how many changed recipes are
+# re-read before the index is rebuilt from scratch instead.
+INGREDIENT_INDEX_REFRESH = int(os.getenv("INGREDIENT_INDEX_REFRESH", 30))
+INGREDIENT_INDEX_MAX_REPLAY = int(os.getenv("INGREDIENT_INDEX_MAX_REPLAY", 500))
+
+# Neighbours kept per recipe by the item-item recommendation model, and the
+# debounce (seconds) before a recipe's neighbours are refreshed after new
+# ratings or favourites.
+RECOMMENDATION_NEIGHBOURS = int(os.getenv("RECOMMENDATION_NEIGHBOURS", 50))
+RECOMMENDATION_REFRESH_DELAY = int(os.getenv("RECOMMENDATION_REFRESH_DELAY", 300))
+
+# Per-endpoint request metrics (see app/profiling.py): seconds between
+# publishing a process's histograms to the cache, and the opt-in cProfile
+# sampling of requests (fraction sampled, and the duration in ms above which
+# a sampled profile is kept).
+REQUEST_METRICS_FLUSH_INTERVAL = int(os.getenv("REQUEST_METRICS_FLUSH_INTERVAL", 10))
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv("REQUEST_PROFILE_SAMPLE_RATE", 0))
+REQUEST_PROFILE_SLOW_MS = int(os.getenv("REQUEST_PROFILE_SLOW_MS", 500))
+
+CELERY_BEAT_SCHEDULE = {
+    "rebuild-recipe-similarity": {
+        "task": "app.tasks.build_recipe_similarity",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "collect-staged-bulk-uploads": {
+        "task": "app.tasks.collect_stale_bulk_uploads",
+        "schedule": crontab(minute=30),
+    },
+    "collect-unused-media-blobs": {
+        "task": "app.tasks.collect_unused_media_blobs",
+        "schedule": crontab(hour=4, minute=0),
+    },
+}
@@ -0,0 +1,38 @@
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+from .tokens import USER_CLAIMS, is_blacklisted
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that builds the user from the token's claims instead
+    of loading the row. The id and USER_CLAIMS are set and every other field
+    is deferred, so it is loaded only if something reads it. Access tokens
+    are checked against the cache blacklist, so logging out, deactivating
+    or deleting the user revokes them immediately. Tokens issued without
+    the claims fall back to the query.
+
+    The trade-off is that a change of user_type or is_staff after a token
+    was issued only shows once it expires. Deactivations made with
+    QuerySet.update() send no signal and are likewise only picked up then.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_blacklisted(token):
+            raise AuthenticationFailed(_("Token is blacklisted"), code="token_not_valid")
+        return token
+
+    def get_user(self, validated_token):
+        claims = (api_settings.USER_ID_CLAIM, *USER_CLAIMS)
+        if any(claim not in validated_token for claim in claims):
+            return super().get_user(validated_token)
+
+        values = {api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM], 'is_active': True}
+        values.update((claim, validated_token[claim]) for claim in USER_CLAIMS)
+        # from_db() takes the values in field order.
+        names = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in values]
+        return self.user_model.from_db(router.db_for_read(self.user_model), names, [values[name] for name in names])
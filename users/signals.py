@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import CustomUser
+from .tokens import revoke_user_tokens
+
+
+@receiver(post_save, sender=CustomUser)
+def revoke_inactive_user_tokens(sender, instance, created, **kwargs):
+    # Authentication trusts the token's claims and never reads is_active.
+    if not instance.is_active and not created:
+        user_id = instance.pk
+        transaction.on_commit(lambda: revoke_user_tokens(user_id))
+
+
+@receiver(post_delete, sender=CustomUser)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: revoke_user_tokens(user_id))
@@ -1,3 +1,78 @@
+import time
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import CustomUser
+from .tokens import UserRefreshToken
 
-# Create your tests here.
+
+class RefreshTokenBlacklistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='viewer@test.local', user_type='viewer')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def refresh(self, token):
+        return self.client.post('/auth/get-access-token/', {'refresh': str(token)})
+
+    def test_token_blacklisted_in_database_before_the_cache_blacklist_is_rejected(self):
+        legacy = RefreshToken.for_user(self.user)
+        self.assertEqual(self.refresh(legacy).status_code, 200)
+
+        legacy.blacklist()
+        self.assertEqual(self.refresh(legacy).status_code, 400)
+
+    def test_current_token_is_verified_without_queries(self):
+        token = UserRefreshToken.for_user(self.user)
+        with self.assertNumQueries(0):
+            UserRefreshToken(str(token))
+
+    def test_logout_blacklists_refresh_token(self):
+        token = UserRefreshToken.for_user(self.user)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post('/auth/logout/', {'refresh': str(token)}).status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 400)
+
+
+class DeactivatedUserTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email='creator@test.local', user_type='creator')
+        self.refresh = UserRefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def test_deactivation_revokes_issued_tokens(self):
+        self.assertEqual(self.client.get('/api/v1/app/cuisine-stats/').status_code, 200)
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(self.client.get('/api/v1/app/cuisine-stats/').status_code, 401)
+        self.client.credentials()
+        self.assertEqual(
+            self.client.post('/auth/get-access-token/', {'refresh': str(self.refresh)}).status_code, 400
+        )
+
+    def test_deletion_revokes_issued_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/v1/app/cuisine-stats/').status_code, 401)
+
+    def test_tokens_issued_after_reactivation_are_accepted(self):
+        self.user.is_active = False
+        with mock.patch('users.tokens.time.time', return_value=time.time() - 1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.save()
+        self.user.is_active = True
+        self.user.save()
+
+        access = UserRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get('/api/v1/app/cuisine-stats/').status_code, 200)
@@ -0,0 +1,108 @@
+"""
+JWTs that carry the claims StatelessJWTAuthentication builds the user from,
+and a token blacklist kept in the cache instead of the token_blacklist
+tables: one entry per revoked jti, expiring when the token would have, and
+one per deactivated or deleted user, holding the time of the revocation.
+"""
+import time
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken, Token
+
+# User fields copied into every token, besides the id.
+USER_CLAIMS = ('user_type', 'is_staff')
+
+
+def _blacklist_key(token):
+    return f'users:token-blacklist:{token[api_settings.JTI_CLAIM]}'
+
+
+def blacklist_token(token):
+    """Revoke ``token`` until it expires."""
+    remaining = token['exp'] - int(token.current_time.timestamp())
+    if remaining > 0:
+        cache.set(_blacklist_key(token), True, timeout=remaining)
+
+
+def _revoked_key(user_id):
+    return f'users:tokens-revoked:{user_id}'
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to the user so far."""
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    cache.set(_revoked_key(user_id), int(time.time()), timeout=int(lifetime.total_seconds()))
+
+
+def is_blacklisted(token):
+    """
+    Whether ``token`` itself was blacklisted or its user's tokens were
+    revoked after it was issued, read in one cache round trip.
+    """
+    token_key, user_key = _blacklist_key(token), _revoked_key(token[api_settings.USER_ID_CLAIM])
+    values = cache.get_many([token_key, user_key])
+    if token_key in values:
+        return True
+    revoked_at = values.get(user_key)
+    return revoked_at is not None and token.get('iat', 0) <= revoked_at
+
+
+class UserRefreshToken(Token):
+    """
+    Refresh token carrying USER_CLAIMS, which its access tokens inherit.
+    Unlike simplejwt's RefreshToken with the token_blacklist app, issuing
+    one writes no OutstandingToken row and verifying it makes no query.
+    """
+
+    token_type = 'refresh'
+    lifetime = api_settings.REFRESH_TOKEN_LIFETIME
+    no_copy_claims = RefreshToken.no_copy_claims
+    access_token_class = AccessToken
+    access_token = RefreshToken.access_token
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if is_blacklisted(self) or self.legacy_blacklisted():
+            raise TokenError(_("Token is blacklisted"))
+
+    def legacy_blacklisted(self):
+        """
+        Whether a refresh token issued before the cache blacklist, recognised
+        by its missing USER_CLAIMS, was blacklisted in the token_blacklist
+        tables. Such tokens are gone within REFRESH_TOKEN_LIFETIME, and with
+        them this query.
+        """
+        if all(claim in self for claim in USER_CLAIMS):
+            return False
+        return BlacklistedToken.objects.filter(token__jti=self[api_settings.JTI_CLAIM]).exists()
+
+    def blacklist(self):
+        blacklist_token(self)
+
+    def fresh_access_token(self):
+        """
+        Access token with USER_CLAIMS re-read from the user's row, so a
+        changed or deactivated user is picked up on the next refresh.
+        """
+        User = get_user_model()
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]}, is_active=True
+        ).first()
+        if user is None:
+            raise TokenError(_("User not found"))
+
+        access = self.access_token
+        for claim in USER_CLAIMS:
+            access[claim] = getattr(user, claim)
+        return access
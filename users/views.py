@@ -3,8 +3,9 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken, TokenError
+from rest_framework_simplejwt.tokens import TokenError
 from .serializers import CustomUserSerializer
+from .tokens import UserRefreshToken, blacklist_token
 
 class RegisterUserView(APIView):
     permission_classes = [AllowAny]
@@ -13,7 +14,7 @@ class RegisterUserView(APIView):
         serializer = CustomUserSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = UserRefreshToken.for_user(user)
             access_token = str(refresh.access_token)
             return Response({
                 "user": serializer.data,
@@ -33,7 +34,7 @@ class LoginUserView(APIView):
 
         user = authenticate(request, email=email, password=password)
         if user:
-            refresh = RefreshToken.for_user(user)
+            refresh = UserRefreshToken.for_user(user)
             access_token = str(refresh.access_token)
             return Response({
                 "user": {"email": user.email, "name": user.username},
@@ -49,8 +50,10 @@ class LogoutUserView(APIView):
         try:
             refresh_token = request.data.get("refresh")
             if refresh_token:
-                token = RefreshToken(refresh_token)
+                token = UserRefreshToken(refresh_token)
                 token.blacklist()
+            if request.auth is not None:
+                blacklist_token(request.auth)
             return Response({"message": "Successfully logged out."}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -64,8 +67,8 @@ class GetAccessTokenView(APIView):
         if not refresh_token:
             return Response({'error': 'Refresh token is required.'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            refresh = RefreshToken(refresh_token)
-            access_token = str(refresh.access_token)
+            refresh = UserRefreshToken(refresh_token)
+            access_token = str(refresh.fresh_access_token())
             return Response({'access': access_token}, status=status.HTTP_200_OK)
         except TokenError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)